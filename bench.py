@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from manifest import Manifest
+
+
+RESULT_VERSION = 1
+# See `BatchApp` in chaos_runtime.py.
+BATCH_PATH = "/_batch"
+
+
+@dataclass
+class EndpointResult:
+    path: str
+    requests: int
+    errors: int
+    duration: float
+    requests_per_second: float
+    p50: float
+    p95: float
+    p99: float
+
+    @staticmethod
+    def from_latencies(
+        path: str,
+        latencies: list[float],
+        errors: int,
+        duration: float,
+    ) -> EndpointResult:
+        latencies = sorted(latencies)
+        return EndpointResult(
+            path=path,
+            requests=len(latencies),
+            errors=errors,
+            duration=duration,
+            requests_per_second=len(latencies) / duration if duration else 0.0,
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            p99=percentile(latencies, 99),
+        )
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def iter_bench_paths(manifest: Manifest) -> list[str]:
+    paths = []
+    for group in manifest.groups:
+        for endpoint in group.endpoints:
+            for path in endpoint.paths:
+                if path not in paths:
+                    paths.append(path)
+    return paths
+
+
+def build_batch_body(paths: list[str]) -> bytes:
+    return json.dumps([{"path": path} for path in paths]).encode()
+
+
+async def read_response(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by server")
+    _, status, _ = status_line.decode("latin-1").split(" ", 2)
+
+    content_length = 0
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            content_length = int(value.strip())
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+
+    if not chunked:
+        return int(status), await reader.readexactly(content_length)
+
+    body = bytearray()
+    while True:
+        size_line = await reader.readline()
+        size = int(size_line.split(b";", 1)[0].strip(), 16)
+        if size == 0:
+            # Trailers, if any, end with an empty line.
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            return int(status), bytes(body)
+        body += await reader.readexactly(size)
+        await reader.readexactly(2)
+
+
+def build_request(
+    host: str, path: str, method: str = "GET", body: bytes = b""
+) -> bytes:
+    headers = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {host}",
+        "Connection: keep-alive",
+    ]
+    if body or method != "GET":
+        headers.append("Content-Type: application/json")
+        headers.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+
+class LoadGenerator:
+    """\
+    Drives a running HTTP server over a fixed number of keep-alive connections,
+    each of which sends its next request as soon as the previous one has been answered.
+    """
+
+    def __init__(self, host: str, port: int, concurrency: int, duration: float):
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.duration = duration
+
+    async def connection(
+        self,
+        requests: list[bytes],
+        deadline: float,
+        latencies: list[float],
+    ) -> int:
+        """\
+        Sends `requests` one after another (like a page which needs all of them),
+        over and over until `deadline`, and records how long each successful round took.
+        Rounds with an error are only counted as errors, so that fast error responses
+        (like a 503 from an overloaded group) don't make the server look faster.
+        """
+        errors = 0
+        writer: Optional[asyncio.StreamWriter] = None
+        while time.perf_counter() < deadline:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+
+                start = time.perf_counter()
+                failed = False
+                for request in requests:
+                    writer.write(request)
+                    await writer.drain()
+                    status, _ = await read_response(reader)
+                    failed = failed or status >= 400
+                if failed:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                if writer is not None:
+                    writer.close()
+                writer = None
+                await asyncio.sleep(0.01)
+
+        if writer is not None:
+            writer.close()
+        return errors
+
+    async def drive(
+        self,
+        path: str,
+        method: str = "GET",
+        body: bytes = b"",
+    ) -> EndpointResult:
+        request = build_request(f"{self.host}:{self.port}", path, method, body)
+        return await self.drive_requests(path, [request])
+
+    async def drive_page(self, name: str, paths: list[str]) -> EndpointResult:
+        """\
+        Measures fetching every one of `paths` in turn, with a round trip each.
+        """
+        requests = [build_request(f"{self.host}:{self.port}", path) for path in paths]
+        return await self.drive_requests(name, requests)
+
+    async def drive_requests(self, path: str, requests: list[bytes]) -> EndpointResult:
+        latencies: list[float] = []
+
+        start = time.perf_counter()
+        deadline = start + self.duration
+        errors = await asyncio.gather(
+            *(
+                self.connection(requests, deadline, latencies)
+                for _ in range(self.concurrency)
+            )
+        )
+        duration = time.perf_counter() - start
+        return EndpointResult.from_latencies(path, latencies, sum(errors), duration)
+
+
+async def wait_until_ready(host: str, port: int, path: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                writer.write(build_request(f"{host}:{port}", path))
+                await writer.drain()
+                await read_response(reader)
+                return
+            finally:
+                writer.close()
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Server on {host}:{port} did not start in time")
+            await asyncio.sleep(0.25)
+
+
+def results_to_dict(results: list[EndpointResult], settings: dict) -> dict:
+    return {
+        "version": RESULT_VERSION,
+        "settings": settings,
+        "endpoints": {result.path: asdict(result) for result in results},
+    }
+
+
+def load_results(path: Path) -> dict[str, EndpointResult]:
+    raw_results = json.loads(path.read_text())
+    return {
+        endpoint_path: EndpointResult(**raw_result)
+        for endpoint_path, raw_result in raw_results["endpoints"].items()
+    }
+
+
+def compare(
+    results: list[EndpointResult],
+    baseline: dict[str, EndpointResult],
+    threshold: float,
+) -> list[str]:
+    """\
+    Returns a description of each endpoint whose throughput dropped,
+    or whose p99 latency grew, by more than `threshold` (e.g. 0.1 for 10%)
+    relative to `baseline`.
+    """
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.path)
+        if previous is None:
+            continue
+
+        if result.requests_per_second < previous.requests_per_second * (1 - threshold):
+            regressions.append(
+                f"{result.path}: {result.requests_per_second:.1f} req/s, "
+                f"down from {previous.requests_per_second:.1f} req/s"
+            )
+        if result.p99 > previous.p99 * (1 + threshold):
+            regressions.append(
+                f"{result.path}: p99 {result.p99 * 1000:.2f}ms, "
+                f"up from {previous.p99 * 1000:.2f}ms"
+            )
+    return regressions
+
+
+def format_results(results: list[EndpointResult]) -> str:
+    width = max([len("endpoint"), *(len(result.path) for result in results)])
+    lines = [
+        f"{'endpoint':<{width}} {'req/s':>10} {'p50':>9} {'p95':>9} {'p99':>9} "
+        f"{'errors':>7}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result.path:<{width}} {result.requests_per_second:>10.1f} "
+            f"{result.p50 * 1000:>7.2f}ms {result.p95 * 1000:>7.2f}ms "
+            f"{result.p99 * 1000:>7.2f}ms {result.errors:>7}"
+        )
+    return "\n".join(lines)
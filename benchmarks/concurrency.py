@@ -0,0 +1,97 @@
+"""\
+Measures what a group's concurrency limit adds to each request in a generated server,
+when requests are admitted straight away, and when each one waits in the queue.
+
+    python benchmarks/concurrency.py
+"""
+import asyncio
+import importlib.util
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import PYTHON_RUNTIME  # noqa: E402
+
+
+REQUESTS = 200000
+ROUNDS = 5
+# How many requests are sent at once when measuring the queue.
+BURST = 100
+
+
+def load_runtime() -> Any:
+    spec = importlib.util.spec_from_file_location("chaos_runtime", PYTHON_RUNTIME)
+    assert spec is not None and spec.loader is not None
+    runtime = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(runtime)
+    return runtime
+
+
+async def noop(scope: Any, receive: Any, send: Any) -> None:
+    pass
+
+
+async def yielding(scope: Any, receive: Any, send: Any) -> None:
+    # Gives the other requests in the burst a chance to queue up behind this one.
+    await asyncio.sleep(0)
+
+
+async def time_sequential(app: Any) -> float:
+    """\
+    Returns the fastest of `ROUNDS` rounds, per request,
+    so that noise from the rest of the machine only makes things look slower.
+    """
+    fastest = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            await app({}, None, None)
+        fastest = min(fastest, (time.perf_counter() - start) / REQUESTS)
+    return fastest
+
+
+async def time_bursts(app: Any) -> float:
+    fastest = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(REQUESTS // BURST // 10):
+            await asyncio.gather(*(app({}, None, None) for _ in range(BURST)))
+        elapsed = time.perf_counter() - start
+        fastest = min(fastest, elapsed / (REQUESTS // 10))
+    return fastest
+
+
+async def bench(runtime: Any) -> list[tuple[str, float, float]]:
+    admitted = runtime.ConcurrencyLimiter("admitted", max_concurrency=1)
+    queued = runtime.ConcurrencyLimiter("queued", max_concurrency=1, max_queue=BURST)
+    return [
+        (
+            "admitted",
+            await time_sequential(noop),
+            await time_sequential(admitted.wrap(noop)),
+        ),
+        (
+            "queued",
+            await time_bursts(yielding),
+            await time_bursts(queued.wrap(yielding)),
+        ),
+    ]
+
+
+def main() -> None:
+    runtime = load_runtime()
+
+    print(f"{'':>8} {'without':>12} {'with':>12} {'overhead':>12}")
+    for name, without_limit, with_limit in asyncio.run(bench(runtime)):
+        overhead = with_limit - without_limit
+        print(
+            f"{name:>8} {without_limit * 1e6:>10.2f}us {with_limit * 1e6:>10.2f}us "
+            f"{overhead * 1e6:>10.2f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
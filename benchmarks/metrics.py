@@ -0,0 +1,126 @@
+"""\
+Measures what recording metrics adds to each request in a generated server,
+both for a request through a whole app and for the recording wrapper on its own.
+
+    python benchmarks/metrics.py
+"""
+import asyncio
+import importlib.util
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import fastapi
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import PYTHON_RUNTIME  # noqa: E402
+
+
+REQUESTS = 20000
+ROUNDS = 5
+
+
+def load_runtime() -> Any:
+    spec = importlib.util.spec_from_file_location("chaos_runtime", PYTHON_RUNTIME)
+    assert spec is not None and spec.loader is not None
+    runtime = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(runtime)
+    return runtime
+
+
+def make_router() -> fastapi.APIRouter:
+    router = fastapi.APIRouter()
+
+    @router.get("/echo/{content}")
+    async def echo(content: str) -> str:
+        return content
+
+    return router
+
+
+def make_scope(path: str) -> dict[str, Any]:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8080),
+    }
+
+
+async def receive() -> dict[str, Any]:
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message: dict[str, Any]) -> None:
+    pass
+
+
+async def time_requests(app: Any, path: str, requests: int) -> float:
+    """\
+    Returns the fastest of `ROUNDS` rounds, per request,
+    so that noise from the rest of the machine only makes things look slower.
+    """
+    scope = make_scope(path)
+    fastest = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(requests):
+            await app(dict(scope), receive, send)
+        fastest = min(fastest, (time.perf_counter() - start) / requests)
+    return fastest
+
+
+async def bench(runtime: Any) -> list[tuple[str, float, float]]:
+    plain_app = fastapi.FastAPI()
+    plain_app.include_router(make_router())
+
+    metrics = runtime.Metrics()
+    metrics_app = fastapi.FastAPI()
+    runtime.include_router(metrics_app, make_router(), metrics=metrics, group="echo")
+    metrics_app = runtime.MetricsApp(metrics_app, metrics)
+
+    async def noop(scope: Any, receive: Any, send: Any) -> None:
+        pass
+
+    route = metrics_app.app.router.routes[-1]
+    timed_noop = metrics.wrap(noop, "noop", route)
+
+    path = "/echo/content"
+    return [
+        (
+            "app",
+            await time_requests(plain_app, path, REQUESTS),
+            await time_requests(metrics_app, path, REQUESTS),
+        ),
+        (
+            "wrapper",
+            await time_requests(noop, path, REQUESTS * 10),
+            await time_requests(timed_noop, path, REQUESTS * 10),
+        ),
+    ]
+
+
+def main() -> None:
+    runtime = load_runtime()
+
+    print(f"{'':>8} {'without':>12} {'with':>12} {'overhead':>12}")
+    for name, without_metrics, with_metrics in asyncio.run(bench(runtime)):
+        overhead = with_metrics - without_metrics
+        print(
+            f"{name:>8} {without_metrics * 1e6:>10.2f}us {with_metrics * 1e6:>10.2f}us "
+            f"{overhead * 1e6:>10.2f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
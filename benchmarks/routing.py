@@ -0,0 +1,120 @@
+"""\
+Compares the cost of routing a request in a generated server
+as the number of groups grows, for `routing: merged` and `routing: prefix`.
+
+    python benchmarks/routing.py
+"""
+import asyncio
+import importlib.util
+import sys
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+import fastapi
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import PYTHON_RUNTIME  # noqa: E402
+
+
+ROUTES_PER_GROUP = 5
+REQUESTS = 2000
+
+
+def load_runtime() -> Any:
+    spec = importlib.util.spec_from_file_location("chaos_runtime", PYTHON_RUNTIME)
+    assert spec is not None and spec.loader is not None
+    runtime = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(runtime)
+    return runtime
+
+
+def make_group_module(index: int) -> ModuleType:
+    router = fastapi.APIRouter()
+    for route in range(ROUTES_PER_GROUP):
+
+        async def endpoint(content: str) -> str:
+            return content
+
+        router.add_api_route(f"/group{index}/route{route}/{{content}}", endpoint)
+
+    module = ModuleType(f"bench_group{index}")
+    module.router = router  # type: ignore
+    sys.modules[module.__name__] = module
+    return module
+
+
+def make_scope(path: str) -> dict[str, Any]:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8080),
+    }
+
+
+async def time_requests(app: Any, path: str) -> float:
+    scope = make_scope(path)
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict[str, Any]) -> None:
+        pass
+
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / REQUESTS
+
+
+async def bench(runtime: Any, group_count: int) -> tuple[float, float]:
+    modules = [make_group_module(index) for index in range(group_count)]
+
+    merged = fastapi.FastAPI()
+    for module in modules:
+        merged.include_router(module.router)
+
+    dispatcher = runtime.PrefixDispatcher(
+        fastapi.FastAPI(),
+        [
+            runtime.Group(f"group{index}", module.__name__, lazy=False)
+            for index, module in enumerate(modules)
+        ],
+        trie=(
+            None,
+            {f"group{index}": (index, {}) for index in range(group_count)},
+        ),
+    )
+    await dispatcher.app.router.startup()
+
+    # The last route of the last group is the worst case for linear matching.
+    path = f"/group{group_count - 1}/route{ROUTES_PER_GROUP - 1}/content"
+    return await time_requests(merged, path), await time_requests(dispatcher, path)
+
+
+def main() -> None:
+    runtime = load_runtime()
+    runtime.logger.disabled = True
+
+    print(f"{'groups':>8} {'routes':>8} {'merged':>12} {'prefix':>12}")
+    for group_count in (1, 10, 100, 1000):
+        merged, prefix = asyncio.run(bench(runtime, group_count))
+        print(
+            f"{group_count:>8} {group_count * ROUTES_PER_GROUP:>8} "
+            f"{merged * 1e6:>10.1f}us {prefix * 1e6:>10.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
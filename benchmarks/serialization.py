@@ -0,0 +1,116 @@
+"""\
+Compares the cost of a request to a generated server which returns JSON,
+for each `serializer` in the manifest.
+
+    python benchmarks/serialization.py
+"""
+import asyncio
+import importlib.util
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import fastapi
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import PYTHON_RUNTIME  # noqa: E402
+from manifest import SERIALIZERS  # noqa: E402
+
+
+# Larger payloads take longer to encode, so fewer requests are timed for them.
+REQUESTS = 20000
+ROUNDS = 3
+
+
+def load_runtime() -> Any:
+    spec = importlib.util.spec_from_file_location("chaos_runtime", PYTHON_RUNTIME)
+    assert spec is not None and spec.loader is not None
+    runtime = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(runtime)
+    return runtime
+
+
+def make_router(items: int) -> fastapi.APIRouter:
+    router = fastapi.APIRouter()
+    payload = [
+        {
+            "id": index,
+            "name": f"item {index}",
+            "price": index * 1.25,
+            "tags": ["a", "b", "c"],
+            "available": index % 2 == 0,
+        }
+        for index in range(items)
+    ]
+
+    @router.get("/items")
+    async def list_items() -> list[dict[str, Any]]:
+        return payload
+
+    return router
+
+
+def make_scope(path: str) -> dict[str, Any]:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8080),
+    }
+
+
+async def time_requests(app: Any, path: str, requests: int) -> float:
+    scope = make_scope(path)
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict[str, Any]) -> None:
+        pass
+
+    fastest = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(requests):
+            await app(dict(scope), receive, send)
+        fastest = min(fastest, (time.perf_counter() - start) / requests)
+    return fastest
+
+
+async def bench(runtime: Any, items: int) -> list[float]:
+    timings = []
+    for serializer in SERIALIZERS:
+        app = fastapi.FastAPI()
+        runtime.include_router(
+            app,
+            make_router(items),
+            default_response_class=runtime.response_class(serializer),
+        )
+        requests = max(REQUESTS // (items + 10), 10)
+        timings.append(await time_requests(app, "/items", requests))
+    return timings
+
+
+def main() -> None:
+    runtime = load_runtime()
+
+    print(f"{'items':>8}" + "".join(f" {serializer:>12}" for serializer in SERIALIZERS))
+    for items in (1, 10, 100, 1000):
+        timings = asyncio.run(bench(runtime, items))
+        print(
+            f"{items:>8}" + "".join(f" {timing * 1e6:>10.1f}us" for timing in timings)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,204 @@
+import json
+import logging
 import textwrap
 from collections import defaultdict
+from dataclasses import dataclass
+from dataclasses import field
 from pathlib import Path
+from typing import Optional
 
+import profiling
+from buildgen.common import group_package
+from buildgen.common import Repository
 from buildgen.python import PythonBuildGenerator
+from config import TEMPLATE_CACHE_DIRECTORY
+from manifest import Group
 from manifest import Language
 from manifest import Manifest
+from outputs import OutputDirectory
 
 
+logger = logging.getLogger(__name__)
+
 HTTP_ARCHIVE = """\
 load("@bazel_tools//tools/build_defs/repo:http.bzl", "http_archive")
 """
 
+SHARED_REPOSITORY = Repository(
+    name="chaos_shared",
+    requirements_file="chaos_shared_requirements.txt",
+)
+
 LANGUAGE_TO_GENERATOR = {
-    "python": PythonBuildGenerator(),
+    "python": PythonBuildGenerator(
+        cache_directory=TEMPLATE_CACHE_DIRECTORY / "python",
+    ),
 }
 
 
-def generate_workspace(language: Language, manifest: Manifest) -> str:
+@dataclass(frozen=True)
+class BuildOptions:
+    # Put every group's dependencies in one repository, if their pins are compatible.
+    shared_dependencies: bool = False
+    # Define each group's target in the BUILD file of the group's own directory,
+    # so that changing one group only invalidates that package.
+    group_packages: bool = False
+
+
+@dataclass
+class RepositoryPlan:
+    # Maps each group's name onto the repository that provides its dependencies.
+    repositories: dict[str, Repository]
+    # Lockfiles which don't exist in the source tree, and have to be generated.
+    generated_files: dict[Path, str] = field(default_factory=dict)
+
+    def unique_repositories(self) -> list[Repository]:
+        return list(dict.fromkeys(self.repositories.values()))
+
+
+def plan_repositories(
+    language: Language,
+    manifest: Manifest,
+    options: BuildOptions = BuildOptions(),
+) -> RepositoryPlan:
     generator = LANGUAGE_TO_GENERATOR[language.id]
 
+    if options.shared_dependencies and manifest.groups:
+        requirements_files = list(
+            dict.fromkeys(group.dependencies for group in manifest.groups)
+        )
+        merged_requirements = generator.merge_requirements(requirements_files)
+        if merged_requirements is not None:
+            return RepositoryPlan(
+                repositories={
+                    group.name: SHARED_REPOSITORY for group in manifest.groups
+                },
+                generated_files={
+                    Path(SHARED_REPOSITORY.requirements_file): merged_requirements,
+                },
+            )
+        logger.warning(
+            "Dependencies of groups are not compatible, so they can't be shared. "
+            "Falling back to one repository per distinct lockfile."
+        )
+
+    # The first group with a given lockfile owns the repository for it,
+    # and every later group with the same lockfile content reuses it.
+    repositories_by_digest: dict[str, Repository] = {}
+    repositories: dict[str, Repository] = {}
+    for group in manifest.groups:
+        digest = generator.requirements_digest(group.dependencies)
+        if digest not in repositories_by_digest:
+            repositories_by_digest[digest] = Repository(
+                name=group.name,
+                requirements_file=group.dependencies,
+            )
+        repositories[group.name] = repositories_by_digest[digest]
+    return RepositoryPlan(repositories=repositories)
+
+
+def generate_workspace(
+    language: Language,
+    manifest: Manifest,
+    plan: Optional[RepositoryPlan] = None,
+) -> str:
+    generator = LANGUAGE_TO_GENERATOR[language.id]
+    if plan is None:
+        plan = plan_repositories(language, manifest)
+
     sections = [
         HTTP_ARCHIVE,
         generator.generate_toolchain(language),
     ]
-    for group in manifest.groups:
-        sections.append(generator.generate_target_deps(group))
+    for repository in plan.unique_repositories():
+        sections.append(generator.generate_target_deps(repository))
 
     return "\n".join(sections)
 
 
-def generate_root_build(language: Language, manifest: Manifest) -> str:
+def generate_targets(
+    language: Language,
+    groups: list[Group],
+    plan: RepositoryPlan,
+    group_packages: bool = False,
+) -> list[str]:
     generator = LANGUAGE_TO_GENERATOR[language.id]
 
+    targets = []
+    for group in groups:
+        # Named after the group, so that slow groups stand out in the summary.
+        with profiling.span(f"render target {group.name}", "group"):
+            targets.append(
+                generator.generate_target(
+                    group, plan.repositories[group.name], group_packages
+                )
+            )
+    return targets
+
+
+def generate_root_build(
+    language: Language,
+    manifest: Manifest,
+    plan: Optional[RepositoryPlan] = None,
+    options: BuildOptions = BuildOptions(),
+) -> str:
+    generator = LANGUAGE_TO_GENERATOR[language.id]
+    if plan is None:
+        plan = plan_repositories(language, manifest, options)
+
+    root_groups = manifest.groups
+    if options.group_packages:
+        root_groups = [group for group in root_groups if not group_package(group)]
+
     sections = [generator.generate_build_rules()]
-    for group in manifest.groups:
-        sections.append(generator.generate_target(group))
-    sections.append(generator.generate_server_target(manifest.groups))
+    sections.extend(
+        generate_targets(language, root_groups, plan, options.group_packages)
+    )
+    sections.append(
+        generator.generate_server_target(
+            manifest.groups, manifest.server, options.group_packages
+        )
+    )
+    for named_server in manifest.servers:
+        sections.append(
+            generator.generate_server_target(
+                manifest.server_groups(named_server),
+                named_server.server,
+                options.group_packages,
+                name=named_server.target,
+            )
+        )
 
     return "\n".join(sections)
 
 
+def generate_group_builds(
+    language: Language,
+    manifest: Manifest,
+    plan: Optional[RepositoryPlan] = None,
+) -> dict[Path, str]:
+    """\
+    Generates the targets for every group outside of the root directory,
+    in a BUILD file for each directory with groups in it.
+    """
+    generator = LANGUAGE_TO_GENERATOR[language.id]
+    if plan is None:
+        plan = plan_repositories(language, manifest)
+
+    package_groups: dict[Path, list[Group]] = defaultdict(list)
+    for group in manifest.groups:
+        package = group_package(group)
+        if package:
+            package_groups[Path(package)].append(group)
+
+    build_files: dict[Path, str] = {}
+    for path, groups in package_groups.items():
+        sections = [generator.generate_build_rules()]
+        sections.extend(generate_targets(language, groups, plan, group_packages=True))
+        build_files[path] = "\n".join(sections)
+    return build_files
+
+
 def generate_export_builds(manifest: Manifest) -> dict[Path, str]:
     filename_groups: dict[Path, set[str]] = defaultdict(set)
     for path in manifest.iter_files():
@@ -62,15 +221,77 @@ def generate_export_builds(manifest: Manifest) -> dict[Path, str]:
     return build_files
 
 
-def generate_build(target_dir: Path, language: Language, manifest: Manifest) -> None:
-    (target_dir / "WORKSPACE").write_text(generate_workspace(language, manifest))
-    (target_dir / "BUILD").write_text(generate_root_build(language, manifest))
+def generate_router_config(manifest: Manifest) -> str:
+    """\
+    Maps each path prefix onto the server which serves it, longest prefix first,
+    for a local router in front of the servers declared under `servers:`.
+    Groups without prefixes can't be routed to, so they aren't listed.
+    """
+    servers = {}
+    routes = []
+    for named_server in manifest.servers:
+        server = named_server.server
+        servers[named_server.name] = {
+            "target": named_server.target,
+            "address": f"{server.host}:{server.port}",
+        }
+        for group in manifest.server_groups(named_server):
+            for prefix in group.prefixes:
+                routes.append(
+                    {"prefix": prefix, "server": named_server.name, "group": group.name}
+                )
+    routes.sort(key=lambda route: len(route["prefix"].rstrip("/")), reverse=True)
+    return json.dumps({"servers": servers, "routes": routes}, indent=2) + "\n"
+
 
-    for path, contents in generate_export_builds(manifest).items():
-        (target_dir / path).mkdir(parents=True, exist_ok=True)
-        (target_dir / path / "BUILD").write_text(contents)
+def generate_build(
+    output: OutputDirectory,
+    language: Language,
+    manifest: Manifest,
+    options: BuildOptions = BuildOptions(),
+) -> None:
+    with profiling.span("plan repositories"):
+        plan = plan_repositories(language, manifest, options)
+    with profiling.span("generate WORKSPACE"):
+        output.write_text(
+            Path("WORKSPACE"), generate_workspace(language, manifest, plan)
+        )
+    with profiling.span("generate BUILD"):
+        output.write_text(
+            Path("BUILD"), generate_root_build(language, manifest, plan, options)
+        )
+    for path, contents in plan.generated_files.items():
+        output.write_text(path, contents)
+
+    with profiling.span("generate export BUILDs"):
+        build_files = generate_export_builds(manifest)
+    if options.group_packages:
+        with profiling.span("generate group BUILDs"):
+            group_builds = generate_group_builds(language, manifest, plan)
+            for path, contents in group_builds.items():
+                # Every group's directory already exports the group's files.
+                # The exports go last, so that the BUILD file's loads come first.
+                build_files[path] = "\n".join([contents, build_files[path]])
+    for path, contents in build_files.items():
+        output.write_text(path / "BUILD", contents)
 
     generator = LANGUAGE_TO_GENERATOR[language.id]
-    (target_dir / f"server.{language.file_suffix}").write_text(
-        generator.generate_server(manifest.groups)
-    )
+    with profiling.span("generate server"):
+        output.write_text(
+            Path(f"server.{language.file_suffix}"),
+            generator.generate_server(manifest.groups, manifest.server),
+        )
+    for named_server in manifest.servers:
+        with profiling.span(f"generate server {named_server.name}"):
+            output.write_text(
+                Path(f"{named_server.target}.{language.file_suffix}"),
+                generator.generate_server(
+                    manifest.server_groups(named_server),
+                    named_server.server,
+                    name=named_server.target,
+                ),
+            )
+    if manifest.servers:
+        output.write_text(Path("router.json"), generate_router_config(manifest))
+    for path, contents in generator.generate_support_files().items():
+        output.write_text(path, contents)
@@ -2,9 +2,13 @@ from __future__ import annotations
 
 from abc import ABC
 from abc import abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
 
 from manifest import Group
 from manifest import Language
+from manifest import ServerConfig
 
 
 HTTP_ARCHIVE = """\
@@ -19,6 +23,34 @@ def filename_as_target(filename: str) -> str:
     return f"//{directory}:{filename}"
 
 
+def group_package(group: Group) -> str:
+    directory, _, _ = group.filename.rpartition("/")
+    return directory
+
+
+def group_label(group: Group, group_packages: bool = False) -> str:
+    """\
+    The label of a group's target, as seen from the root package.
+    With `group_packages`, groups outside of the root directory
+    are defined in the package for their own directory.
+    """
+    package = group_package(group)
+    if group_packages and package:
+        return f"//{package}:{group.name}"
+    return f":{group.name}"
+
+
+@dataclass(frozen=True)
+class Repository:
+    """\
+    A repository of third party dependencies, e.g. a `pip_parse` repository.
+    Groups whose lockfiles have the same content share a single repository.
+    """
+
+    name: str
+    requirements_file: str
+
+
 class BuildGenerator(ABC):
     @abstractmethod
     def generate_toolchain(self, language: Language) -> str:
@@ -30,9 +62,25 @@ class BuildGenerator(ABC):
         pass
 
     @abstractmethod
-    def generate_target_deps(self, group: Group) -> str:
+    def requirements_digest(self, requirements_file: str) -> str:
+        """\
+        Identifies the content of a lockfile,
+        so that groups with identical lockfiles can share a repository.
+        """
+        pass
+
+    @abstractmethod
+    def merge_requirements(self, requirements_files: list[str]) -> Optional[str]:
+        """\
+        Produces a single lockfile which satisfies every one of `requirements_files`,
+        or `None` if their pins are not compatible with one another.
+        """
+        pass
+
+    @abstractmethod
+    def generate_target_deps(self, repository: Repository) -> str:
         """\
-        Loads the dependencies for a particular target.
+        Loads the dependencies for a repository used by one or more targets.
         E.g. `pip_parse` and `install_deps` for a Python dependency.
         """
         pass
@@ -47,28 +95,55 @@ class BuildGenerator(ABC):
         pass
 
     @abstractmethod
-    def generate_target(self, group: Group) -> str:
+    def generate_target(
+        self,
+        group: Group,
+        repository: Repository,
+        group_packages: bool = False,
+    ) -> str:
         """\
         Generates the target for a particular endpoint group.
         E.g. for Python this is a `py_library` where its deps
-        are the set of deps produced by `generate_target_deps`.
+        are taken from the repository produced by `generate_target_deps`.
+        With `group_packages`, the target is defined in its group's own package,
+        and has to be visible to the server in the root package.
         """
         pass
 
     @abstractmethod
-    def generate_server_target(self, groups: list[Group]) -> str:
+    def generate_server_target(
+        self,
+        groups: list[Group],
+        server: ServerConfig,
+        group_packages: bool = False,
+        name: str = "server",
+    ) -> str:
         """\
-        Generates the server for a particular language and set of deps.
+        Generates the server target called `name` for a particular language and set of deps.
         This has a set of deps necessary for running the server,
-        and then depends on each of the targets generated by `generate_target`.
+        which follow from the server's configuration,
+        and then depends on each of the targets generated by `generate_target`
+        (see `group_label`).
         """
         pass
 
     @abstractmethod
-    def generate_server(self, groups: list[Group]) -> str:
+    def generate_server(
+        self, groups: list[Group], server: ServerConfig, name: str = "server"
+    ) -> str:
         """\
         Generates the actual server implementation for a language and a set of deps.
         E.g. for Python: an ASGI application that composes all of the endpoints,
-        along with an invocation of the ASGI server.
+        along with an invocation of the ASGI server configured by `server`.
+        `name` is the name of the server's target (and so of its entry point).
+        """
+        pass
+
+    @abstractmethod
+    def generate_support_files(self) -> dict[Path, str]:
+        """\
+        Generates the files which the server implementation depends on,
+        beyond the endpoints themselves. E.g. for Python: a runtime library
+        which is imported by the generated server.
         """
         pass
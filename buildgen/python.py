@@ -1,46 +1,204 @@
 from __future__ import annotations
 
+import hashlib
+import json
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
+from jinja2 import BytecodeCache
 from jinja2 import Environment
+from jinja2 import FileSystemBytecodeCache
 from jinja2 import FileSystemLoader
 from packaging.requirements import Requirement
+from packaging.utils import canonicalize_name
 
+import profiling
 from buildgen.common import BuildGenerator
 from buildgen.common import filename_as_target
+from buildgen.common import group_label
+from buildgen.common import Repository
+from config import PYTHON_RUNTIME
 from config import TEMPLATES_DIRECTORY
 from manifest import Group
 from manifest import Language
+from manifest import ServerConfig
 
 
 # TODO: `server` is essentially a reserved keyword in this setup,
 # but that's not articulated anywhere in the manifest load / validation
 
 
-def load_requirements(requirements_txt: str) -> list[str]:
-    requirements_path = Path(requirements_txt)
-    if not requirements_path.is_absolute():
-        requirements_path = Path.cwd() / requirements_path
+def parse_requirements(contents: str) -> list[Requirement]:
+    """\
+    Parses the contents of a requirements file, as produced by e.g. `pip freeze`
+    or `pip-compile`. Options (like `--hash` or `--index-url`) are ignored.
+    """
+    # Join continued lines before anything else,
+    # so that `--hash` options on their own lines are attached to their requirement.
+    contents = contents.replace("\\\n", " ")
 
     requirements = []
-    for line in requirements_path.read_text().splitlines():
+    for line in contents.splitlines():
+        line, _, _ = line.partition(" #")
         line = line.strip()
-        if line.startswith("#"):
+        if not line or line.startswith("#") or line.startswith("-"):
             continue
 
-        requirement = Requirement(line)
-        requirements.append(requirement.name)
+        line, _, _ = line.partition(" --")
+        requirements.append(Requirement(line.strip()))
     return requirements
 
 
+@dataclass(frozen=True)
+class RequirementsFile:
+    path: Path
+    digest: str
+    requirements: list[Requirement]
+
+    @property
+    def names(self) -> list[str]:
+        return [requirement.name for requirement in self.requirements]
+
+
+def python_literal(value: object) -> str:
+    if isinstance(value, str):
+        # Prefer double quotes, to match the rest of the generated code.
+        return json.dumps(value)
+    if isinstance(value, list):
+        return "[" + ", ".join(python_literal(item) for item in value) + "]"
+    return repr(value)
+
+
+def group_module(group: Group) -> str:
+    """\
+    The dotted name of a group's module, e.g. `groups.echo` for `groups/echo.py`.
+    """
+    dirname, _, filename = group.filename.rpartition("/")
+    filename, _, _ = filename.rpartition(".")
+    return f"{dirname.replace('/', '.')}.{filename}"
+
+
+def limiter_variable(group: Group) -> Optional[str]:
+    """\
+    The variable holding a group's concurrency limiter in `server.py`, if it has one.
+    """
+    if group.max_concurrency is None:
+        return None
+    return f"{group.name}_limiter"
+
+
+def threadpool_variable(group: Group) -> Optional[str]:
+    """\
+    The variable holding a group's threadpool in `server.py`, if it has its own.
+    """
+    if group.threadpool_size is None:
+        return None
+    return f"{group.name}_threadpool"
+
+
+# See `TrieNode` in chaos_runtime.py.
+TrieNode = tuple[Optional[int], dict[str, "TrieNode"]]
+
+
+def build_prefix_trie(prefixes: list[list[str]]) -> TrieNode:
+    """\
+    Builds a trie of path segments, where `prefixes[i]` are the prefixes owned by group `i`.
+    """
+    root: TrieNode = (None, {})
+    for index, group_prefixes in enumerate(prefixes):
+        for prefix in group_prefixes:
+            parent: Optional[TrieNode] = None
+            node = root
+            segment = ""
+            for segment in prefix.split("/"):
+                if not segment:
+                    continue
+                parent = node
+                node = node[1].setdefault(segment, (None, {}))
+
+            if node[0] is not None and node[0] != index:
+                raise ValueError(f"Prefix `{prefix}` belongs to more than one group")
+            if parent is None:
+                root = (index, root[1])
+            else:
+                parent[1][segment] = (index, node[1])
+    return root
+
+
+def render_trie(node: TrieNode, indent: int = 0) -> str:
+    owner, children = node
+    if not children:
+        return f"({python_literal(owner)}, {{}})"
+
+    padding = " " * indent
+    lines = [f"({python_literal(owner)}, {{"]
+    for segment, child in sorted(children.items()):
+        rendered_child = render_trie(child, indent + 4)
+        lines.append(f"{padding}    {python_literal(segment)}: {rendered_child},")
+    lines.append(f"{padding}}})")
+    return "\n".join(lines)
+
+
+class RequirementsIndex:
+    """\
+    Parses each requirements file at most once, no matter how many groups,
+    targets, or servers refer to it.
+    Entries are keyed by resolved path, and are reparsed if the file's mtime or size changes.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[Path, tuple[tuple[int, int], RequirementsFile]] = {}
+
+    def load(self, requirements_txt: str) -> RequirementsFile:
+        requirements_path = Path(requirements_txt)
+        if not requirements_path.is_absolute():
+            requirements_path = Path.cwd() / requirements_path
+        requirements_path = requirements_path.resolve()
+
+        stat = requirements_path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(requirements_path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        with profiling.span("load requirements", path=requirements_txt):
+            raw_contents = requirements_path.read_bytes()
+            requirements_file = RequirementsFile(
+                path=requirements_path,
+                digest=hashlib.sha256(raw_contents).hexdigest(),
+                requirements=parse_requirements(raw_contents.decode()),
+            )
+        self._entries[requirements_path] = (key, requirements_file)
+        return requirements_file
+
+
+def make_bytecode_cache(cache_directory: Optional[Path]) -> Optional[BytecodeCache]:
+    """\
+    Compiled templates are cached on disk, keyed by template name,
+    and validated against a checksum of the template source.
+    The cache files are replaced atomically, so they can be shared between processes.
+    """
+    if cache_directory is None:
+        return None
+    try:
+        cache_directory.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        # An unwritable cache shouldn't stop us from generating anything.
+        return None
+    return FileSystemBytecodeCache(str(cache_directory))
+
+
 class PythonBuildGenerator(BuildGenerator):
-    def __init__(self):
+    def __init__(self, cache_directory: Optional[Path] = None):
         self.env = Environment(
             loader=FileSystemLoader(TEMPLATES_DIRECTORY / "python"),
+            bytecode_cache=make_bytecode_cache(cache_directory),
             keep_trailing_newline=True,
             trim_blocks=True,
             lstrip_blocks=True,
         )
+        self.requirements = RequirementsIndex()
 
     def generate_toolchain(self, language: Language) -> str:
         template = self.env.get_template("toolchain.jinja2.WORKSPACE")
@@ -48,35 +206,273 @@ class PythonBuildGenerator(BuildGenerator):
             python_version=language.formatted_version(),
         )
 
-    def generate_target_deps(self, group: Group) -> str:
+    def requirements_digest(self, requirements_file: str) -> str:
+        return self.requirements.load(requirements_file).digest
+
+    def merge_requirements(self, requirements_files: list[str]) -> Optional[str]:
+        merged: dict[str, Requirement] = {}
+        for requirements_file in requirements_files:
+            for requirement in self.requirements.load(requirements_file).requirements:
+                name = canonicalize_name(requirement.name)
+                existing = merged.get(name)
+                if existing is None:
+                    merged[name] = Requirement(str(requirement))
+                    continue
+
+                if (
+                    existing.specifier != requirement.specifier
+                    or str(existing.marker) != str(requirement.marker)
+                    or existing.url != requirement.url
+                ):
+                    return None
+                existing.extras |= requirement.extras
+
+        lines = [str(merged[name]) for name in sorted(merged)]
+        return "".join(f"{line}\n" for line in lines)
+
+    def generate_target_deps(self, repository: Repository) -> str:
         template = self.env.get_template("target_deps.jinja2.WORKSPACE")
         return template.render(
-            group_name=group.name,
-            requirements_file_target=filename_as_target(group.dependencies),
+            repository_name=repository.name,
+            requirements_file_target=filename_as_target(repository.requirements_file),
         )
 
     def generate_build_rules(self) -> str:
         return self.env.get_template("build_rules.jinja2.BUILD").render()
 
-    def generate_target(self, group: Group) -> str:
+    def generate_target(
+        self,
+        group: Group,
+        repository: Repository,
+        group_packages: bool = False,
+    ) -> str:
         template = self.env.get_template("target.jinja2.BUILD")
         return template.render(
             group_name=group.name,
+            repository_name=repository.name,
             group_target=filename_as_target(group.filename),
-            requirements=load_requirements(group.dependencies),
+            requirements=self.requirements.load(group.dependencies).names,
+            visibility=["//:__pkg__"] if group_packages else [],
         )
 
-    def generate_server_target(self, groups: list[Group]) -> str:
+    def server_requirements(
+        self, server: ServerConfig, groups: Optional[list[Group]] = None
+    ) -> list[str]:
+        # uvicorn uses uvloop and httptools whenever they're installed,
+        # so they have to be left out to use anything else.
+        excluded = set()
+        if server.loop == "asyncio":
+            excluded.add("uvloop")
+        if server.http == "h11":
+            excluded.add("httptools")
+        # orjson is pinned in requirements.txt too, but only servers which use it depend on it.
+        serializers = {server.serializer}
+        serializers.update(
+            group.serializer for group in groups or [] if group.serializer
+        )
+        if "orjson" not in serializers:
+            excluded.add("orjson")
+
+        requirements = [
+            name
+            for name in self.requirements.load("requirements.txt").names
+            if canonicalize_name(name) not in excluded
+        ]
+        canonical_requirements = {canonicalize_name(name) for name in requirements}
+        for implementation in (server.loop, server.http):
+            if implementation in ("uvloop", "httptools"):
+                if implementation not in canonical_requirements:
+                    requirements.append(implementation)
+
+        if "orjson" in serializers and "orjson" not in canonical_requirements:
+            requirements.append("orjson")
+        return requirements
+
+    def generate_server_target(
+        self,
+        groups: list[Group],
+        server: ServerConfig,
+        group_packages: bool = False,
+        name: str = "server",
+    ) -> str:
         template = self.env.get_template("server_target.jinja2.BUILD")
         return template.render(
-            groups=[group.name for group in groups],
-            requirements=load_requirements("requirements.txt"),
+            name=name,
+            srcs=[
+                f"{name}.py",
+                *(path.as_posix() for path in self.generate_support_files()),
+            ],
+            group_labels=[group_label(group, group_packages) for group in groups],
+            requirements=self.server_requirements(server, groups),
         )
 
-    def generate_server(self, groups: list[Group]) -> str:
+    def generate_server_options(self, server: ServerConfig) -> list[tuple[str, str]]:
+        """\
+        Renders the keyword arguments for `uvicorn.run` as Python source.
+        """
+        workers = "os.cpu_count() or 1"
+        if server.workers is not None:
+            workers = python_literal(server.workers)
+
+        return [
+            ("host", python_literal(server.host)),
+            ("port", python_literal(server.port)),
+            ("log_level", python_literal(server.log_level)),
+            ("workers", workers),
+            ("loop", python_literal(server.loop)),
+            ("http", python_literal(server.http)),
+            ("backlog", python_literal(server.backlog)),
+            ("timeout_keep_alive", python_literal(server.timeout_keep_alive)),
+            ("limit_concurrency", python_literal(server.limit_concurrency)),
+        ]
+
+    def generate_routers(self, group: Group) -> list[tuple[str, Optional[str]]]:
+        """\
+        Lists the router of each of the group's endpoints,
+        along with the argument which passes it its response cache (if it has one).
+        Groups without endpoints serve the router called `router`.
+        """
+        if not group.endpoints:
+            return [("router", None)]
+        # Isolated groups are only served by their workers,
+        # so they're passed the arguments to build their caches with instead.
+        keyword = "worker_cache" if group.isolation == "process" else "cache"
+        return [
+            (
+                endpoint.name,
+                f"{keyword}={group.name}_{endpoint.name}_cache"
+                if endpoint.cache
+                else None,
+            )
+            for endpoint in group.endpoints
+        ]
+
+    def generate_response_caches(
+        self, groups: list[Group]
+    ) -> list[tuple[str, str, list[tuple[str, str]]]]:
+        """\
+        Renders the arguments to construct the response cache of each endpoint
+        which has one, along with the variable which holds it,
+        and what it's constructed with.
+        The caches of isolated groups are built by their workers,
+        so the server only holds the arguments to build them with.
+        """
+        caches = []
+        for group in groups:
+            for endpoint in group.endpoints:
+                if endpoint.cache is None:
+                    continue
+                caches.append(
+                    (
+                        f"{group.name}_{endpoint.name}_cache",
+                        "dict"
+                        if group.isolation == "process"
+                        else "chaos_runtime.ResponseCache",
+                        [
+                            ("name", python_literal(f"{group.name}.{endpoint.name}")),
+                            ("ttl", python_literal(endpoint.cache.ttl)),
+                            ("max_entries", python_literal(endpoint.cache.max_entries)),
+                            ("vary_on", python_literal(endpoint.cache.vary_on)),
+                        ],
+                    )
+                )
+        return caches
+
+    def generate_concurrency_limiters(
+        self, groups: list[Group]
+    ) -> list[tuple[str, list[tuple[str, str]]]]:
+        """\
+        Renders the arguments to construct the concurrency limiter of each group
+        which has one, along with the variable which holds it.
+        """
+        return [
+            (
+                f"{group.name}_limiter",
+                [
+                    ("name", python_literal(group.name)),
+                    ("max_concurrency", python_literal(group.max_concurrency)),
+                    ("max_queue", python_literal(group.max_queue)),
+                ],
+            )
+            for group in groups
+            if group.max_concurrency is not None
+        ]
+
+    def generate_threadpools(
+        self, groups: list[Group]
+    ) -> list[tuple[str, list[tuple[str, str]]]]:
+        """\
+        Renders the arguments to construct the threadpool of each group
+        which has its own, along with the variable which holds it.
+        """
+        return [
+            (
+                f"{group.name}_threadpool",
+                [
+                    ("name", python_literal(group.name)),
+                    ("size", python_literal(group.threadpool_size)),
+                ],
+            )
+            for group in groups
+            if group.threadpool_size is not None
+        ]
+
+    def generate_group_serializer(
+        self, group: Group, server: ServerConfig
+    ) -> Optional[str]:
+        """\
+        Renders the serializer for a group's routers, unless neither the server
+        nor the group changes it. It's passed on even if the group doesn't override
+        the server's serializer, so that `chaos_runtime` can encode responses
+        directly, and because groups which are served from their own app
+        don't inherit the server's response class.
+        """
+        serializer = group.serializer or server.serializer
+        if serializer == "json" and server.serializer == "json":
+            return None
+        return python_literal(serializer)
+
+    def generate_warmups(
+        self, groups: list[Group], server: ServerConfig
+    ) -> list[list[str]]:
+        """\
+        Renders the arguments to construct the warm-up of each group
+        which is warmed up, either by its own `warmup` or by the server's.
+        Isolated groups call their hook in their workers (see `Group.warmup_hook`),
+        so it isn't passed on here.
+        """
+        warmups = []
+        for group in groups:
+            warmup = group.warmup or server.warmup
+            if warmup is None:
+                continue
+            arguments = [
+                python_literal(group.name),
+                python_literal(group_module(group)),
+            ]
+            paths = [path for endpoint in group.endpoints for path in endpoint.paths]
+            if paths and warmup.requests:
+                arguments.append(f"paths={python_literal(paths)}")
+                if warmup.requests != 1:
+                    arguments.append(f"requests={python_literal(warmup.requests)}")
+            if warmup.hook is not None and group.isolation != "process":
+                arguments.append(f"hook={python_literal(warmup.hook)}")
+            warmups.append(arguments)
+        return warmups
+
+    def generate_warmup_hook(self, group: Group, server: ServerConfig) -> Optional[str]:
+        warmup = group.warmup or server.warmup
+        if group.isolation != "process" or warmup is None or warmup.hook is None:
+            return None
+        return python_literal(warmup.hook)
+
+    def generate_server(
+        self, groups: list[Group], server: ServerConfig, name: str = "server"
+    ) -> str:
         template = self.env.get_template("server.jinja2")
 
         targets = []
+        routed_groups = []
         for group in groups:
             dirname, _, filename = group.filename.rpartition("/")
             filename, _, _ = filename.rpartition(".")
@@ -85,8 +481,93 @@ class PythonBuildGenerator(BuildGenerator):
             fully_qualified_name = dirname.replace("/", "_")
             fully_qualified_name = f"{fully_qualified_name}_{filename}"
 
-            targets.append((dot_directory, filename, fully_qualified_name))
+            # Groups can only be imported lazily, dispatched to by prefix,
+            # or run in their own processes if we know which requests they serve.
+            if group.prefixes and (
+                server.lazy_imports
+                or server.routing == "prefix"
+                or group.isolation == "process"
+            ):
+                routed_groups.append((group, group_module(group)))
+            else:
+                targets.append(
+                    (
+                        python_literal(group.name),
+                        dot_directory,
+                        filename,
+                        fully_qualified_name,
+                        self.generate_routers(group),
+                        self.generate_group_serializer(group, server),
+                        limiter_variable(group),
+                        threadpool_variable(group),
+                    )
+                )
 
+        group_loader = "LazyGroups"
+        if server.routing == "prefix":
+            group_loader = "PrefixDispatcher"
+        trie = build_prefix_trie([group.prefixes for group, _ in routed_groups])
+
+        response_caches = self.generate_response_caches(groups)
+        warmups = self.generate_warmups(groups, server)
+        concurrency_limiters = self.generate_concurrency_limiters(groups)
+        threadpools = self.generate_threadpools(groups)
+        server_options = self.generate_server_options(server)
+        uses_serializers = server.serializer != "json" or any(
+            group.serializer not in (None, "json") for group in groups
+        )
         return template.render(
             targets=targets,
+            uses_runtime=bool(
+                routed_groups
+                or response_caches
+                or server.metrics
+                or uses_serializers
+                or warmups
+                or concurrency_limiters
+                or threadpools
+                or server.batch
+            ),
+            metrics=server.metrics,
+            server_serializer=python_literal(server.serializer)
+            if server.serializer != "json"
+            else None,
+            response_caches=response_caches,
+            concurrency_limiters=concurrency_limiters,
+            threadpools=threadpools,
+            group_loader=group_loader,
+            routed_groups=[
+                (
+                    python_literal(group.name),
+                    python_literal(module),
+                    python_literal(server.lazy_imports),
+                    self.generate_routers(group),
+                    python_literal(group.workers)
+                    if group.isolation == "process"
+                    else None,
+                    self.generate_group_serializer(group, server),
+                    self.generate_warmup_hook(group, server),
+                    limiter_variable(group),
+                    threadpool_variable(group),
+                )
+                for group, module in routed_groups
+            ],
+            warmups=warmups,
+            batch=[
+                ("max_requests", python_literal(server.batch.max_requests)),
+                ("timeout", python_literal(server.batch.timeout)),
+            ]
+            if server.batch is not None
+            else None,
+            trie=render_trie(trie, indent=4),
+            import_in_background=python_literal(server.import_in_background),
+            server_options=server_options,
+            # Each worker warms up on its own, so readiness waits for all of them.
+            workers=dict(server_options)["workers"],
+            # Only the default number of workers, `os.cpu_count()`, needs `os`.
+            uses_os=server.workers is None,
+            module=name,
         )
+
+    def generate_support_files(self) -> dict[Path, str]:
+        return {Path(PYTHON_RUNTIME.name): PYTHON_RUNTIME.read_text()}
@@ -1,5 +1,18 @@
+import os
 from pathlib import Path
 
 
 PROJECT_ROOT = Path(__file__).parent
 TEMPLATES_DIRECTORY = PROJECT_ROOT / "templates"
+PYTHON_RUNTIME = TEMPLATES_DIRECTORY / "python" / "chaos_runtime.py"
+
+CACHE_DIRECTORY = Path(
+    os.environ.get(
+        "CHAOS_CACHE_DIR",
+        Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "chaos",
+    )
+)
+WORKSPACE_CACHE_DIRECTORY = CACHE_DIRECTORY / "workspaces"
+TEMPLATE_CACHE_DIRECTORY = CACHE_DIRECTORY / "templates"
+MANIFEST_CACHE_DIRECTORY = CACHE_DIRECTORY / "manifests"
+VIRTUALENV_CACHE_DIRECTORY = CACHE_DIRECTORY / "virtualenvs"
@@ -1,33 +1,139 @@
+import asyncio
+import contextlib
 import functools
-import shutil
+import json
 import subprocess
+import sys
 import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Any
 from typing import Callable
+from typing import Iterator
+from typing import Optional
 
 import click
+import yaml
 
+import bench as benchmark
 import buildgen
+import profiling
+from buildgen import BuildOptions
+from config import MANIFEST_CACHE_DIRECTORY
+from config import TEMPLATES_DIRECTORY
+from config import VIRTUALENV_CACHE_DIRECTORY
+from config import WORKSPACE_CACHE_DIRECTORY
 from manifest import Language
 from manifest import Manifest
+from outputs import OutputDirectory
+from outputs import reflink_available
+from outputs import STAGE_MODES
+from virtualenvs import virtualenv_key
+from virtualenvs import VirtualenvCache
+from watch import make_watcher
+from watch import wait_for_changes
+from workspaces import requirement_lockfiles
+from workspaces import workspace_key
+from workspaces import WorkspaceCache
 
 
-def load_manifest(manifest: str) -> Manifest:
+def load_manifest(manifest: str, use_cache: bool = True) -> Manifest:
     cwd = Path.cwd()
-    return Manifest.load(cwd / manifest)
+    with profiling.span("load manifest"):
+        return Manifest.load(
+            cwd / manifest,
+            cache_directory=MANIFEST_CACHE_DIRECTORY if use_cache else None,
+        )
 
 
-def do_buildgen(manifest: Manifest, language: Language, target_path: Path) -> None:
-    manifest.groups = [group for group in manifest.groups if group.language == language]
+def do_buildgen(
+    manifest: Manifest,
+    language: Language,
+    target_path: Path,
+    options: BuildOptions = BuildOptions(),
+    force: bool = False,
+    stage_mode: str = "copy",
+) -> list[Path]:
+    """\
+    Generates the build for `language` into `target_path`,
+    and returns the outputs which were written or removed.
+    """
+    manifest = manifest.for_language(language)
 
     cwd = Path.cwd()
-    buildgen.generate_build(target_path, language, manifest)
+    with profiling.span("generate", language=language.format()):
+        with OutputDirectory(target_path, force=force, stage_mode=stage_mode) as output:
+            buildgen.generate_build(output, language, manifest, options)
+
+            with profiling.span("copy sources"):
+                # TODO: express this in the manifest somehow...
+                output.copy_all(
+                    [
+                        (cwd / "requirements.txt", Path("requirements.txt")),
+                        *((cwd / path, path) for path in manifest.iter_files()),
+                    ]
+                )
+    return [*output.written, *output.removed]
+
+
+def timed_buildgen(
+    manifest: Manifest,
+    language: Language,
+    target_path: Path,
+    options: BuildOptions = BuildOptions(),
+    force: bool = False,
+    stage_mode: str = "copy",
+    profile: bool = False,
+) -> tuple[float, list[profiling.TraceEvent]]:
+    """\
+    Returns how long generation took, and the spans it recorded if `profile` is set.
+    Meant to be run in a worker process, whose spans would otherwise be lost.
+    """
+    if profile:
+        profiling.enable()
+    start = time.perf_counter()
+    do_buildgen(
+        manifest, language, target_path, options, force=force, stage_mode=stage_mode
+    )
+    timing = time.perf_counter() - start
+
+    profiler = profiling.disable()
+    return timing, profiler.events if profiler is not None else []
 
-    # TODO: express this in the manifest somehow...
-    shutil.copy(cwd / "requirements.txt", target_path / "requirements.txt")
-    for path in manifest.iter_files():
-        shutil.copy(cwd / path, target_path / path)
+
+def do_parallel_buildgen(
+    manifest: Manifest,
+    languages: list[Language],
+    output_path: Path,
+    options: BuildOptions = BuildOptions(),
+    force: bool = False,
+    stage_mode: str = "copy",
+) -> dict[Language, float]:
+    """\
+    Generates each of `languages` into its own subdirectory of `output_path`,
+    in parallel, and returns the wall time each language took.
+    """
+    with ProcessPoolExecutor(max_workers=len(languages)) as executor:
+        futures = {
+            language: executor.submit(
+                timed_buildgen,
+                manifest,
+                language,
+                output_path / language.format(),
+                options,
+                force,
+                stage_mode,
+                profiling.is_enabled(),
+            )
+            for language in languages
+        }
+
+        timings = {}
+        for language, future in futures.items():
+            timings[language], events = future.result()
+            profiling.collect(events)
+        return timings
 
 
 def get_available_languages() -> list[str]:
@@ -37,25 +143,108 @@ def get_available_languages() -> list[str]:
     return available_languages
 
 
+def parse_languages(raw_languages: tuple[str, ...]) -> list[Language]:
+    if "all" in raw_languages:
+        return list(Language)
+
+    languages = []
+    for raw_language in raw_languages:
+        language = Language.from_str(raw_language)
+        if language not in languages:
+            languages.append(language)
+    return languages
+
+
 # NOTE: we don't really care about type erasure here,
 # because these are only going to be called from
 # click's magic internal interface.
-def arguments(fn: Callable[..., Any]) -> Callable[..., Any]:
-    @click.option(
-        "--manifest",
-        required=True,
-        type=click.Path(exists=True, dir_okay=False, readable=True),
-    )
-    @click.option(
-        "--language",
-        required=True,
-        type=click.Choice(get_available_languages()),
-    )
-    @functools.wraps(fn)
-    def _fn(*args, **kwargs):
-        fn(*args, **kwargs)
+def arguments(
+    multiple_languages: bool = False,
+) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    if multiple_languages:
+        language_option = click.option(
+            "--language",
+            required=True,
+            multiple=True,
+            type=click.Choice([*get_available_languages(), "all"]),
+            help="May be repeated. `all` generates every language.",
+        )
+    else:
+        language_option = click.option(
+            "--language",
+            required=True,
+            type=click.Choice(get_available_languages()),
+        )
+
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @click.option(
+            "--manifest",
+            required=True,
+            type=click.Path(exists=True, dir_okay=False, readable=True),
+        )
+        @language_option
+        @click.option(
+            "--shared-dependencies",
+            is_flag=True,
+            help="Put every group's dependencies in a single repository, "
+            "if their pins are compatible.",
+        )
+        @click.option(
+            "--group-packages",
+            is_flag=True,
+            help="Define each group's target in a BUILD file in the group's directory, "
+            "rather than in the root BUILD file.",
+        )
+        @functools.wraps(fn)
+        def _fn(*args, shared_dependencies: bool, group_packages: bool, **kwargs):
+            options = BuildOptions(
+                shared_dependencies=shared_dependencies,
+                group_packages=group_packages,
+            )
+            fn(*args, options=options, **kwargs)
+
+        return _fn  # type: ignore
+
+    return decorator
+
+
+def profile_path(profile: Optional[str]) -> Optional[Path]:
+    return Path(profile) if profile is not None else None
 
-    return _fn  # type: ignore
+
+profile_option = click.option(
+    "--profile",
+    type=click.Path(dir_okay=False),
+    help="Time each phase of generation, "
+    "and write the spans to this file as a Chrome trace.",
+)
+
+
+manifest_cache_option = click.option(
+    "--no-manifest-cache",
+    is_flag=True,
+    help="Parse the manifest from scratch, without reading or writing "
+    f"the cache of parsed manifests in {MANIFEST_CACHE_DIRECTORY}.",
+)
+
+
+def check_stage_mode(ctx: click.Context, param: click.Parameter, value: str) -> str:
+    if value == "reflink" and not reflink_available():
+        raise click.UsageError(
+            "--stage-mode reflink isn't supported on this platform", ctx=ctx
+        )
+    return value
+
+
+stage_mode_option = click.option(
+    "--stage-mode",
+    type=click.Choice(STAGE_MODES),
+    callback=check_stage_mode,
+    default="copy",
+    show_default=True,
+    help="How to place endpoint sources and lockfiles in the build directory. "
+    "Falls back to copying if the filesystem doesn't support links or reflinks.",
+)
 
 
 @click.group()
@@ -65,31 +254,610 @@ def cli():
 
 @cli.command()
 @click.option("--output-dir", type=click.Path(file_okay=False), required=True)
-@arguments
-def generate(manifest: str, language: str, output_dir: str) -> None:
-    manifest_obj = load_manifest(manifest)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Rewrite every output, even if its content has not changed.",
+)
+@stage_mode_option
+@profile_option
+@manifest_cache_option
+@arguments(multiple_languages=True)
+def generate(
+    manifest: str,
+    language: tuple[str, ...],
+    output_dir: str,
+    force: bool,
+    stage_mode: str,
+    profile: Optional[str],
+    no_manifest_cache: bool,
+    options: BuildOptions,
+) -> None:
+    with profiling.profile(profile_path(profile)):
+        do_generate(
+            manifest,
+            language,
+            output_dir,
+            force,
+            stage_mode,
+            options,
+            use_manifest_cache=not no_manifest_cache,
+        )
+
+
+def do_generate(
+    manifest: str,
+    language: tuple[str, ...],
+    output_dir: str,
+    force: bool,
+    stage_mode: str,
+    options: BuildOptions,
+    use_manifest_cache: bool = True,
+) -> None:
+    manifest_obj = load_manifest(manifest, use_cache=use_manifest_cache)
     output_path = Path(output_dir)
     if not output_path.is_absolute():
         output_path = Path.cwd() / output_path
     output_path.mkdir(parents=True, exist_ok=True)
-    do_buildgen(manifest_obj, Language.from_str(language), output_path)
+
+    languages = parse_languages(language)
+    if len(languages) == 1:
+        do_buildgen(
+            manifest_obj,
+            languages[0],
+            output_path,
+            options,
+            force=force,
+            stage_mode=stage_mode,
+        )
+        return
+
+    # Generating more than one language puts each language in its own subdirectory.
+    timings = do_parallel_buildgen(
+        manifest_obj,
+        languages,
+        output_path,
+        options,
+        force=force,
+        stage_mode=stage_mode,
+    )
+    for language_obj, timing in timings.items():
+        click.echo(f"{language_obj.format()}: {timing:.3f}s", err=True)
+
+
+@contextlib.contextmanager
+def run_workspace(
+    manifest_path: Path,
+    manifest: Manifest,
+    language: Language,
+    cache_dir: Optional[Path],
+    cache_max_size: Optional[int],
+    cache_max_age: Optional[float],
+) -> Iterator[Path]:
+    if cache_dir is None:
+        with tempfile.TemporaryDirectory() as output_dir:
+            yield Path(output_dir)
+        return
+
+    cache = WorkspaceCache(cache_dir)
+    key = workspace_key(manifest_path, language, manifest)
+    with profiling.span("evict workspaces"):
+        cache.evict(max_size=cache_max_size, max_age=cache_max_age, keep=key)
+    yield cache.get(key)
+
+
+@cli.command()
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    default=str(WORKSPACE_CACHE_DIRECTORY),
+    show_default=True,
+    help="Where to keep workspaces between runs.",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Build in a fresh temporary workspace.",
+)
+@click.option(
+    "--cache-max-size-mb",
+    type=int,
+    default=20 * 1024,
+    show_default=True,
+    help="Evict the least recently used workspaces beyond this size.",
+)
+@click.option(
+    "--cache-max-age-days",
+    type=float,
+    default=30,
+    show_default=True,
+    help="Evict workspaces and virtualenvs which haven't been used for this long.",
+)
+@click.option(
+    "--runner",
+    type=click.Choice(["bazel", "venv"]),
+    default="bazel",
+    show_default=True,
+    help="`venv` skips Bazel, and runs the server in a cached virtualenv "
+    "with every lockfile installed.",
+)
+@click.option(
+    "--venv-cache-dir",
+    type=click.Path(file_okay=False),
+    default=str(VIRTUALENV_CACHE_DIRECTORY),
+    show_default=True,
+    help="Where to keep virtualenvs for --runner venv.",
+)
+@click.option(
+    "--venv-cache-max-size-mb",
+    type=int,
+    default=10 * 1024,
+    show_default=True,
+    help="Evict the least recently used virtualenvs beyond this size.",
+)
+@stage_mode_option
+@profile_option
+@manifest_cache_option
+@arguments()
+def run(
+    manifest: str,
+    language: str,
+    cache_dir: str,
+    no_cache: bool,
+    cache_max_size_mb: int,
+    cache_max_age_days: float,
+    runner: str,
+    venv_cache_dir: str,
+    venv_cache_max_size_mb: int,
+    stage_mode: str,
+    profile: Optional[str],
+    no_manifest_cache: bool,
+    options: BuildOptions,
+) -> None:
+    with contextlib.ExitStack() as stack:
+        # Only generation is profiled, since the server runs until it's stopped.
+        with profiling.profile(profile_path(profile)):
+            manifest_obj = load_manifest(manifest, use_cache=not no_manifest_cache)
+            language_obj = Language.from_str(language)
+            output_path = stack.enter_context(
+                run_workspace(
+                    Path.cwd() / manifest,
+                    manifest_obj,
+                    language_obj,
+                    cache_dir=None if no_cache else Path(cache_dir).absolute(),
+                    cache_max_size=cache_max_size_mb * 1024 * 1024,
+                    cache_max_age=cache_max_age_days * 24 * 60 * 60,
+                )
+            )
+            do_buildgen(
+                manifest_obj, language_obj, output_path, options, stage_mode=stage_mode
+            )
+
+            server_command: tuple[str, ...] = ("bazelisk", "run", "//:server")
+            if runner == "venv":
+                with profiling.span("prepare virtualenv"):
+                    python = prepare_virtualenv(
+                        manifest_obj,
+                        language_obj,
+                        Path(venv_cache_dir).absolute(),
+                        cache_max_size=venv_cache_max_size_mb * 1024 * 1024,
+                        cache_max_age=cache_max_age_days * 24 * 60 * 60,
+                    )
+                server_command = (
+                    str(python),
+                    f"server.{language_obj.file_suffix}",
+                )
+
+        subprocess.check_call(server_command, cwd=output_path)
+
+
+def prepare_virtualenv(
+    manifest: Manifest,
+    language: Language,
+    cache_dir: Path,
+    cache_max_size: Optional[int],
+    cache_max_age: Optional[float],
+) -> Path:
+    """\
+    Returns the interpreter of a virtualenv with the server's and every group's
+    lockfiles installed, reusing a cached one with the same lockfiles if possible.
+    """
+    cwd = Path.cwd()
+    lockfiles = [
+        cwd / lockfile for lockfile in requirement_lockfiles(manifest, language)
+    ]
+    cache = VirtualenvCache(cache_dir)
+    cache.evict(
+        max_size=cache_max_size,
+        max_age=cache_max_age,
+        keep=virtualenv_key(language, lockfiles),
+    )
+    return cache.create(language, lockfiles)
+
+
+def build_server(output_path: Path, script_path: Path) -> None:
+    """\
+    Builds the server, and writes a script which runs it to `script_path`.
+    Running the script directly (rather than through `bazelisk run`)
+    means that the server can be stopped like any other process.
+    """
+    subprocess.check_call(
+        (
+            "bazelisk",
+            "run",
+            f"--script_path={script_path}",
+            "//:server",
+        ),
+        cwd=output_path,
+    )
+
+
+async def run_bench(
+    load_generator: benchmark.LoadGenerator,
+    paths: list[str],
+    warmup: float,
+    startup_timeout: float,
+    batch_paths: Optional[list[str]] = None,
+) -> list[benchmark.EndpointResult]:
+    """\
+    Measures each of `paths`, and then, if the server serves `/_batch`,
+    compares fetching `batch_paths` one at a time with fetching them in a single batch.
+    """
+    await benchmark.wait_until_ready(
+        load_generator.host, load_generator.port, paths[0], startup_timeout
+    )
+    warmup_generator = benchmark.LoadGenerator(
+        load_generator.host,
+        load_generator.port,
+        load_generator.concurrency,
+        warmup,
+    )
+
+    results = []
+    for path in paths:
+        if warmup > 0:
+            await warmup_generator.drive(path)
+        results.append(await load_generator.drive(path))
+
+    if batch_paths:
+        page = f"{len(batch_paths)} paths in turn"
+        batch_body = benchmark.build_batch_body(batch_paths)
+        if warmup > 0:
+            await warmup_generator.drive_page(page, batch_paths)
+        results.append(await load_generator.drive_page(page, batch_paths))
+        if warmup > 0:
+            await warmup_generator.drive(benchmark.BATCH_PATH, "POST", batch_body)
+        results.append(
+            await load_generator.drive(benchmark.BATCH_PATH, "POST", batch_body)
+        )
+    return results
+
+
+@cli.command()
+@click.option(
+    "--manifest",
+    default="fixtures/bench_manifest.yaml",
+    show_default=True,
+    type=click.Path(exists=True, dir_okay=False, readable=True),
+)
+@click.option(
+    "--language",
+    default=Language.PYTHON_3_10.format(),
+    show_default=True,
+    type=click.Choice(get_available_languages()),
+)
+@click.option("--concurrency", default=16, show_default=True, type=int)
+@click.option(
+    "--duration",
+    default=10.0,
+    show_default=True,
+    help="Seconds of load to send to each endpoint.",
+)
+@click.option(
+    "--warmup",
+    default=1.0,
+    show_default=True,
+    help="Seconds of load to send to each endpoint before measuring it.",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Where to write the results as JSON.",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Results from a previous --output to compare against.",
+)
+@click.option(
+    "--threshold",
+    default=0.1,
+    show_default=True,
+    help="Fail if throughput or p99 latency regresses by more than this fraction.",
+)
+@click.option("--startup-timeout", default=900.0, show_default=True)
+@manifest_cache_option
+def bench(
+    manifest: str,
+    language: str,
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    output: Optional[str],
+    baseline: Optional[str],
+    threshold: float,
+    startup_timeout: float,
+    no_manifest_cache: bool,
+) -> None:
+    """\
+    Generates and starts a server, and measures each endpoint's throughput and latency.
+    """
+    language_obj = Language.from_str(language)
+    manifest_obj = load_manifest(
+        manifest, use_cache=not no_manifest_cache
+    ).for_language(language_obj)
+    paths = benchmark.iter_bench_paths(manifest_obj)
+    if not paths:
+        raise click.UsageError(
+            f"No endpoint in {manifest} declares `paths` for {language}"
+        )
+
+    server = manifest_obj.server
+    host = server.host
+    if host in ("0.0.0.0", "::"):
+        host = "127.0.0.1"
+    load_generator = benchmark.LoadGenerator(host, server.port, concurrency, duration)
+    batch_paths = None
+    if server.batch is not None:
+        batch_paths = paths[: server.batch.max_requests]
+
+    with run_workspace(
+        Path.cwd() / manifest,
+        manifest_obj,
+        language_obj,
+        cache_dir=WORKSPACE_CACHE_DIRECTORY,
+        cache_max_size=None,
+        cache_max_age=None,
+    ) as output_path, tempfile.TemporaryDirectory() as script_dir:
+        do_buildgen(manifest_obj, language_obj, output_path)
+        script_path = Path(script_dir) / "server.sh"
+        build_server(output_path, script_path)
+
+        process = subprocess.Popen((str(script_path),), cwd=output_path)
+        try:
+            results = asyncio.run(
+                run_bench(load_generator, paths, warmup, startup_timeout, batch_paths)
+            )
+        finally:
+            process.terminate()
+            process.wait()
+
+    click.echo(benchmark.format_results(results))
+
+    if output is not None:
+        settings = {
+            "manifest": manifest,
+            "language": language,
+            "concurrency": concurrency,
+            "duration": duration,
+        }
+        Path(output).write_text(
+            json.dumps(benchmark.results_to_dict(results, settings), indent=2) + "\n"
+        )
+
+    if baseline is not None:
+        regressions = benchmark.compare(
+            results, benchmark.load_results(Path(baseline)), threshold
+        )
+        for regression in regressions:
+            click.echo(f"regression: {regression}", err=True)
+        if regressions:
+            sys.exit(1)
+
+
+def stop_server(process: Optional[subprocess.Popen]) -> None:
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def wait_for_server(
+    process: subprocess.Popen,
+    host: str,
+    port: int,
+    path: str,
+    timeout: float,
+) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            await benchmark.wait_until_ready(host, port, path, timeout=0)
+            return
+        except TimeoutError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+def watched_files(manifest_path: Path, manifest: Manifest) -> list[Path]:
+    cwd = Path.cwd()
+    return [
+        manifest_path,
+        *manifest.sources,
+        cwd / "requirements.txt",
+        *(cwd / path for path in manifest.iter_files()),
+    ]
 
 
 @cli.command()
-@arguments
-def run(manifest: str, language: str) -> None:
-    manifest_obj = load_manifest(manifest)
-    with tempfile.TemporaryDirectory() as output_dir:
-        output_path = Path(output_dir)
-        do_buildgen(manifest_obj, Language.from_str(language), output_path)
-        subprocess.check_call(
-            (
-                "bazelisk",
-                "run",
-                "//:server",
-            ),
-            cwd=output_path,
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Regenerate, rebuild, and restart the server whenever "
+    "the manifest, an endpoint, a lockfile, or a template changes.",
+)
+@click.option(
+    "--debounce-ms",
+    default=100,
+    show_default=True,
+    help="Wait for this long without any changes before regenerating.",
+)
+@click.option(
+    "--poll",
+    is_flag=True,
+    help="Poll for changes, rather than using inotify.",
+)
+@click.option("--startup-timeout", default=900.0, show_default=True)
+@stage_mode_option
+@manifest_cache_option
+@arguments()
+def dev(
+    manifest: str,
+    language: str,
+    watch: bool,
+    debounce_ms: int,
+    poll: bool,
+    startup_timeout: float,
+    stage_mode: str,
+    no_manifest_cache: bool,
+    options: BuildOptions,
+) -> None:
+    """\
+    Builds and runs a server, and with --watch, restarts it whenever its sources change.
+    """
+    manifest_path = Path.cwd() / manifest
+    manifest_obj = load_manifest(manifest, use_cache=not no_manifest_cache)
+    language_obj = Language.from_str(language)
+
+    # Keep using the same workspace for the whole session, even if the manifest
+    # changes, so that every cycle is an incremental regeneration and rebuild.
+    cache = WorkspaceCache(WORKSPACE_CACHE_DIRECTORY)
+    output_path = cache.get(workspace_key(manifest_path, language_obj, manifest_obj))
+
+    watcher = make_watcher(polling=poll)
+    watcher.update(watched_files(manifest_path, manifest_obj), [TEMPLATES_DIRECTORY])
+
+    process: Optional[subprocess.Popen] = None
+    changed_at = time.perf_counter()
+    with tempfile.TemporaryDirectory() as script_dir:
+        script_path = Path(script_dir) / "server.sh"
+        try:
+            while True:
+                try:
+                    process = dev_cycle(
+                        manifest_obj,
+                        language_obj,
+                        output_path,
+                        script_path,
+                        process,
+                        changed_at,
+                        startup_timeout,
+                        stage_mode,
+                        options,
+                    )
+                except (
+                    subprocess.CalledProcessError,
+                    OSError,
+                    RuntimeError,
+                    TimeoutError,
+                    ValueError,
+                ) as e:
+                    if not watch:
+                        raise
+                    click.echo(f"dev: {e}", err=True)
+
+                if not watch:
+                    assert process is not None
+                    process.wait()
+                    return
+
+                changed, changed_at = wait_for_changes(watcher, debounce_ms / 1000)
+                click.echo(f"dev: {len(changed)} file(s) changed", err=True)
+                if changed & {manifest_path, *manifest_obj.sources}:
+                    try:
+                        manifest_obj = load_manifest(
+                            manifest, use_cache=not no_manifest_cache
+                        )
+                    except (ValueError, yaml.YAMLError) as e:
+                        click.echo(f"dev: can't load {manifest}: {e}", err=True)
+                        continue
+                    watcher.update(
+                        watched_files(manifest_path, manifest_obj),
+                        [TEMPLATES_DIRECTORY],
+                    )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop_server(process)
+            watcher.close()
+
+
+def dev_cycle(
+    manifest: Manifest,
+    language: Language,
+    output_path: Path,
+    script_path: Path,
+    process: Optional[subprocess.Popen],
+    changed_at: float,
+    startup_timeout: float,
+    stage_mode: str,
+    options: BuildOptions,
+) -> Optional[subprocess.Popen]:
+    """\
+    Regenerates the build, and if any output changed, rebuilds and restarts the server.
+    Returns the server's process.
+    """
+    changed_outputs = do_buildgen(
+        manifest, language, output_path, options, stage_mode=stage_mode
+    )
+    generated_at = time.perf_counter()
+    if process is not None and process.poll() is None and not changed_outputs:
+        click.echo("dev: no outputs changed", err=True)
+        return process
+
+    build_server(output_path, script_path)
+    built_at = time.perf_counter()
+
+    # Restart the server itself, rather than `bazelisk run`,
+    # so that Bazel's server and caches stay warm between cycles.
+    stop_server(process)
+    process = subprocess.Popen((str(script_path),), cwd=output_path)
+
+    server = manifest.for_language(language).server
+    host = server.host
+    if host in ("0.0.0.0", "::"):
+        host = "127.0.0.1"
+    paths = benchmark.iter_bench_paths(manifest.for_language(language))
+    try:
+        asyncio.run(
+            wait_for_server(
+                process,
+                host,
+                server.port,
+                paths[0] if paths else "/",
+                startup_timeout,
+            )
         )
+    except BaseException:
+        stop_server(process)
+        raise
+    served_at = time.perf_counter()
+
+    click.echo(
+        f"dev: first request served {served_at - changed_at:.2f}s after the change "
+        f"(generate {generated_at - changed_at:.2f}s, "
+        f"build {built_at - generated_at:.2f}s, "
+        f"start {served_at - built_at:.2f}s)",
+        err=True,
+    )
+    return process
 
 
 if __name__ == "__main__":
@@ -1,13 +1,33 @@
 from __future__ import annotations
 
+import hashlib
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from dataclasses import field
 from enum import Enum
 from pathlib import Path
 from typing import Any
 from typing import Generator
+from typing import Optional
 
 import yaml
 
+import profiling
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # PyYAML was built without libyaml.
+    from yaml import SafeLoader  # type: ignore
+
+
+# Loading included files in separate processes only pays off
+# once there are enough of them to make up for starting the processes.
+PARALLEL_LOAD_THRESHOLD = 4
+MANIFEST_CACHE_VERSION = 1
+
 
 # TODO: do some validation here and raise better errors
 # also check that we're returning the right types
@@ -51,13 +71,99 @@ class Language(Enum):
         return language_map[raw]
 
 
+@dataclass
+class CacheConfig:
+    # How long a response is served from the cache, in seconds.
+    ttl: float
+    max_entries: int = 1024
+    # Path and query parameters which identify a response.
+    # If empty, responses are identified by their entire path and query string.
+    vary_on: list[str] = field(default_factory=list)
+
+    @staticmethod
+    def from_dict(raw_cache: dict[str, Any]) -> CacheConfig:
+        default = CacheConfig(ttl=0)
+        cache = CacheConfig(
+            ttl=raw_cache["ttl"],
+            max_entries=raw_cache.get("max_entries", default.max_entries),
+            vary_on=raw_cache.get("vary_on", default.vary_on),
+        )
+        if cache.ttl <= 0:
+            raise ValueError(f"`cache.ttl` must be positive, not `{cache.ttl}`")
+        if cache.max_entries < 1:
+            raise ValueError(
+                f"`cache.max_entries` must be at least 1, not `{cache.max_entries}`"
+            )
+        return cache
+
+
+@dataclass
+class WarmupConfig:
+    # How many requests to send to each of the group's example `paths` (see `Endpoint`).
+    requests: int = 1
+    # The name of a function in the group's module to call before the requests,
+    # e.g. `warmup`. It may be async. Isolated groups call it in each of their workers.
+    hook: Optional[str] = None
+
+    @staticmethod
+    def from_dict(raw_warmup: dict[str, Any]) -> WarmupConfig:
+        default = WarmupConfig()
+        warmup = WarmupConfig(
+            requests=raw_warmup.get("requests", default.requests),
+            hook=raw_warmup.get("hook", default.hook),
+        )
+        if warmup.requests < 0:
+            raise ValueError(
+                f"`warmup.requests` can't be negative, not `{warmup.requests}`"
+            )
+        return warmup
+
+
+@dataclass
+class BatchConfig:
+    # The most sub-requests which a single `/_batch` request can make.
+    max_requests: int = 20
+    # Seconds to wait for each sub-request, before answering it with a 504.
+    timeout: float = 5.0
+
+    @staticmethod
+    def from_dict(raw_batch: dict[str, Any]) -> BatchConfig:
+        default = BatchConfig()
+        batch = BatchConfig(
+            max_requests=raw_batch.get("max_requests", default.max_requests),
+            timeout=raw_batch.get("timeout", default.timeout),
+        )
+        if batch.max_requests < 1:
+            raise ValueError(
+                f"`batch.max_requests` must be at least 1, not `{batch.max_requests}`"
+            )
+        if batch.timeout <= 0:
+            raise ValueError(f"`batch.timeout` must be positive, not `{batch.timeout}`")
+        return batch
+
+
 @dataclass
 class Endpoint:
+    # The name of the endpoint's router in its group's module, e.g. `router`.
     name: str
+    # Example request paths served by this endpoint, e.g. `/echo/hello`.
+    # These are what `main.py bench` sends requests to.
+    paths: list[str] = field(default_factory=list)
+    # Serve the endpoint's successful GET responses from an in-process cache.
+    cache: Optional[CacheConfig] = None
 
     @staticmethod
     def from_dict(raw_endpoint: dict[str, Any]) -> Endpoint:
-        return Endpoint(name=raw_endpoint["name"])
+        raw_cache = raw_endpoint.get("cache")
+        return Endpoint(
+            name=raw_endpoint["name"],
+            paths=raw_endpoint.get("paths", []),
+            cache=CacheConfig.from_dict(raw_cache) if raw_cache is not None else None,
+        )
+
+
+GROUP_ISOLATION = ("none", "process")
+SERIALIZERS = ("json", "orjson")
 
 
 @dataclass
@@ -67,10 +173,36 @@ class Group:
     filename: str
     endpoints: list[Endpoint]
     dependencies: str
+    # Path prefixes served by this group, e.g. `/echo`.
+    # Required for the group to be imported lazily, or run in its own processes.
+    prefixes: list[str] = field(default_factory=list)
+    # `none` serves the group in the server's own process.
+    # `process` serves it from a pool of `workers` separate processes,
+    # so that it can't hold up the other groups' requests.
+    # Each of the server's own worker processes starts a pool of its own,
+    # so the group runs in `server.workers` times `workers` processes in all.
+    isolation: str = "none"
+    workers: int = 1
+    # Overrides `server.serializer` for this group's responses.
+    serializer: Optional[str] = None
+    # Overrides `server.warmup` for this group.
+    warmup: Optional[WarmupConfig] = None
+    # How many of the group's requests are handled at once, and how many more
+    # can wait for their turn. Requests beyond those are rejected with a 503,
+    # so that a slow group can't take the rest of the server down with it.
+    # Both are per server worker process, so the limits of the whole server
+    # are `server.workers` times these.
+    max_concurrency: Optional[int] = None
+    max_queue: int = 0
+    # How many of the group's sync (`def`) endpoints can run on threads at once.
+    # By default, every group shares the 40 threads of AnyIO's default limiter.
+    # Like `max_concurrency`, this is per server worker process.
+    threadpool_size: Optional[int] = None
 
     @staticmethod
     def from_dict(raw_group: dict[str, Any]) -> Group:
-        return Group(
+        raw_warmup = raw_group.get("warmup")
+        group = Group(
             name=raw_group["name"],
             language=Language.from_str(raw_group["language"]),
             filename=raw_group["filename"],
@@ -79,12 +211,313 @@ class Group:
                 for raw_endpoint in raw_group["endpoints"]
             ],
             dependencies=raw_group["dependencies"],
+            prefixes=raw_group.get("prefixes", []),
+            isolation=check_choice(
+                "isolation",
+                raw_group.get("isolation", "none"),
+                GROUP_ISOLATION,
+            ),
+            workers=raw_group.get("workers", 1),
+            serializer=check_optional_choice(
+                "serializer",
+                raw_group.get("serializer"),
+                SERIALIZERS,
+            ),
+            warmup=WarmupConfig.from_dict(raw_warmup)
+            if raw_warmup is not None
+            else None,
+            max_concurrency=raw_group.get("max_concurrency"),
+            max_queue=raw_group.get("max_queue", 0),
+            threadpool_size=raw_group.get("threadpool_size"),
+        )
+        if group.isolation == "process" and not group.prefixes:
+            raise ValueError(
+                f"Group `{group.name}` needs `prefixes` to run in its own processes"
+            )
+        if group.workers < 1:
+            raise ValueError(
+                f"Group `{group.name}` needs at least 1 worker, not `{group.workers}`"
+            )
+        if group.max_concurrency is not None and group.max_concurrency < 1:
+            raise ValueError(
+                f"Group `{group.name}` needs a `max_concurrency` of at least 1, "
+                f"not `{group.max_concurrency}`"
+            )
+        if group.max_queue < 0:
+            raise ValueError(
+                f"Group `{group.name}` can't have a negative `max_queue`, "
+                f"not `{group.max_queue}`"
+            )
+        if group.max_queue and group.max_concurrency is None:
+            raise ValueError(
+                f"Group `{group.name}` needs `max_concurrency` to have a `max_queue`"
+            )
+        if group.threadpool_size is not None and group.threadpool_size < 1:
+            raise ValueError(
+                f"Group `{group.name}` needs a `threadpool_size` of at least 1, "
+                f"not `{group.threadpool_size}`"
+            )
+        return group
+
+
+SERVER_LOOPS = ("auto", "asyncio", "uvloop")
+SERVER_HTTP_IMPLEMENTATIONS = ("auto", "h11", "httptools")
+SERVER_ROUTING = ("merged", "prefix")
+
+
+def check_choice(name: str, value: str, choices: tuple[str, ...]) -> str:
+    if value not in choices:
+        raise ValueError(f"`{name}` must be one of {', '.join(choices)}, not `{value}`")
+    return value
+
+
+def check_optional_choice(
+    name: str, value: Optional[str], choices: tuple[str, ...]
+) -> Optional[str]:
+    if value is None:
+        return None
+    return check_choice(name, value, choices)
+
+
+@dataclass
+class ServerConfig:
+    host: str = "127.0.0.1"
+    port: int = 8080
+    log_level: str = "info"
+    # `None` runs one worker process per CPU.
+    workers: Optional[int] = None
+    # `auto` uses uvloop and httptools when they're installed.
+    loop: str = "auto"
+    http: str = "auto"
+    backlog: int = 2048
+    timeout_keep_alive: int = 5
+    limit_concurrency: Optional[int] = None
+    # Import groups (which declare their prefixes) on their first request,
+    # rather than before the server starts.
+    lazy_imports: bool = False
+    # With lazy imports, import the remaining groups in the background after startup.
+    import_in_background: bool = True
+    # `merged` includes every group's routes in a single app.
+    # `prefix` serves each group (which declares its prefixes) from its own app,
+    # and dispatches requests to them by prefix.
+    routing: str = "merged"
+    # Count requests to each route, and serve the counters at `/metrics`.
+    metrics: bool = False
+    # How responses are encoded as JSON. `orjson` is considerably faster than `json`
+    # (from the standard library), and falls back to it if orjson isn't installed.
+    serializer: str = "json"
+    # Warm up every group after startup, and serve `/ready` once they're all warm.
+    warmup: Optional[WarmupConfig] = None
+    # Serve `/_batch`, which makes several requests to the server in one round trip.
+    batch: Optional[BatchConfig] = None
+
+    @staticmethod
+    def from_dict(raw_server: dict[str, Any]) -> ServerConfig:
+        default = ServerConfig()
+        raw_warmup = raw_server.get("warmup")
+        raw_batch = raw_server.get("batch")
+        return ServerConfig(
+            host=raw_server.get("host", default.host),
+            port=raw_server.get("port", default.port),
+            log_level=raw_server.get("log_level", default.log_level),
+            workers=raw_server.get("workers", default.workers),
+            loop=check_choice(
+                "server.loop",
+                raw_server.get("loop", default.loop),
+                SERVER_LOOPS,
+            ),
+            http=check_choice(
+                "server.http",
+                raw_server.get("http", default.http),
+                SERVER_HTTP_IMPLEMENTATIONS,
+            ),
+            backlog=raw_server.get("backlog", default.backlog),
+            timeout_keep_alive=raw_server.get(
+                "timeout_keep_alive", default.timeout_keep_alive
+            ),
+            limit_concurrency=raw_server.get(
+                "limit_concurrency", default.limit_concurrency
+            ),
+            lazy_imports=raw_server.get("lazy_imports", default.lazy_imports),
+            import_in_background=raw_server.get(
+                "import_in_background", default.import_in_background
+            ),
+            routing=check_choice(
+                "server.routing",
+                raw_server.get("routing", default.routing),
+                SERVER_ROUTING,
+            ),
+            metrics=raw_server.get("metrics", default.metrics),
+            serializer=check_choice(
+                "server.serializer",
+                raw_server.get("serializer", default.serializer),
+                SERIALIZERS,
+            ),
+            warmup=WarmupConfig.from_dict(raw_warmup)
+            if raw_warmup is not None
+            else default.warmup,
+            batch=BatchConfig.from_dict(raw_batch)
+            if raw_batch is not None
+            else default.batch,
         )
 
 
+@dataclass
+class NamedServer:
+    """\
+    A server which only serves some of the manifest's groups,
+    so that it can be deployed and scaled separately from the others.
+    """
+
+    name: str
+    groups: list[str]
+    # The top-level `server` settings, with any of this server's own on top.
+    server: ServerConfig = field(default_factory=ServerConfig)
+
+    @property
+    def target(self) -> str:
+        # Prefixed, so that servers can't clash with groups' targets.
+        return f"server_{self.name}"
+
+    @staticmethod
+    def from_dict(
+        raw_named_server: dict[str, Any], raw_server: dict[str, Any]
+    ) -> NamedServer:
+        name = raw_named_server["name"]
+        if not name.isidentifier():
+            raise ValueError(f"Server name `{name}` must be a valid identifier")
+        overrides = {
+            key: value
+            for key, value in raw_named_server.items()
+            if key not in ("name", "groups")
+        }
+        return NamedServer(
+            name=name,
+            groups=raw_named_server.get("groups", []),
+            server=ServerConfig.from_dict({**raw_server, **overrides}),
+        )
+
+
+def load_yaml(path: Path) -> Any:
+    with path.open("rb") as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def load_yaml_files(paths: list[Path]) -> list[Any]:
+    if len(paths) < PARALLEL_LOAD_THRESHOLD:
+        return [load_yaml(path) for path in paths]
+    with ProcessPoolExecutor(
+        max_workers=min(len(paths), os.cpu_count() or 1)
+    ) as executor:
+        return list(executor.map(load_yaml, paths))
+
+
+def hash_file(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+@dataclass
+class ManifestCacheEntry:
+    version: int
+    # Identifies the code which produced `manifest`, so that changes to
+    # the manifest classes invalidate the cache.
+    code_digest: str
+    # The digest of every file that `manifest` was loaded from.
+    file_digests: dict[Path, str]
+    # The result of expanding each `include:` glob, keyed by (directory, pattern).
+    includes: dict[tuple[Path, str], list[Path]]
+    manifest: Manifest
+
+    def is_valid(self) -> bool:
+        if self.version != MANIFEST_CACHE_VERSION:
+            return False
+        if self.code_digest != hash_file(Path(__file__)):
+            return False
+
+        for (directory, pattern), matches in self.includes.items():
+            if sorted(directory.glob(pattern)) != matches:
+                return False
+
+        for path, digest in self.file_digests.items():
+            try:
+                if hash_file(path) != digest:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+
+class ManifestCache:
+    """\
+    Stores parsed manifests on disk, so that loading an unchanged manifest
+    (and the files it includes) doesn't have to parse any YAML.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def entry_path(self, path: Path) -> Path:
+        key = hashlib.sha256(str(path.resolve()).encode()).hexdigest()[:32]
+        return self.directory / f"{key}.pickle"
+
+    def get(self, path: Path) -> Optional[Manifest]:
+        try:
+            with self.entry_path(path).open("rb") as f:
+                entry = pickle.load(f)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if not isinstance(entry, ManifestCacheEntry) or not entry.is_valid():
+            return None
+        return entry.manifest
+
+    def put(self, path: Path, entry: ManifestCacheEntry) -> None:
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=self.directory, suffix=".tmp", delete=False
+            ) as f:
+                pickle.dump(entry, f)
+            os.replace(f.name, self.entry_path(path))
+        except OSError:
+            # An unwritable cache shouldn't stop us from loading the manifest.
+            pass
+
+
 @dataclass
 class Manifest:
     groups: list[Group]
+    server: ServerConfig = field(default_factory=ServerConfig)
+    # Servers which each serve some of the groups. Every group is still served
+    # by the server built from all of them (which is what `run` and `bench` use).
+    servers: list[NamedServer] = field(default_factory=list)
+    # The manifest files this manifest was loaded from, including any `include:`s.
+    sources: list[Path] = field(default_factory=list, compare=False)
+
+    def for_language(self, language: Language) -> Manifest:
+        """\
+        Returns a copy of this manifest which only contains the groups
+        which are built for `language`. Leaves this manifest untouched.
+        """
+        groups = [group for group in self.groups if group.language == language]
+        group_names = {group.name for group in groups}
+        servers = []
+        for named_server in self.servers:
+            server_groups = [
+                name for name in named_server.groups if name in group_names
+            ]
+            if server_groups:
+                servers.append(
+                    NamedServer(named_server.name, server_groups, named_server.server)
+                )
+        return Manifest(
+            groups=groups,
+            server=self.server,
+            servers=servers,
+            sources=self.sources,
+        )
+
+    def server_groups(self, named_server: NamedServer) -> list[Group]:
+        return [group for group in self.groups if group.name in named_server.groups]
 
     def iter_files(self) -> Generator[Path, None, None]:
         for group in self.groups:
@@ -93,12 +526,162 @@ class Manifest:
 
     @staticmethod
     def from_dict(raw_manifest: dict[str, Any]) -> Manifest:
-        return Manifest(
-            groups=[Group.from_dict(raw_group) for raw_group in raw_manifest["groups"]],
+        raw_server = raw_manifest.get("server", {})
+        manifest = Manifest(
+            groups=[
+                Group.from_dict(raw_group)
+                for raw_group in raw_manifest.get("groups", [])
+            ],
+            server=ServerConfig.from_dict(raw_server),
+            servers=[
+                NamedServer.from_dict(raw_named_server, raw_server)
+                for raw_named_server in raw_manifest.get("servers", [])
+            ],
         )
+        manifest.check_servers()
+        manifest.check_isolated_groups()
+        return manifest
+
+    def check_servers(self) -> None:
+        group_names = {group.name for group in self.groups}
+        server_names: set[str] = set()
+        group_servers: dict[str, str] = {}
+        # Servers are run side by side, so each needs an address of its own.
+        address_servers: dict[tuple[str, int], str] = {}
+        for named_server in self.servers:
+            if named_server.name in server_names:
+                raise ValueError(
+                    f"Server `{named_server.name}` is declared more than once"
+                )
+            server_names.add(named_server.name)
+            address = (named_server.server.host, named_server.server.port)
+            if address in address_servers:
+                raise ValueError(
+                    f"Servers `{address_servers[address]}` and `{named_server.name}` "
+                    f"both listen on {address[0]}:{address[1]}, so one of them needs "
+                    "its own `host` or `port`"
+                )
+            address_servers[address] = named_server.name
+            if named_server.target in group_names:
+                raise ValueError(
+                    f"Server `{named_server.name}` clashes with "
+                    f"group `{named_server.target}`"
+                )
+            if not named_server.groups:
+                raise ValueError(f"Server `{named_server.name}` has no groups")
+
+            for name in named_server.groups:
+                if name not in group_names:
+                    raise ValueError(
+                        f"Server `{named_server.name}` serves unknown group `{name}`"
+                    )
+                if name in group_servers:
+                    raise ValueError(
+                        f"Group `{name}` is served by both `{group_servers[name]}` "
+                        f"and `{named_server.name}`"
+                    )
+                group_servers[name] = named_server.name
+
+    def check_isolated_groups(self) -> None:
+        """\
+        Each of a server's workers starts its own processes for every isolated group,
+        so servers with isolated groups have to set `workers`
+        rather than leave it to the number of CPUs.
+        """
+        servers = [("`server`", self.server, [group.name for group in self.groups])]
+        for named_server in self.servers:
+            servers.append(
+                (
+                    f"Server `{named_server.name}`",
+                    named_server.server,
+                    named_server.groups,
+                )
+            )
+        isolated = {group.name for group in self.groups if group.isolation == "process"}
+        for label, server, group_names in servers:
+            for name in group_names:
+                if name in isolated and server.workers is None:
+                    raise ValueError(
+                        f"{label} needs `workers`, because each of its workers "
+                        f"starts the processes of isolated group `{name}`"
+                    )
 
     @staticmethod
-    def load(path: Path) -> Manifest:
-        with path.open() as f:
-            raw_manifest = yaml.full_load(f.read())
-        return Manifest.from_dict(raw_manifest)
+    def load(path: Path, cache_directory: Optional[Path] = None) -> Manifest:
+        """\
+        Loads a manifest, along with every file matched by its `include:` globs.
+        Included files may only declare `groups` (and further `include`s).
+        With a `cache_directory`, parsed manifests are reused until one of their files changes.
+        """
+        cache = None
+        if cache_directory is not None:
+            cache = ManifestCache(cache_directory)
+            with profiling.span("read manifest cache"):
+                cached_manifest = cache.get(path)
+            if cached_manifest is not None:
+                return cached_manifest
+
+        with profiling.span("parse manifest", path=str(path)):
+            raw_manifest = load_yaml(path) or {}
+        sources = [path]
+        includes: dict[tuple[Path, str], list[Path]] = {}
+        raw_groups = list(raw_manifest.get("groups", []))
+
+        pending = [(path, raw_manifest)]
+        while pending:
+            # Every file included at the same depth is loaded at once.
+            to_load: list[Path] = []
+            for including_path, raw_including in pending:
+                for pattern in raw_including.get("include", []):
+                    if Path(pattern).is_absolute():
+                        raise ValueError(
+                            f"{including_path}: `include` patterns have to be "
+                            f"relative to the manifest, not `{pattern}`"
+                        )
+                    matches = sorted(including_path.parent.glob(pattern))
+                    includes[(including_path.parent, pattern)] = matches
+                    to_load.extend(match for match in matches if match not in sources)
+            to_load = list(dict.fromkeys(to_load))
+            if not to_load:
+                break
+
+            pending = []
+            with profiling.span("parse included manifests", files=len(to_load)):
+                raw_includes = load_yaml_files(to_load)
+            for included_path, raw_included in zip(to_load, raw_includes):
+                if not isinstance(raw_included, dict):
+                    raise ValueError(
+                        f"{included_path}: included manifests have to be a mapping "
+                        "of `groups` (and `include`)"
+                    )
+                if set(raw_included) - {"groups", "include"}:
+                    raise ValueError(
+                        f"{included_path}: included manifests may only declare "
+                        "`groups` and `include`"
+                    )
+                sources.append(included_path)
+                raw_groups.extend(raw_included.get("groups", []))
+                pending.append((included_path, raw_included))
+
+        manifest = Manifest.from_dict({**raw_manifest, "groups": raw_groups})
+        manifest.sources = sources
+
+        group_names = set()
+        for group in manifest.groups:
+            if group.name in group_names:
+                raise ValueError(f"Group `{group.name}` is declared more than once")
+            group_names.add(group.name)
+
+        if cache is not None:
+            with profiling.span("write manifest cache"):
+                cache.put(
+                    path,
+                    ManifestCacheEntry(
+                        version=MANIFEST_CACHE_VERSION,
+                        code_digest=hash_file(Path(__file__)),
+                        file_digests={source: hash_file(source) for source in sources},
+                        includes=includes,
+                        manifest=manifest,
+                    ),
+                )
+        return manifest
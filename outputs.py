@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import TracebackType
+from typing import Iterable
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = ".chaos_state.json"
+STATE_VERSION = 2
+
+STAGE_MODES = ("copy", "hardlink", "symlink", "reflink")
+
+# From <linux/fs.h>: share the source's extents with the target (copy-on-write).
+FICLONE = 0x40049409
+
+# The size, mtime, and stage mode of a copied file's source,
+# and then the mtime and inode of the file it was staged as.
+SourceStat = list[object]
+
+
+def digest_bytes(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def digest_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reflink_available() -> bool:
+    # Files are cloned with an ioctl, and `fcntl` doesn't exist on Windows.
+    return importlib.util.find_spec("fcntl") is not None
+
+
+def reflink(source: Path, target: Path) -> None:
+    import fcntl
+
+    with source.open("rb") as source_file, target.open("wb") as target_file:
+        fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+
+
+class OutputDirectory:
+    """\
+    Tracks every file that a generation writes into a target directory,
+    so that regenerating an unchanged manifest leaves the directory untouched.
+
+    Writes and copies whose content matches what is already on disk are skipped,
+    which keeps mtimes stable and Bazel's caches warm.
+    Files that were produced by a previous generation, but not by this one,
+    are removed when the generation finishes.
+
+    Copied files are staged according to `stage_mode`:
+    a plain copy, a hard link, a symlink, or a copy-on-write clone (reflink).
+    If the filesystem can't link or clone a file, it is copied instead.
+    """
+
+    def __init__(self, root: Path, force: bool = False, stage_mode: str = "copy"):
+        if stage_mode not in STAGE_MODES:
+            raise ValueError(f"Unknown stage mode `{stage_mode}`")
+        if stage_mode == "reflink" and not reflink_available():
+            raise ValueError("Reflinks aren't supported on this platform")
+
+        self.root = root
+        self.force = force
+        self.stage_mode = stage_mode
+        # Cleared once the filesystem refuses to link or clone a file,
+        # so that the rest are copied without trying (and warning) again.
+        self.can_link = stage_mode != "copy"
+        self.previous, self.previous_stats = self._load_state()
+        self.current: dict[str, str] = {}
+        self.stats: dict[str, SourceStat] = {}
+        self.written: list[Path] = []
+        self.skipped: list[Path] = []
+        self.removed: list[Path] = []
+
+    @property
+    def state_path(self) -> Path:
+        return self.root / STATE_FILENAME
+
+    def _load_state(self) -> tuple[dict[str, str], dict[str, SourceStat]]:
+        try:
+            raw_state = json.loads(self.state_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}, {}
+        if raw_state.get("version") != STATE_VERSION:
+            return {}, {}
+        return raw_state["files"], raw_state.get("sources", {})
+
+    def _save_state(self) -> None:
+        raw_state = {
+            "version": STATE_VERSION,
+            "files": dict(sorted(self.current.items())),
+            "sources": dict(sorted(self.stats.items())),
+        }
+        contents = json.dumps(raw_state, indent=2) + "\n"
+        if not self.state_path.is_file() or self.state_path.read_text() != contents:
+            self.state_path.write_text(contents)
+
+    def _record(self, path: Path, digest: str, changed: bool) -> None:
+        self.current[path.as_posix()] = digest
+        if changed:
+            self.written.append(path)
+        else:
+            self.skipped.append(path)
+
+    def write_text(self, path: Path, contents: str) -> bool:
+        """\
+        Writes `contents` to `path` (relative to the root of the output directory),
+        unless the file already has exactly that content.
+        Returns whether the file was written.
+        """
+        raw_contents = contents.encode()
+        target_path = self.root / path
+
+        changed = True
+        if not self.force and target_path.is_file():
+            changed = target_path.read_bytes() != raw_contents
+
+        if changed:
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            # Never write through a link into the file it was staged from.
+            target_path.unlink(missing_ok=True)
+            target_path.write_bytes(raw_contents)
+        self._record(path, digest_bytes(raw_contents), changed)
+        return changed
+
+    def _is_staged(self, source: Path, target_path: Path, size: int) -> bool:
+        if self.stage_mode == "symlink":
+            return target_path.is_symlink() and os.readlink(target_path) == str(source)
+        return (
+            not target_path.is_symlink()
+            and target_path.is_file()
+            and target_path.stat().st_size == size
+        )
+
+    def _target_stat(self, target_path: Path) -> SourceStat:
+        stat = target_path.lstat()
+        return [stat.st_mtime_ns, stat.st_ino]
+
+    def _is_unmodified(
+        self, target_path: Path, digest: str, staged_stat: SourceStat
+    ) -> bool:
+        """\
+        Checks that a staged file still has the content it was staged with,
+        in case it was edited in place. It's only read if it changed since it was staged.
+        """
+        if (
+            self.stage_mode == "symlink"
+            or self._target_stat(target_path) == staged_stat
+        ):
+            return True
+        return digest_file(target_path) == digest
+
+    def _stage(self, source: Path, target_path: Path) -> None:
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        # Stage next to the target and then replace it,
+        # so that a link left by a previous generation is never written through.
+        staging_path = target_path.with_name(f".{target_path.name}.chaos_staging")
+        staging_path.unlink(missing_ok=True)
+
+        linked = False
+        if self.can_link:
+            try:
+                if self.stage_mode == "hardlink":
+                    os.link(source, staging_path)
+                elif self.stage_mode == "symlink":
+                    os.symlink(source, staging_path)
+                else:
+                    reflink(source, staging_path)
+                linked = True
+            except OSError as e:
+                if self.can_link:
+                    self.can_link = False
+                    logger.warning(
+                        "Can't %s files into %s (%s), copying them instead",
+                        self.stage_mode,
+                        self.root,
+                        e,
+                    )
+                staging_path.unlink(missing_ok=True)
+
+        if not linked:
+            shutil.copy(source, staging_path)
+        os.replace(staging_path, target_path)
+
+    def copy(self, source: Path, path: Path) -> bool:
+        """\
+        Stages `source` at `path` (relative to the root of the output directory),
+        unless the previous generation already staged the same content there.
+        Sources whose size and mtime are unchanged aren't even read,
+        unless the staged file has changed since it was staged.
+        Returns whether the file was staged.
+        """
+        key = path.as_posix()
+        target_path = self.root / path
+        stat = source.stat()
+        source_stat: SourceStat = [stat.st_size, stat.st_mtime_ns, self.stage_mode]
+        previous_digest = self.previous.get(key)
+        previous_stat = self.previous_stats.get(key, [])
+
+        if (
+            not self.force
+            and previous_digest is not None
+            and previous_stat[:3] == source_stat
+            and self._is_staged(source, target_path, stat.st_size)
+            and self._is_unmodified(target_path, previous_digest, previous_stat[3:])
+        ):
+            digest = previous_digest
+            changed = False
+        else:
+            digest = digest_file(source)
+            changed = (
+                self.force
+                or previous_digest != digest
+                or previous_stat[2:3] != [self.stage_mode]
+                or not self._is_staged(source, target_path, stat.st_size)
+                or not self._is_unmodified(target_path, digest, previous_stat[3:])
+            )
+
+        if changed:
+            self._stage(source, target_path)
+        self.stats[key] = [*source_stat, *self._target_stat(target_path)]
+        self._record(path, digest, changed)
+        return changed
+
+    def copy_all(self, files: Iterable[tuple[Path, Path]]) -> list[Path]:
+        """\
+        Stages each `(source, path)` pair like `copy`, on a pool of threads.
+        A path which appears more than once is only staged once.
+        Returns the paths which were staged.
+        """
+        unique_files: dict[Path, Path] = {}
+        for source, path in files:
+            unique_files.setdefault(path, source)
+
+        with ThreadPoolExecutor() as executor:
+            changed = list(
+                executor.map(self.copy, unique_files.values(), unique_files.keys())
+            )
+        return [path for path, was_changed in zip(unique_files, changed) if was_changed]
+
+    def remove_stale(self) -> list[Path]:
+        """\
+        Removes the files which were produced by the previous generation
+        but not by this one, along with any directories that leaves empty.
+        """
+        removed = []
+        for raw_path in sorted(set(self.previous) - set(self.current)):
+            path = Path(raw_path)
+            (self.root / path).unlink(missing_ok=True)
+            removed.append(path)
+
+            for parent in path.parents:
+                if parent == Path("."):
+                    break
+                try:
+                    (self.root / parent).rmdir()
+                except OSError:
+                    break
+        return removed
+
+    def finish(self) -> list[Path]:
+        self.removed = self.remove_stale()
+        self._save_state()
+        return self.removed
+
+    def __enter__(self) -> OutputDirectory:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        if exc_type is None:
+            self.finish()
+            return
+
+        # Generation failed part way through: don't remove anything,
+        # but remember every file that either run may have produced
+        # so that the next successful run can still clean them up.
+        self.current = {**self.previous, **self.current}
+        self.stats = {**self.previous_stats, **self.stats}
+        self._save_state()
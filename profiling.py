@@ -0,0 +1,143 @@
+"""\
+Lightweight spans for timing the phases of generation.
+
+Profiling is off unless `enable` is called (e.g. by `--profile`).
+While it's off, `span` returns the same do-nothing context manager every time,
+so instrumented code pays for a global lookup and nothing more.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+from typing import Iterator
+from typing import Optional
+
+import click
+
+
+TraceEvent = dict[str, Any]
+
+_DISABLED = contextlib.nullcontext()
+_profiler: Optional[Profiler] = None
+
+
+class Profiler:
+    """\
+    Records completed spans in Chrome's trace event format,
+    which can be opened in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self) -> None:
+        self.events: list[TraceEvent] = []
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, args: dict[str, Any]) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": start / 1000,
+                    "dur": (end - start) / 1000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def write_trace(self, path: Path) -> None:
+        raw_trace = {
+            "traceEvents": sorted(self.events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+        }
+        path.write_text(json.dumps(raw_trace))
+
+    def summary(self, top: int = 10) -> str:
+        """\
+        Lists the `top` spans with the most total (inclusive) time,
+        aggregated by name across every process.
+        """
+        totals: dict[str, list[float]] = defaultdict(list)
+        for event in self.events:
+            totals[event["name"]].append(event["dur"] / 1000)
+
+        ranked = sorted(totals.items(), key=lambda item: sum(item[1]), reverse=True)
+        ranked = ranked[:top]
+        width = max([len("span"), *(len(name) for name, _ in ranked)])
+        lines = [f"{'span':<{width}} {'calls':>6} {'total':>11} {'max':>11}"]
+        for name, durations in ranked:
+            lines.append(
+                f"{name:<{width}} {len(durations):>6} "
+                f"{sum(durations):>9.2f}ms {max(durations):>9.2f}ms"
+            )
+        return "\n".join(lines)
+
+
+def enable() -> Profiler:
+    """\
+    Starts a new profile, discarding any spans recorded before
+    (e.g. those a forked worker process inherited from its parent).
+    """
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> Optional[Profiler]:
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def is_enabled() -> bool:
+    return _profiler is not None
+
+
+def span(
+    name: str, category: str = "chaos", **args: Any
+) -> contextlib.AbstractContextManager[None]:
+    """\
+    Times the enclosed block as a span called `name`, if profiling is enabled.
+    """
+    if _profiler is None:
+        return _DISABLED
+    return _profiler.span(name, category, args)
+
+
+def collect(events: list[TraceEvent]) -> None:
+    """\
+    Adds spans recorded elsewhere (e.g. in a worker process) to the current profile.
+    """
+    if _profiler is not None:
+        _profiler.events.extend(events)
+
+
+@contextlib.contextmanager
+def profile(trace_path: Optional[Path], top: int = 10) -> Iterator[None]:
+    """\
+    Profiles the enclosed block if `trace_path` is given,
+    then writes a Chrome trace there and a summary of the slowest spans to stderr.
+    """
+    if trace_path is None:
+        yield
+        return
+
+    profiler = enable()
+    try:
+        yield
+    finally:
+        disable()
+        profiler.write_trace(trace_path)
+        click.echo(profiler.summary(top), err=True)
+        click.echo(f"Wrote trace to {trace_path}", err=True)
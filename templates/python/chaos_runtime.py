@@ -0,0 +1,1949 @@
+"""\
+Runtime support for servers generated by chaos.
+
+This file is copied verbatim next to the generated `server.py`,
+so it may only depend on the server's own requirements.
+"""
+import asyncio
+import atexit
+import contextlib
+import functools
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from abc import ABC
+from abc import abstractmethod
+from bisect import bisect_left
+from collections import deque
+from collections import OrderedDict
+from types import ModuleType
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+from urllib.parse import parse_qsl
+
+import anyio
+import anyio.to_thread
+import fastapi
+import fastapi.datastructures
+import fastapi.responses
+import fastapi.routing
+import fastapi.utils
+
+
+logger = logging.getLogger("chaos")
+if not logger.handlers:
+    # Match the format of uvicorn's own logs.
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(levelname)s:     %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+Scope = dict[str, Any]
+Message = dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+class CachedResponse:
+    def __init__(self, status: int, headers: list[tuple[bytes, bytes]], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    async def send(self, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status,
+                "headers": [*self.headers, (b"x-chaos-cache", b"hit")],
+            }
+        )
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class ResponseCache:
+    """\
+    A bounded LRU cache of the successful GET responses of an endpoint's routes.
+    Concurrent misses for the same key wait for a single call to the handler.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_entries: int,
+        vary_on: Optional[list[str]] = None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.vary_on = vary_on or []
+        self.entries: OrderedDict[
+            Hashable, tuple[float, CachedResponse]
+        ] = OrderedDict()
+        self.pending: dict[Hashable, asyncio.Future[Optional[CachedResponse]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        response_caches[name] = self
+
+    def key(self, route_path: str, scope: Scope) -> Hashable:
+        if not self.vary_on:
+            query = tuple(sorted(parse_qsl(scope["query_string"].decode("latin-1"))))
+            return (route_path, scope["path"], query)
+
+        path_params = scope.get("path_params", {})
+        query_params = parse_qsl(scope["query_string"].decode("latin-1"))
+        values = []
+        for name in self.vary_on:
+            if name in path_params:
+                values.append(str(path_params[name]))
+            else:
+                values.append(
+                    tuple(value for key, value in query_params if key == name)
+                )
+        return (route_path, *values)
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return response
+
+    def put(self, key: Hashable, response: CachedResponse) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def wrap(self, app: ASGIApp, route_path: str) -> ASGIApp:
+        async def cached_app(scope: Scope, receive: Receive, send: Send) -> None:
+            if scope["type"] != "http" or scope["method"] != "GET":
+                await app(scope, receive, send)
+                return
+
+            key = self.key(route_path, scope)
+            while True:
+                response = self.get(key)
+                if response is not None:
+                    self.hits += 1
+                    await response.send(send)
+                    return
+
+                pending = self.pending.get(key)
+                if pending is None:
+                    break
+                # Another request is already calling the handler for this key.
+                if await asyncio.shield(pending) is None:
+                    # ...but its response can't be cached, so call the handler too.
+                    self.misses += 1
+                    await app(scope, receive, send)
+                    return
+
+            self.misses += 1
+            future: asyncio.Future[
+                Optional[CachedResponse]
+            ] = asyncio.get_running_loop().create_future()
+            self.pending[key] = future
+            response = None
+            try:
+                response = await self.record(app, scope, receive, send)
+                if response is not None:
+                    self.put(key, response)
+            finally:
+                del self.pending[key]
+                future.set_result(response)
+
+        return cached_app
+
+    async def record(
+        self, app: ASGIApp, scope: Scope, receive: Receive, send: Send
+    ) -> Optional[CachedResponse]:
+        """\
+        Calls `app`, passing its response through to `send`,
+        and returns the response if it can be cached.
+        """
+        start: Optional[Message] = None
+        body = bytearray()
+        complete = False
+
+        async def recording_send(message: Message) -> None:
+            nonlocal start, complete
+            if message["type"] == "http.response.start":
+                start = message
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"x-chaos-cache", b"miss"),
+                    ],
+                }
+            elif message["type"] == "http.response.body":
+                body.extend(message.get("body", b""))
+                complete = not message.get("more_body", False)
+            await send(message)
+
+        await app(scope, receive, recording_send)
+        if start is None or start["status"] != 200 or not complete:
+            return None
+        return CachedResponse(
+            start["status"], list(start.get("headers", [])), bytes(body)
+        )
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Every response cache in the server by name, e.g. for reporting their counters.
+# `python server.py` runs the server module twice (as `__main__`, and then as `server`
+# for uvicorn), so the caches of the app which is served replace those of the first run,
+# rather than being reported twice.
+response_caches: dict[str, ResponseCache] = {}
+
+
+# The upper bounds of the request latency histogram's buckets, in seconds.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Set in the scope of warm-up requests, which aren't counted as the routes' requests.
+WARMUP_SCOPE_KEY = "chaos.warmup"
+
+
+def format_labels(**labels: str) -> str:
+    escaped = (
+        value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in labels.values()
+    )
+    return ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+
+
+class RouteMetrics:
+    """\
+    The counters of a single route. Everything is allocated up front,
+    so that recording a request only updates existing counters.
+    """
+
+    __slots__ = ("labels", "requests", "errors", "in_flight", "buckets", "total")
+
+    def __init__(self, labels: str):
+        self.labels = labels
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        # The number of requests in each bucket (not cumulative),
+        # and then the number slower than the last bucket.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+
+
+class Metrics:
+    """\
+    Counts requests to each route, and how long each group took to import,
+    for `MetricsApp` to report in the Prometheus text format.
+    Counters belong to a single worker process.
+    """
+
+    def __init__(self) -> None:
+        # Created at the top of `server.py`, so this is roughly when the worker started.
+        self.created = time.perf_counter()
+        self.startup_seconds: Optional[float] = None
+        self.routes: list[RouteMetrics] = []
+
+    def wrap(
+        self, app: ASGIApp, group: str, route: fastapi.routing.APIRoute
+    ) -> ASGIApp:
+        metrics = RouteMetrics(
+            format_labels(
+                group=group,
+                route=route.path,
+                method=",".join(sorted(route.methods or ())),
+            )
+        )
+        self.routes.append(metrics)
+        perf_counter = time.perf_counter
+
+        async def timed_app(scope: Scope, receive: Receive, send: Send) -> None:
+            if WARMUP_SCOPE_KEY in scope:
+                await app(scope, receive, send)
+                return
+
+            metrics.in_flight += 1
+            start = perf_counter()
+            try:
+                await app(scope, receive, send)
+            except BaseException:
+                metrics.errors += 1
+                raise
+            finally:
+                elapsed = perf_counter() - start
+                metrics.in_flight -= 1
+                metrics.requests += 1
+                metrics.total += elapsed
+                metrics.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+        return timed_app
+
+    def render(self) -> str:
+        lines = [
+            "# HELP chaos_requests_total Requests handled by each route.",
+            "# TYPE chaos_requests_total counter",
+        ]
+        for route in self.routes:
+            lines.append(f"chaos_requests_total{{{route.labels}}} {route.requests}")
+
+        lines.append(
+            "# HELP chaos_request_errors_total "
+            "Requests to each route which raised an exception."
+        )
+        lines.append("# TYPE chaos_request_errors_total counter")
+        for route in self.routes:
+            lines.append(f"chaos_request_errors_total{{{route.labels}}} {route.errors}")
+
+        lines.append(
+            "# HELP chaos_requests_in_flight Requests being handled by each route."
+        )
+        lines.append("# TYPE chaos_requests_in_flight gauge")
+        for route in self.routes:
+            lines.append(
+                f"chaos_requests_in_flight{{{route.labels}}} {route.in_flight}"
+            )
+
+        lines.append(
+            "# HELP chaos_request_duration_seconds "
+            "How long each route took to handle requests."
+        )
+        lines.append("# TYPE chaos_request_duration_seconds histogram")
+        for route in self.routes:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, route.buckets):
+                cumulative += count
+                lines.append(
+                    f'chaos_request_duration_seconds_bucket{{{route.labels},le="{bound}"}} '
+                    f"{cumulative}"
+                )
+            lines.append(
+                f'chaos_request_duration_seconds_bucket{{{route.labels},le="+Inf"}} '
+                f"{route.requests}"
+            )
+            lines.append(
+                f"chaos_request_duration_seconds_sum{{{route.labels}}} {route.total}"
+            )
+            lines.append(
+                f"chaos_request_duration_seconds_count{{{route.labels}}} {route.requests}"
+            )
+
+        lines.append(
+            "# HELP chaos_group_import_seconds How long each group took to import."
+        )
+        lines.append("# TYPE chaos_group_import_seconds gauge")
+        for group, seconds in import_seconds.items():
+            lines.append(
+                f"chaos_group_import_seconds{{{format_labels(group=group)}}} {seconds}"
+            )
+
+        if warmup_seconds:
+            lines.append(
+                "# HELP chaos_group_warmup_seconds How long each group took to warm up."
+            )
+            lines.append("# TYPE chaos_group_warmup_seconds gauge")
+            for group, seconds in warmup_seconds.items():
+                lines.append(
+                    f"chaos_group_warmup_seconds{{{format_labels(group=group)}}} "
+                    f"{seconds}"
+                )
+
+        if self.startup_seconds is not None:
+            lines.append(
+                "# HELP chaos_startup_seconds "
+                "How long the worker took to import its groups and start up."
+            )
+            lines.append("# TYPE chaos_startup_seconds gauge")
+            lines.append(f"chaos_startup_seconds {self.startup_seconds}")
+
+        if concurrency_limiters:
+            lines.append(
+                "# HELP chaos_group_requests_active "
+                "Requests being handled by each group with a concurrency limit."
+            )
+            lines.append("# TYPE chaos_group_requests_active gauge")
+            for limiter in concurrency_limiters.values():
+                labels = format_labels(group=limiter.name)
+                lines.append(
+                    f"chaos_group_requests_active{{{labels}}} {limiter.active}"
+                )
+            lines.append(
+                "# HELP chaos_group_queue_depth "
+                "Requests waiting for their turn in each group."
+            )
+            lines.append("# TYPE chaos_group_queue_depth gauge")
+            for limiter in concurrency_limiters.values():
+                labels = format_labels(group=limiter.name)
+                lines.append(f"chaos_group_queue_depth{{{labels}}} {limiter.queued}")
+            lines.append(
+                "# HELP chaos_group_rejected_requests_total "
+                "Requests turned away because their group's queue was full."
+            )
+            lines.append("# TYPE chaos_group_rejected_requests_total counter")
+            for limiter in concurrency_limiters.values():
+                labels = format_labels(group=limiter.name)
+                lines.append(
+                    f"chaos_group_rejected_requests_total{{{labels}}} {limiter.rejected}"
+                )
+
+        if threadpools:
+            lines.append(
+                "# HELP chaos_group_threads Threads available to each group's sync routes."
+            )
+            lines.append("# TYPE chaos_group_threads gauge")
+            for threadpool in threadpools.values():
+                labels = format_labels(group=threadpool.name)
+                lines.append(f"chaos_group_threads{{{labels}}} {threadpool.size}")
+            lines.append(
+                "# HELP chaos_group_threads_busy "
+                "Threads running each group's sync routes."
+            )
+            lines.append("# TYPE chaos_group_threads_busy gauge")
+            for threadpool in threadpools.values():
+                labels = format_labels(group=threadpool.name)
+                lines.append(
+                    f"chaos_group_threads_busy{{{labels}}} {min(threadpool.calls, threadpool.size)}"
+                )
+            lines.append(
+                "# HELP chaos_group_thread_waits_total "
+                "Calls to each group's sync routes which had to wait for a thread."
+            )
+            lines.append("# TYPE chaos_group_thread_waits_total counter")
+            for threadpool in threadpools.values():
+                labels = format_labels(group=threadpool.name)
+                lines.append(
+                    f"chaos_group_thread_waits_total{{{labels}}} {threadpool.waits}"
+                )
+
+        if response_caches:
+            for counter in ("hits", "misses", "evictions"):
+                lines.append(f"# TYPE chaos_response_cache_{counter}_total counter")
+                for cache in response_caches.values():
+                    labels = format_labels(cache=cache.name)
+                    lines.append(
+                        f"chaos_response_cache_{counter}_total{{{labels}}} "
+                        f"{getattr(cache, counter)}"
+                    )
+            lines.append("# TYPE chaos_response_cache_entries gauge")
+            for cache in response_caches.values():
+                labels = format_labels(cache=cache.name)
+                lines.append(
+                    f"chaos_response_cache_entries{{{labels}}} {len(cache.entries)}"
+                )
+        return "".join(f"{line}\n" for line in lines)
+
+
+class MetricsApp:
+    """\
+    Wraps an ASGI app, serving `metrics` at `path`,
+    and recording when the wrapped app has started up.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: Metrics, path: str = "/metrics"):
+        self.app = app
+        self.metrics = metrics
+        self.path = path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] == self.path:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/plain; version=0.0.4; charset=utf-8"),
+                    ],
+                }
+            )
+            await send(
+                {"type": "http.response.body", "body": self.metrics.render().encode()}
+            )
+            return
+
+        if scope["type"] == "lifespan":
+
+            async def lifespan_send(message: Message) -> None:
+                if message["type"] == "lifespan.startup.complete":
+                    self.metrics.startup_seconds = (
+                        time.perf_counter() - self.metrics.created
+                    )
+                await send(message)
+
+            await self.app(scope, receive, lifespan_send)
+            return
+
+        await self.app(scope, receive, send)
+
+
+@functools.lru_cache(maxsize=None)
+def response_class(serializer: str) -> type[fastapi.responses.JSONResponse]:
+    """\
+    Returns the response class which encodes JSON with `serializer`,
+    falling back to the standard library's `json` if it isn't installed.
+    """
+    if serializer == "orjson":
+        if importlib.util.find_spec("orjson") is not None:
+            return fastapi.responses.ORJSONResponse
+        logger.warning("orjson isn't installed, so responses are encoded with json")
+    return fastapi.responses.JSONResponse
+
+
+def uses_response_parameter(dependant: Any) -> bool:
+    return dependant.response_param_name is not None or any(
+        uses_response_parameter(dependency) for dependency in dependant.dependencies
+    )
+
+
+def encode_directly(route: fastapi.routing.APIRoute) -> None:
+    """\
+    Makes a route which responds with orjson encode what its endpoint returns directly,
+    rather than through FastAPI's `jsonable_encoder` (which takes far longer than
+    orjson itself). Anything orjson can't encode, like a pydantic model, still goes
+    through `jsonable_encoder`. Routes with a response model, or which can set their
+    response's status or headers through a `Response` parameter, are left alone.
+    """
+    response_class = route.response_class
+    if isinstance(response_class, fastapi.datastructures.DefaultPlaceholder):
+        response_class = response_class.value
+    if response_class is not fastapi.responses.ORJSONResponse:
+        return
+    if route.response_field is not None or uses_response_parameter(route.dependant):
+        return
+    status_code = route.status_code or 200
+    if not fastapi.utils.is_body_allowed_for_status_code(status_code):
+        return
+
+    import orjson
+
+    def encode(content: Any) -> Any:
+        if isinstance(content, fastapi.Response):
+            return content
+        try:
+            body = orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return content
+        return fastapi.Response(body, status_code, media_type="application/json")
+
+    call = route.dependant.call
+    assert call is not None
+    encoding_call: Callable[..., Any]
+    if asyncio.iscoroutinefunction(call):
+
+        async def encoding_call(**values: Any) -> Any:
+            return encode(await call(**values))
+
+    else:
+
+        def encoding_call(**values: Any) -> Any:
+            return encode(call(**values))
+
+    route.dependant.call = encoding_call
+    route.app = fastapi.routing.request_response(route.get_route_handler())
+
+
+class ConcurrencyLimiter:
+    """\
+    Limits how many of a group's requests this process handles at once, queueing up to
+    `max_queue` more in arrival order, and turning away the rest with a 503
+    rather than letting them pile up. Admitting, queueing and releasing
+    a request are all constant time.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int = 0):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        # Requests which were cancelled while they waited are left in `waiters`
+        # until they reach the front, so `queued` is the actual queue depth.
+        self.waiters: deque[asyncio.Future[None]] = deque()
+        self.queued = 0
+        self.rejected = 0
+        concurrency_limiters[name] = self
+
+    async def wait(self) -> bool:
+        """\
+        Waits for a turn to handle a request, unless the queue is full.
+        """
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        self.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self.queued -= 1
+            else:
+                # The request was handed a turn just as it was cancelled.
+                self.release()
+            raise
+        return True
+
+    def release(self) -> None:
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                # Hand the turn straight to the next request, so `active` is unchanged.
+                self.queued -= 1
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def wrap(self, app: ASGIApp) -> ASGIApp:
+        async def limited_app(scope: Scope, receive: Receive, send: Send) -> None:
+            if self.active < self.max_concurrency and not self.queued:
+                self.active += 1
+            elif not await self.wait():
+                await send(
+                    {
+                        "type": "http.response.start",
+                        "status": 503,
+                        "headers": [
+                            (b"content-type", b"text/plain; charset=utf-8"),
+                            (b"retry-after", b"1"),
+                        ],
+                    }
+                )
+                await send({"type": "http.response.body", "body": b"Overloaded"})
+                return
+
+            try:
+                await app(scope, receive, send)
+            finally:
+                self.release()
+
+        return limited_app
+
+
+# Every concurrency limiter in the server by group, e.g. for reporting their counters.
+# Keyed like `response_caches`, so that each limiter is only reported once.
+concurrency_limiters: dict[str, ConcurrencyLimiter] = {}
+
+
+# How often to warn that a group's threadpool is saturated, in seconds.
+SATURATION_WARNING_INTERVAL = 60.0
+
+
+class Threadpool:
+    """\
+    Runs a group's sync endpoints on threads with the group's own capacity limiter,
+    rather than the default limiter which every group shares,
+    so that one group's blocking handlers can't use up the threads of the others.
+    """
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        # Created on first use, because AnyIO needs to know which event loop it's for.
+        self.limiter: Optional[anyio.CapacityLimiter] = None
+        # Calls which are running or waiting for a thread, counted here rather than
+        # by the limiter, which only takes a token once the call has yielded.
+        self.calls = 0
+        # How many calls had to wait for a thread.
+        self.waits = 0
+        self.last_warning = -SATURATION_WARNING_INTERVAL
+        threadpools[name] = self
+
+    async def run(self, function: Callable[..., Any], **values: Any) -> Any:
+        if self.limiter is None:
+            self.limiter = anyio.CapacityLimiter(self.size)
+        self.calls += 1
+        if self.calls > self.size:
+            self.waits += 1
+            now = time.monotonic()
+            if now - self.last_warning >= SATURATION_WARNING_INTERVAL:
+                self.last_warning = now
+                logger.warning(
+                    "threadpool of group %s is saturated: %d threads busy, "
+                    "%d calls waiting",
+                    self.name,
+                    self.size,
+                    self.calls - self.size,
+                )
+        try:
+            return await anyio.to_thread.run_sync(
+                functools.partial(function, **values), limiter=self.limiter
+            )
+        finally:
+            self.calls -= 1
+
+    def wrap(self, route: fastapi.routing.APIRoute) -> None:
+        call = route.dependant.call
+        if call is None or asyncio.iscoroutinefunction(call):
+            return
+
+        async def threaded_call(**values: Any) -> Any:
+            return await self.run(call, **values)
+
+        route.dependant.call = threaded_call
+        # Route handlers decide how to call their endpoint when they're created.
+        route.app = fastapi.routing.request_response(route.get_route_handler())
+
+
+# Every group threadpool in the server by group, e.g. for reporting their counters.
+# Keyed like `response_caches`, so that each threadpool is only reported once.
+threadpools: dict[str, Threadpool] = {}
+
+
+class Router:
+    """\
+    A router in a group's module, and the cache for its routes, if any.
+    The routers of isolated groups are passed the arguments of their cache instead,
+    which each of the group's workers builds its own cache from.
+    """
+
+    def __init__(
+        self,
+        attribute: str,
+        cache: Optional[ResponseCache] = None,
+        worker_cache: Optional[dict[str, Any]] = None,
+    ):
+        self.attribute = attribute
+        self.cache = cache
+        self.worker_cache = worker_cache
+
+
+def include_router(
+    app: fastapi.FastAPI,
+    router: fastapi.APIRouter,
+    cache: Optional[ResponseCache] = None,
+    metrics: Optional[Metrics] = None,
+    group: str = "",
+    default_response_class: Optional[type[fastapi.responses.Response]] = None,
+    limiter: Optional[ConcurrencyLimiter] = None,
+    threadpool: Optional[Threadpool] = None,
+) -> None:
+    """\
+    Includes `router` in `app`, serving the routes it adds through `cache`,
+    limiting them with `limiter`, and counting their requests in `metrics` under `group`.
+    Routes which respond with orjson encode their responses directly,
+    and sync routes run on `threadpool`.
+    """
+    first_route = len(app.router.routes)
+    if default_response_class is None:
+        app.include_router(router)
+    else:
+        app.include_router(router, default_response_class=default_response_class)
+    for route in app.router.routes[first_route:]:
+        if isinstance(route, fastapi.routing.APIRoute):
+            encode_directly(route)
+            if threadpool is not None:
+                threadpool.wrap(route)
+            if limiter is not None:
+                # Inside of the cache, so that cache hits don't wait for a turn.
+                route.app = limiter.wrap(route.app)
+            if cache is not None:
+                route.app = cache.wrap(route.app, route.path)
+            if metrics is not None:
+                # Outside of the cache, so that cache hits are counted too.
+                route.app = metrics.wrap(route.app, group, route)
+
+
+def include_group(
+    app: fastapi.FastAPI,
+    group: "Group",
+    module: ModuleType,
+    metrics: Optional[Metrics] = None,
+) -> None:
+    for router in group.routers:
+        include_router(
+            app,
+            getattr(module, router.attribute),
+            cache=router.cache,
+            metrics=metrics,
+            group=group.name,
+            default_response_class=None
+            if group.serializer is None
+            else response_class(group.serializer),
+            limiter=group.limiter,
+            threadpool=group.threadpool,
+        )
+
+
+# How long each group took to import, in seconds.
+# This belongs to the process rather than to a `Metrics`, because `python server.py`
+# runs the server module twice (as `__main__`, and then as `server` for uvicorn),
+# and only the first of those actually imports the groups.
+import_seconds: dict[str, float] = {}
+
+
+def import_group(name: str, module: str) -> ModuleType:
+    already_imported = module in sys.modules
+    start = time.perf_counter()
+    imported = importlib.import_module(module)
+    elapsed = time.perf_counter() - start
+    if not already_imported:
+        logger.info("imported group %s (%s) in %.3fs", name, module, elapsed)
+        import_seconds[name] = elapsed
+    return imported
+
+
+# A node in a prefix trie of path segments:
+# the index of the group which owns the path up to this node, if any,
+# and the child node for each following path segment.
+TrieNode = tuple[Optional[int], dict[str, "TrieNode"]]
+
+
+def lookup(trie: TrieNode, path: str) -> Optional[int]:
+    """\
+    Finds the group with the longest prefix of `path`.
+    This depends on the depth of the path, not on the number of groups or routes.
+    """
+    owner, children = trie
+    for segment in path.split("/"):
+        if not segment:
+            continue
+        node = children.get(segment)
+        if node is None:
+            break
+        if node[0] is not None:
+            owner = node[0]
+        children = node[1]
+    return owner
+
+
+class Group:
+    def __init__(
+        self,
+        name: str,
+        module: str,
+        lazy: bool = True,
+        routers: Optional[list[Router]] = None,
+        workers: int = 0,
+        serializer: Optional[str] = None,
+        warmup_hook: Optional[str] = None,
+        limiter: Optional[ConcurrencyLimiter] = None,
+        threadpool: Optional[Threadpool] = None,
+    ):
+        self.name = name
+        self.module = module
+        self.lazy = lazy
+        self.routers = routers if routers is not None else [Router("router")]
+        # How many worker processes this process starts for the group,
+        # or 0 to serve it in this process.
+        self.workers = workers
+        # Overrides the app's default response class, see `response_class`.
+        self.serializer = serializer
+        # Called by each of the group's worker processes before they serve requests.
+        self.warmup_hook = warmup_hook
+        # Shared by all of the group's routes, or its workers.
+        self.limiter = limiter
+        self.threadpool = threadpool
+        self.loaded = False
+        # The group's own app, when each group is served by a separate app.
+        self.app: Optional[fastapi.FastAPI] = None
+        self.pool: Optional[WorkerPool] = None
+        # Created on first use, so that it belongs to the server's event loop.
+        self.lock: Optional[asyncio.Lock] = None
+
+
+# Group worker processes answer health checks on this path. Requests only reach
+# a worker if they match one of its group's prefixes, so clients can't reach it.
+HEALTH_CHECK_PATH = "/_chaos/health"
+HEALTH_CHECK_INTERVAL = 1.0
+HEALTH_CHECK_TIMEOUT = 2.0
+# How many health checks in a row an idle worker may fail before it's restarted.
+HEALTH_CHECK_FAILURES = 3
+WORKER_STARTUP_TIMEOUT = 30.0
+# Only the server connects to its workers, so their connections can stay open.
+WORKER_KEEP_ALIVE = 3600
+MAX_IDLE_CONNECTIONS = 64
+READ_SIZE = 64 * 1024
+
+# Headers which only describe a single connection, and so aren't forwarded.
+HOP_BY_HOP_HEADERS = frozenset(
+    (
+        b"connection",
+        b"keep-alive",
+        b"proxy-authenticate",
+        b"proxy-authorization",
+        b"te",
+        b"trailer",
+        b"transfer-encoding",
+        b"upgrade",
+    )
+)
+
+Connection = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+async def read_request(scope: Scope, receive: Receive) -> Optional[bytes]:
+    """\
+    Reads a request from an ASGI server, and encodes it as HTTP/1.1.
+    Returns `None` if the client disconnects first.
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body.extend(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+
+    target = scope.get("raw_path") or scope["path"].encode()
+    if scope["query_string"]:
+        target += b"?" + scope["query_string"]
+    lines = [b"%s %s HTTP/1.1" % (scope["method"].encode(), target)]
+    has_host = False
+    for name, value in scope["headers"]:
+        if name in HOP_BY_HOP_HEADERS or name == b"content-length":
+            continue
+        has_host = has_host or name == b"host"
+        lines.append(b"%s: %s" % (name, value))
+    if not has_host:
+        lines.append(b"host: chaos")
+    lines.append(b"content-length: %d" % len(body))
+    return b"\r\n".join(lines) + b"\r\n\r\n" + body
+
+
+async def read_response_head(
+    reader: asyncio.StreamReader,
+) -> tuple[int, list[tuple[bytes, bytes]]]:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Worker closed the connection")
+    status = int(status_line.split()[1])
+
+    headers = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Worker closed the connection")
+        if line in (b"\r\n", b"\n"):
+            return status, headers
+        name, _, value = line.partition(b":")
+        headers.append((name.strip().lower(), value.strip()))
+
+
+async def send_error(send: Send, status: int, reason: bytes) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        }
+    )
+    await send({"type": "http.response.body", "body": reason})
+
+
+class WorkerUnavailable(Exception):
+    """\
+    Raised when a worker can't be connected to, so it never saw the request.
+    """
+
+
+class Worker:
+    def __init__(self, index: int, socket_path: str):
+        self.index = index
+        self.socket_path = socket_path
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.healthy = False
+        self.failed_checks = 0
+        self.in_flight = 0
+        self.idle: list[Connection] = []
+
+    async def connect(self) -> Connection:
+        return await asyncio.open_unix_connection(self.socket_path)
+
+    def close_idle(self) -> None:
+        for _, writer in self.idle:
+            writer.close()
+        self.idle.clear()
+
+
+class WorkerPool:
+    """\
+    Serves a group from separate worker processes, so that the group can't hold up
+    requests to the rest of the server. Requests are forwarded to the least busy worker
+    over a Unix socket, and connections to the workers are kept open for reuse.
+    Workers which exit, or which stop answering health checks while idle, are restarted.
+    """
+
+    def __init__(self, group: "Group"):
+        self.group = group
+        self.workers: list[Worker] = []
+        self.next_worker = 0
+        self.socket_directory: Optional[str] = None
+        self.health_task: Optional[asyncio.Task[None]] = None
+        # Requests wait for their turn here rather than in the workers,
+        # so that requests which are turned away are never forwarded.
+        self.handle: ASGIApp = self.forward_request
+        if group.limiter is not None:
+            self.handle = group.limiter.wrap(self.forward_request)
+
+    def worker_spec(self, worker: Worker) -> str:
+        return json.dumps(
+            {
+                "name": self.group.name,
+                "module": self.group.module,
+                "serializer": self.group.serializer,
+                "warmup_hook": self.group.warmup_hook,
+                "threadpool_size": None
+                if self.group.threadpool is None
+                else self.group.threadpool.size,
+                "socket": worker.socket_path,
+                "routers": [
+                    {
+                        "attribute": router.attribute,
+                        "cache": router.worker_cache,
+                    }
+                    for router in self.group.routers
+                ],
+            }
+        )
+
+    async def start(self) -> None:
+        self.socket_directory = tempfile.mkdtemp(prefix="chaos-")
+        self.workers = [
+            Worker(index, os.path.join(self.socket_directory, f"{index}.sock"))
+            for index in range(self.group.workers)
+        ]
+        await asyncio.gather(*(self.spawn(worker) for worker in self.workers))
+        self.health_task = asyncio.create_task(self.check_health())
+
+    async def stop(self) -> None:
+        if self.health_task is not None:
+            self.health_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.health_task
+        for worker in self.workers:
+            worker.healthy = False
+            worker.close_idle()
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                await worker.process.wait()
+        if self.socket_directory is not None:
+            shutil.rmtree(self.socket_directory, ignore_errors=True)
+
+    async def spawn(self, worker: Worker) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(worker.socket_path)
+        # Workers import the group the same way that the server does.
+        python_path = os.pathsep.join(path or os.getcwd() for path in sys.path)
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            __file__,
+            "worker",
+            self.worker_spec(worker),
+            env={**os.environ, "PYTHONPATH": python_path},
+        )
+
+        deadline = time.monotonic() + WORKER_STARTUP_TIMEOUT
+        while not await self.check(worker):
+            if worker.process.returncode is not None:
+                raise RuntimeError(
+                    f"Worker {worker.index} of group {self.group.name} "
+                    f"exited with {worker.process.returncode} while starting"
+                )
+            if time.monotonic() > deadline:
+                worker.process.kill()
+                await worker.process.wait()
+                raise TimeoutError(
+                    f"Worker {worker.index} of group {self.group.name} didn't start "
+                    f"within {WORKER_STARTUP_TIMEOUT}s"
+                )
+            await asyncio.sleep(0.05)
+        worker.failed_checks = 0
+        worker.healthy = True
+
+    async def check(self, worker: Worker) -> bool:
+        try:
+            reader, writer = await asyncio.wait_for(
+                worker.connect(), HEALTH_CHECK_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        try:
+            writer.write(
+                b"GET %s HTTP/1.1\r\nhost: chaos\r\nconnection: close\r\n\r\n"
+                % HEALTH_CHECK_PATH.encode()
+            )
+            status, _ = await asyncio.wait_for(
+                read_response_head(reader), HEALTH_CHECK_TIMEOUT
+            )
+            return status == 200
+        except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+            return False
+        finally:
+            writer.close()
+
+    async def restart(self, worker: Worker) -> None:
+        worker.healthy = False
+        worker.close_idle()
+        assert worker.process is not None
+        if worker.process.returncode is None:
+            worker.process.kill()
+            await worker.process.wait()
+        try:
+            await self.spawn(worker)
+        except Exception:
+            # The next health check tries again.
+            logger.exception(
+                "failed to restart worker %d of group %s", worker.index, self.group.name
+            )
+
+    async def check_health(self) -> None:
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            for worker in self.workers:
+                assert worker.process is not None
+                if worker.process.returncode is not None:
+                    logger.warning(
+                        "worker %d of group %s exited with %s, restarting it",
+                        worker.index,
+                        self.group.name,
+                        worker.process.returncode,
+                    )
+                    await self.restart(worker)
+                    continue
+
+                # A worker which is busy with a slow request can't be expected to
+                # answer quickly, so it's only restarted if it exits.
+                if worker.in_flight:
+                    continue
+                if await self.check(worker):
+                    worker.failed_checks = 0
+                    worker.healthy = True
+                    continue
+                worker.failed_checks += 1
+                if worker.failed_checks >= HEALTH_CHECK_FAILURES:
+                    logger.warning(
+                        "worker %d of group %s failed %d health checks, restarting it",
+                        worker.index,
+                        self.group.name,
+                        worker.failed_checks,
+                    )
+                    await self.restart(worker)
+
+    def choose(self) -> Optional[Worker]:
+        """\
+        Picks the healthy worker with the fewest requests in flight,
+        starting from a different worker each time to spread out ties.
+        """
+        chosen = None
+        for offset in range(len(self.workers)):
+            worker = self.workers[(self.next_worker + offset) % len(self.workers)]
+            if worker.healthy and (
+                chosen is None or worker.in_flight < chosen.in_flight
+            ):
+                chosen = worker
+        self.next_worker = (self.next_worker + 1) % max(len(self.workers), 1)
+        return chosen
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.handle(scope, receive, send)
+
+    async def forward_request(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            # Only HTTP requests are forwarded to workers.
+            if scope["type"] == "websocket":
+                await receive()
+                await send({"type": "websocket.close", "code": 1011})
+            return
+
+        request = await read_request(scope, receive)
+        if request is None:
+            return
+
+        started = False
+
+        async def forwarding_send(message: Message) -> None:
+            nonlocal started
+            started = True
+            await send(message)
+
+        while True:
+            worker = self.choose()
+            if worker is None:
+                await send_error(send, 503, b"Service Unavailable")
+                return
+
+            worker.in_flight += 1
+            try:
+                await self.forward(worker, request, scope["method"], forwarding_send)
+                return
+            except WorkerUnavailable:
+                # Leave the worker to the health checks, and try another one.
+                worker.healthy = False
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                logger.exception(
+                    "failed to forward a request to worker %d of group %s",
+                    worker.index,
+                    self.group.name,
+                )
+                if not started:
+                    await send_error(send, 502, b"Bad Gateway")
+                return
+            finally:
+                worker.in_flight -= 1
+
+    async def forward(
+        self, worker: Worker, request: bytes, method: str, send: Send
+    ) -> None:
+        while True:
+            reused = bool(worker.idle)
+            if reused:
+                reader, writer = worker.idle.pop()
+            else:
+                try:
+                    reader, writer = await worker.connect()
+                except OSError as error:
+                    raise WorkerUnavailable(str(error)) from error
+            try:
+                writer.write(request)
+                status, headers = await read_response_head(reader)
+                break
+            except (OSError, ValueError, IndexError):
+                writer.close()
+                # The worker may have closed an idle connection,
+                # in which case it never saw the request, so it's safe to try again.
+                if not reused:
+                    raise
+            except BaseException:
+                writer.close()
+                raise
+
+        try:
+            length: Optional[int] = None
+            chunked = False
+            keep_alive = True
+            response_headers = []
+            for name, value in headers:
+                if name == b"content-length":
+                    length = int(value)
+                elif name == b"transfer-encoding":
+                    chunked = b"chunked" in value.lower()
+                elif name == b"connection":
+                    keep_alive = b"close" not in value.lower()
+                if name not in HOP_BY_HOP_HEADERS:
+                    response_headers.append((name, value))
+            if method == "HEAD" or status in (204, 304):
+                length = 0
+                chunked = False
+
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": status,
+                    "headers": response_headers,
+                }
+            )
+            if chunked:
+                await self.forward_chunks(reader, send)
+            elif length is not None:
+                while length > 0:
+                    body = await reader.readexactly(min(length, READ_SIZE))
+                    length -= len(body)
+                    await send(
+                        {"type": "http.response.body", "body": body, "more_body": True}
+                    )
+                await send({"type": "http.response.body", "body": b""})
+            else:
+                # The body ends when the worker closes the connection.
+                keep_alive = False
+                while body := await reader.read(READ_SIZE):
+                    await send(
+                        {"type": "http.response.body", "body": body, "more_body": True}
+                    )
+                await send({"type": "http.response.body", "body": b""})
+        except BaseException:
+            writer.close()
+            raise
+
+        if keep_alive and worker.healthy and len(worker.idle) < MAX_IDLE_CONNECTIONS:
+            worker.idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def forward_chunks(self, reader: asyncio.StreamReader, send: Send) -> None:
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                # Trailers, if any, end with an empty line.
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                await send({"type": "http.response.body", "body": b""})
+                return
+            body = await reader.readexactly(size)
+            await reader.readexactly(2)
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+
+
+class GroupLoader(ABC):
+    """\
+    Wraps an ASGI app, routing requests to groups by the prefix of their path.
+    Lazy groups are imported on the first request to one of their prefixes.
+    With `import_in_background`, every lazy group which hasn't been requested yet
+    is imported one at a time, once the server has started up.
+    """
+
+    def __init__(
+        self,
+        app: fastapi.FastAPI,
+        groups: list[Group],
+        trie: TrieNode,
+        import_in_background: bool = True,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.app = app
+        self.groups = groups
+        self.trie = trie
+        self.import_in_background = import_in_background
+        self.metrics = metrics
+        self.background_task: Optional[asyncio.Task[None]] = None
+        for group in groups:
+            if group.workers:
+                group.pool = WorkerPool(group)
+                # The group is never imported into this process.
+                group.loaded = True
+        app.router.on_startup.append(self.startup)
+        app.router.on_shutdown.append(self.shutdown)
+
+    def match(self, path: str) -> Optional[Group]:
+        index = lookup(self.trie, path)
+        if index is None:
+            return None
+        return self.groups[index]
+
+    @abstractmethod
+    async def include(self, group: Group, module: ModuleType) -> None:
+        """\
+        Serves the routes of `group`, once its `module` has been imported.
+        """
+
+    async def load(self, group: Group) -> None:
+        if group.loaded:
+            return
+        if group.lock is None:
+            group.lock = asyncio.Lock()
+
+        async with group.lock:
+            if group.loaded:
+                return
+            # Import on a thread, so that requests to other groups aren't blocked.
+            loop = asyncio.get_running_loop()
+            module = await loop.run_in_executor(
+                None, import_group, group.name, group.module
+            )
+            await self.include(group, module)
+            group.loaded = True
+
+    async def load_all(self) -> None:
+        for group in self.groups:
+            try:
+                await self.load(group)
+            except Exception:
+                logger.exception("failed to import group %s", group.name)
+
+    async def startup(self) -> None:
+        await asyncio.gather(
+            *(group.pool.start() for group in self.groups if group.pool is not None)
+        )
+        if self.import_in_background:
+            self.background_task = asyncio.create_task(self.load_all())
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(
+            *(group.pool.stop() for group in self.groups if group.pool is not None)
+        )
+
+
+class LazyGroups(GroupLoader):
+    """\
+    Includes the router of each group in the wrapped app once it has been imported.
+    """
+
+    async def include(self, group: Group, module: ModuleType) -> None:
+        include_group(self.app, group, module, self.metrics)
+        self.app.openapi_schema = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] in ("http", "websocket"):
+            group = self.match(scope["path"])
+            if group is not None and group.pool is not None:
+                await group.pool(scope, receive, send)
+                return
+            if group is not None and not group.loaded:
+                await self.load(group)
+        await self.app(scope, receive, send)
+
+
+class PrefixDispatcher(GroupLoader):
+    """\
+    Serves each group from its own app, so that a request is only matched
+    against the routes of the group that owns its prefix.
+    Requests which don't match any group's prefix go to the wrapped app.
+    """
+
+    def __init__(
+        self,
+        app: fastapi.FastAPI,
+        groups: list[Group],
+        trie: TrieNode,
+        import_in_background: bool = True,
+        metrics: Optional[Metrics] = None,
+    ):
+        super().__init__(app, groups, trie, import_in_background, metrics)
+        self.started = False
+        for group in groups:
+            if not group.lazy and not group.loaded:
+                module = import_group(group.name, group.module)
+                group.app = self.make_app(group, module)
+                group.loaded = True
+
+    def make_app(self, group: Group, module: ModuleType) -> fastapi.FastAPI:
+        group_app = fastapi.FastAPI(openapi_url=None)
+        include_group(group_app, group, module, self.metrics)
+        return group_app
+
+    async def include(self, group: Group, module: ModuleType) -> None:
+        group_app = self.make_app(group, module)
+        if self.started:
+            await group_app.router.startup()
+        group.app = group_app
+
+    async def startup(self) -> None:
+        for group in self.groups:
+            if group.app is not None:
+                await group.app.router.startup()
+        self.started = True
+        await super().startup()
+
+    async def shutdown(self) -> None:
+        for group in self.groups:
+            if group.app is not None:
+                await group.app.router.shutdown()
+        await super().shutdown()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] in ("http", "websocket"):
+            group = self.match(scope["path"])
+            if group is not None and group.pool is not None:
+                await group.pool(scope, receive, send)
+                return
+            if group is not None:
+                if not group.loaded:
+                    await self.load(group)
+                assert group.app is not None
+                await group.app(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+# How long each group took to warm up, in seconds. See `import_seconds`.
+warmup_seconds: dict[str, float] = {}
+
+# The directory in which each of the server's workers records that it's warm.
+READY_DIRECTORY_VARIABLE = "CHAOS_READY_DIRECTORY"
+
+
+def share_readiness() -> None:
+    """\
+    Creates a directory for the server's workers to record that they're warm in,
+    so that each of them only reports the server as ready once all of them are.
+    Called before uvicorn starts the workers, which inherit the environment.
+    """
+    directory = tempfile.mkdtemp(prefix="chaos-ready-")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    os.environ[READY_DIRECTORY_VARIABLE] = directory
+
+
+async def run_hook(name: str, module: ModuleType, hook: str) -> None:
+    """\
+    Calls a group's warm-up hook: on the event loop if it's async,
+    and otherwise on a thread, so that it doesn't block requests.
+    """
+    function = getattr(module, hook)
+    start = time.perf_counter()
+    if asyncio.iscoroutinefunction(function):
+        await function()
+    else:
+        await asyncio.get_running_loop().run_in_executor(None, function)
+    logger.info(
+        "ran warm-up hook %s.%s in %.3fs", name, hook, time.perf_counter() - start
+    )
+
+
+def make_request_scope(path: str) -> Scope:
+    path, _, query_string = path.partition("?")
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query_string.encode(),
+        "headers": [(b"host", b"chaos"), (b"user-agent", b"chaos-warmup")],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 0),
+    }
+
+
+async def call_app(
+    app: ASGIApp, scope: Scope, body: bytes = b""
+) -> tuple[Optional[int], list[tuple[bytes, bytes]], bytes]:
+    """\
+    Sends a request to `app` in-process, and returns the status, headers and body
+    of its response. The status is `None` if the app didn't respond.
+    """
+    status = None
+    headers: list[tuple[bytes, bytes]] = []
+    response_body = bytearray()
+    finished = asyncio.Event()
+    received = False
+
+    async def receive() -> Message:
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        nonlocal status, headers
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            headers = list(message.get("headers", []))
+        elif message["type"] == "http.response.body":
+            response_body.extend(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        finished.set()
+    return status, headers, bytes(response_body)
+
+
+class GroupWarmup:
+    """\
+    Warms up a group by calling its `hook` (if it has one),
+    and then sending `requests` requests to each of its example `paths`.
+    Lazy groups are imported by the first request to them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        module: str,
+        paths: Optional[list[str]] = None,
+        requests: int = 1,
+        hook: Optional[str] = None,
+    ):
+        self.name = name
+        self.module = module
+        self.paths = paths or []
+        self.requests = requests
+        self.hook = hook
+
+    async def warm_up(self, app: ASGIApp) -> None:
+        start = time.perf_counter()
+        if self.hook is not None:
+            loop = asyncio.get_running_loop()
+            module = await loop.run_in_executor(
+                None, import_group, self.name, self.module
+            )
+            await run_hook(self.name, module, self.hook)
+
+        for path in self.paths:
+            for _ in range(self.requests):
+                scope = make_request_scope(path)
+                scope[WARMUP_SCOPE_KEY] = True
+                status, _, _ = await call_app(app, scope)
+                if status is None or status >= 400:
+                    logger.warning(
+                        "warm-up request to %s (group %s) returned %s",
+                        path,
+                        self.name,
+                        status,
+                    )
+        warmup_seconds[self.name] = time.perf_counter() - start
+
+
+class Warmup:
+    """\
+    Wraps an ASGI app, warming up its groups once it has started up,
+    and serving the server's readiness at `path`:
+    503 while the groups are warming up, and 200 once they're done.
+    Groups are warmed up one at a time, so that they don't compete for the CPU.
+
+    Each of the server's `workers` warms itself up. If the server shares readiness
+    (see `share_readiness`), it's only ready once every worker is warm,
+    and otherwise once the worker which is asked is.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        groups: list[GroupWarmup],
+        path: str = "/ready",
+        workers: int = 1,
+    ):
+        self.app = app
+        self.groups = groups
+        self.path = path
+        self.workers = workers
+        self.directory = os.environ.get(READY_DIRECTORY_VARIABLE)
+        self.ready = False
+        self.seconds: Optional[float] = None
+        self.task: Optional[asyncio.Task[None]] = None
+
+    async def warm_up(self) -> None:
+        start = time.perf_counter()
+        for group in self.groups:
+            try:
+                await group.warm_up(self.app)
+            except Exception:
+                logger.exception("failed to warm up group %s", group.name)
+        self.seconds = time.perf_counter() - start
+        self.ready = True
+        if self.directory is not None:
+            with open(os.path.join(self.directory, str(os.getpid())), "w"):
+                pass
+        logger.info("warmed up in %.3fs", self.seconds)
+
+    def warm_workers(self) -> int:
+        """\
+        Counts the server's workers which are warm, including this one.
+        """
+        if self.directory is None:
+            return int(self.ready)
+
+        warm = 0
+        for entry in os.scandir(self.directory):
+            # Workers which have exited leave their records behind,
+            # and the workers which replace them have to warm up in turn.
+            try:
+                os.kill(int(entry.name), 0)
+            except (ValueError, ProcessLookupError):
+                continue
+            except PermissionError:
+                pass
+            warm += 1
+        return warm
+
+    async def send_readiness(self, send: Send) -> None:
+        if self.ready and self.warm_workers() >= self.workers:
+            status = 200
+            body: dict[str, Any] = {
+                "ready": True,
+                "warmup_seconds": self.seconds,
+                "groups": {
+                    group.name: warmup_seconds.get(group.name) for group in self.groups
+                },
+            }
+        else:
+            status = 503
+            body = {"ready": False}
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        await send({"type": "http.response.body", "body": json.dumps(body).encode()})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] == self.path:
+            await self.send_readiness(send)
+            return
+
+        if scope["type"] == "lifespan":
+
+            async def lifespan_receive() -> Message:
+                message = await receive()
+                if message["type"] == "lifespan.shutdown" and self.task is not None:
+                    # Before the app shuts down, so that it isn't sent any more requests.
+                    self.task.cancel()
+                return message
+
+            async def lifespan_send(message: Message) -> None:
+                if message["type"] == "lifespan.startup.complete":
+                    # Only once the app has started up, so that isolated groups'
+                    # workers are running, and requests can reach them.
+                    self.task = asyncio.create_task(self.warm_up())
+                await send(message)
+
+            await self.app(scope, lifespan_receive, lifespan_send)
+            return
+
+        await self.app(scope, receive, send)
+
+
+class BatchError(Exception):
+    def __init__(self, status: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class BatchApp:
+    """\
+    Wraps an ASGI app, serving `POST /_batch`, which makes several requests
+    to the wrapped app in-process and concurrently, in a single round trip.
+    The request body is a list of sub-requests, e.g.
+
+        [{"path": "/hello/chaos"}, {"method": "POST", "path": "/echo", "body": {...}}]
+
+    which inherit the batch request's headers (like its cookies),
+    and the response is a list of their responses, in the same order:
+
+        [{"status": 200, "headers": {...}, "body": "Hello chaos!"}, ...]
+
+    JSON response bodies are passed through as they are, rather than decoded
+    and encoded again. Other bodies are passed on as strings.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_requests: int = 20,
+        timeout: float = 5.0,
+        path: str = "/_batch",
+    ):
+        self.app = app
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.path = path
+
+    def make_scope(self, scope: Scope, sub_request: Any) -> tuple[Scope, bytes]:
+        if not isinstance(sub_request, dict):
+            raise BatchError(400, "Each sub-request must be an object")
+        method = sub_request.get("method", "GET")
+        path = sub_request.get("path")
+        raw_headers = sub_request.get("headers", {})
+        if not isinstance(method, str):
+            raise BatchError(400, "A sub-request's `method` must be a string")
+        if not isinstance(path, str) or not path.startswith("/"):
+            raise BatchError(400, "Each sub-request needs a `path` starting with /")
+        if not isinstance(raw_headers, dict) or not all(
+            isinstance(value, str) for value in raw_headers.values()
+        ):
+            raise BatchError(400, "A sub-request's `headers` must map names to strings")
+
+        sub_headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in raw_headers.items()
+        ]
+        body = b""
+        if "body" in sub_request:
+            body = json.dumps(sub_request["body"]).encode()
+            if b"content-type" not in dict(sub_headers):
+                sub_headers.append((b"content-type", b"application/json"))
+        sub_headers.append((b"content-length", str(len(body)).encode()))
+
+        # The batch request's own headers, unless the sub-request overrides them.
+        overridden = {name for name, _ in sub_headers}
+        headers = [
+            (name, value) for name, value in scope["headers"] if name not in overridden
+        ]
+        headers.extend(sub_headers)
+
+        path, _, query_string = path.partition("?")
+        sub_scope = {
+            **scope,
+            "method": method.upper(),
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query_string.encode(),
+            "headers": headers,
+        }
+        return sub_scope, body
+
+    async def call(self, scope: Scope, body: bytes) -> bytes:
+        try:
+            status, headers, response_body = await asyncio.wait_for(
+                call_app(self.app, scope, body), self.timeout
+            )
+        except asyncio.TimeoutError:
+            status, headers, response_body = 504, [], b"Gateway Timeout"
+        except Exception:
+            logger.exception("sub-request to %s failed", scope["path"])
+            status, headers, response_body = 500, [], b"Internal Server Error"
+        if status is None:
+            status, headers, response_body = 502, [], b"Bad Gateway"
+
+        header_dict = {
+            name.decode("latin-1"): value.decode("latin-1") for name, value in headers
+        }
+        if not response_body:
+            encoded_body = b"null"
+        elif header_dict.get("content-type", "").startswith("application/json"):
+            encoded_body = response_body
+        else:
+            encoded_body = json.dumps(response_body.decode("utf-8", "replace")).encode()
+        return b'{"status":%d,"headers":%s,"body":%s}' % (
+            status,
+            json.dumps(header_dict).encode(),
+            encoded_body,
+        )
+
+    async def batch(self, scope: Scope, receive: Receive) -> bytes:
+        if scope["method"] != "POST":
+            raise BatchError(405, "Method Not Allowed")
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise BatchError(400, "Client disconnected")
+            body.extend(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+
+        try:
+            sub_requests = json.loads(body)
+        except ValueError:
+            raise BatchError(400, "The body must be a JSON list of sub-requests")
+        if not isinstance(sub_requests, list):
+            raise BatchError(400, "The body must be a JSON list of sub-requests")
+        if len(sub_requests) > self.max_requests:
+            raise BatchError(
+                413, f"A batch can't have more than {self.max_requests} sub-requests"
+            )
+
+        scopes = [self.make_scope(scope, sub_request) for sub_request in sub_requests]
+        responses = await asyncio.gather(
+            *(self.call(sub_scope, sub_body) for sub_scope, sub_body in scopes)
+        )
+        return b"[" + b",".join(responses) + b"]"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            body = await self.batch(scope, receive)
+        except BatchError as error:
+            await send_error(send, error.status, error.reason.encode())
+            return
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def exit_with_parent(parent: int) -> None:
+    """\
+    Exits once the process which started this one has exited,
+    so that workers don't outlive a server which was killed.
+    """
+    while os.getppid() == parent:
+        time.sleep(1)
+    os._exit(1)
+
+
+def serve_worker(raw_spec: str) -> None:
+    """\
+    Serves a single group on a Unix socket, as a worker of a `WorkerPool`.
+    """
+    import uvicorn
+
+    spec = json.loads(raw_spec)
+    group = Group(
+        spec["name"],
+        spec["module"],
+        lazy=False,
+        routers=[
+            Router(
+                router["attribute"],
+                None if router["cache"] is None else ResponseCache(**router["cache"]),
+            )
+            for router in spec["routers"]
+        ],
+        serializer=spec["serializer"],
+        threadpool=None
+        if spec["threadpool_size"] is None
+        else Threadpool(spec["name"], spec["threadpool_size"]),
+    )
+
+    app = fastapi.FastAPI(openapi_url=None)
+
+    @app.get(HEALTH_CHECK_PATH, include_in_schema=False)
+    async def health() -> str:
+        return "ok"
+
+    module = import_group(group.name, group.module)
+    include_group(app, group, module)
+    warmup_hook = spec["warmup_hook"]
+    if warmup_hook is not None:
+
+        async def warm_up() -> None:
+            # Like `Warmup`, a hook which fails is logged rather than stopping the worker.
+            try:
+                await run_hook(group.name, module, warmup_hook)
+            except Exception:
+                logger.exception("failed to warm up group %s", group.name)
+
+        # uvicorn doesn't accept connections until the app has started up,
+        # so the worker isn't sent requests (or health checks) until it's warm.
+        app.router.on_startup.append(warm_up)
+    threading.Thread(target=exit_with_parent, args=(os.getppid(),), daemon=True).start()
+    # The server already logs every request, so workers only log problems.
+    uvicorn.run(
+        app,
+        uds=spec["socket"],
+        log_level="warning",
+        timeout_keep_alive=WORKER_KEEP_ALIVE,
+    )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["worker"]:
+        serve_worker(sys.argv[2])
@@ -1,8 +1,17 @@
 import textwrap
+from unittest import mock
+
+import pytest
 
 from buildgen import python
+from buildgen.common import Repository
+from manifest import BatchConfig
+from manifest import CacheConfig
+from manifest import Endpoint
 from manifest import Group
 from manifest import Language
+from manifest import ServerConfig
+from manifest import WarmupConfig
 
 
 def test_python_build_generator__toolchain():
@@ -43,13 +52,7 @@ def test_python_build_generator__toolchain():
 def test_python_build_generator__target_deps():
     generator = python.PythonBuildGenerator()
     target_deps = generator.generate_target_deps(
-        Group(
-            name="test",
-            language=Language.PYTHON_3_10,
-            filename="something.py",
-            endpoints=[],
-            dependencies="requirements.txt",
-        ),
+        Repository(name="test", requirements_file="requirements.txt"),
     )
 
     expected_target_deps = """\
@@ -94,10 +97,11 @@ def test_python_build_generator__target(tmp_path):
             endpoints=[],
             dependencies="requirements.txt",
         ),
+        Repository(name="shared", requirements_file="requirements.txt"),
     )
 
     expected_target = """\
-    load("@test_deps//:requirements.bzl", requirement_test = "requirement")
+    load("@shared_deps//:requirements.bzl", requirement_test = "requirement")
 
     py_library(
         name = "test",
@@ -111,6 +115,40 @@ def test_python_build_generator__target(tmp_path):
     assert target == expected_target
 
 
+def test_python_build_generator__target_in_group_package(tmp_path):
+    (tmp_path / "requirements.txt").write_text("somedep==1.2.3\n")
+
+    generator = python.PythonBuildGenerator()
+    target = generator.generate_target(
+        Group(
+            name="test",
+            language=Language.PYTHON_3_10,
+            filename="subdir/something.py",
+            endpoints=[],
+            dependencies="requirements.txt",
+        ),
+        Repository(name="shared", requirements_file="requirements.txt"),
+        group_packages=True,
+    )
+
+    expected_target = """\
+    load("@shared_deps//:requirements.bzl", requirement_test = "requirement")
+
+    py_library(
+        name = "test",
+        srcs = ["//subdir:something.py"],
+        deps = [
+            requirement_test("somedep"),
+        ],
+        visibility = [
+            "//:__pkg__",
+        ],
+    )
+    """
+    expected_target = textwrap.dedent(expected_target)
+    assert target == expected_target
+
+
 def test_python_build_generator__server_target(tmp_path):
     requirements_txt = """\
     somedep==1.2.3
@@ -129,6 +167,7 @@ def test_python_build_generator__server_target(tmp_path):
                 dependencies="requirements.txt",
             ),
         ],
+        ServerConfig(),
     )
 
     expected_server_target = """\
@@ -136,7 +175,10 @@ def test_python_build_generator__server_target(tmp_path):
 
     py_binary(
         name = "server",
-        srcs = [":server.py"],
+        srcs = [
+            ":server.py",
+            ":chaos_runtime.py",
+        ],
         deps = [
             ":test",
             requirement_server("somedep"),
@@ -147,6 +189,41 @@ def test_python_build_generator__server_target(tmp_path):
     assert server_target == expected_server_target
 
 
+def test_python_build_generator__named_server(tmp_path):
+    (tmp_path / "requirements.txt").write_text("somedep==1.2.3\n")
+    generator = python.PythonBuildGenerator()
+    group = Group(
+        name="test",
+        language=Language.PYTHON_3_10,
+        filename="something.py",
+        endpoints=[],
+        dependencies="requirements.txt",
+    )
+
+    server_target = generator.generate_server_target(
+        [group], ServerConfig(), name="server_front"
+    )
+    expected_server_target = """\
+    load("@server_deps//:requirements.bzl", requirement_server_front = "requirement")
+
+    py_binary(
+        name = "server_front",
+        srcs = [
+            ":server_front.py",
+            ":chaos_runtime.py",
+        ],
+        deps = [
+            ":test",
+            requirement_server_front("somedep"),
+        ],
+    )
+    """
+    assert server_target == textwrap.dedent(expected_server_target)
+
+    server = generator.generate_server([group], ServerConfig(), name="server_front")
+    assert '"server_front:app",' in server
+
+
 def test_python_build_generator__server():
     generator = python.PythonBuildGenerator()
     server = generator.generate_server(
@@ -159,9 +236,12 @@ def test_python_build_generator__server():
                 dependencies="path/to/endpoint/requirements.txt",
             ),
         ],
+        ServerConfig(),
     )
 
     expected_server = """\
+    import os
+
     import fastapi
     import uvicorn
 
@@ -173,7 +253,706 @@ def test_python_build_generator__server():
 
 
     if __name__ == "__main__":
-        uvicorn.run("server:app", port=8080, log_level="info")
+        uvicorn.run(
+            "server:app",
+            host="127.0.0.1",
+            port=8080,
+            log_level="info",
+            workers=os.cpu_count() or 1,
+            loop="auto",
+            http="auto",
+            backlog=2048,
+            timeout_keep_alive=5,
+            limit_concurrency=None,
+        )
     """
     expected_server = textwrap.dedent(expected_server)
     assert server == expected_server
+
+
+def test_python_build_generator__template_cache(tmp_path):
+    cache_directory = tmp_path / "cache"
+    generator = python.PythonBuildGenerator(cache_directory=cache_directory)
+    expected_build_rules = generator.generate_build_rules()
+    assert list(cache_directory.iterdir())
+
+    # A fresh generator shouldn't need to compile anything that's been cached.
+    generator = python.PythonBuildGenerator(cache_directory=cache_directory)
+    with mock.patch.object(generator.env, "compile", side_effect=AssertionError):
+        assert generator.generate_build_rules() == expected_build_rules
+
+
+def test_parse_requirements():
+    requirements_txt = """\
+    # a comment
+    --index-url https://pypi.org/simple
+
+    somedep[extra]==1.2.3 ; python_version < "3.11"  # inline comment
+    hashed==4.5.6 \\
+        --hash=sha256:0123456789abcdef
+    """
+    requirements = python.parse_requirements(textwrap.dedent(requirements_txt))
+
+    assert [requirement.name for requirement in requirements] == ["somedep", "hashed"]
+    assert requirements[0].extras == {"extra"}
+    assert str(requirements[0].specifier) == "==1.2.3"
+    assert requirements[0].marker is not None
+    assert str(requirements[1].specifier) == "==4.5.6"
+
+
+def test_requirements_index(tmp_path):
+    (tmp_path / "requirements.txt").write_text("somedep==1.2.3\n")
+
+    index = python.RequirementsIndex()
+    requirements_file = index.load("requirements.txt")
+    assert requirements_file.names == ["somedep"]
+    assert index.load(str(tmp_path / "requirements.txt")) is requirements_file
+
+    (tmp_path / "requirements.txt").write_text("somedep==1.2.3\notherdep==4.5.6\n")
+    assert index.load("requirements.txt").names == ["somedep", "otherdep"]
+
+
+def test_python_build_generator__merge_requirements(tmp_path):
+    (tmp_path / "a.txt").write_text("somedep[a]==1.2.3\nfirstdep==1.0\n")
+    (tmp_path / "b.txt").write_text("SomeDep[b]==1.2.3\nseconddep==2.0\n")
+    (tmp_path / "c.txt").write_text("somedep==1.2.4\n")
+
+    generator = python.PythonBuildGenerator()
+    assert generator.merge_requirements(["a.txt", "b.txt"]) == (
+        "firstdep==1.0\nseconddep==2.0\nsomedep[a,b]==1.2.3\n"
+    )
+    assert generator.merge_requirements(["a.txt", "c.txt"]) is None
+
+
+def test_python_build_generator__server_target_follows_server_config(tmp_path):
+    requirements_txt = """\
+    fastapi==0.87.0
+    httptools==0.5.0
+    uvicorn==0.20.0
+    uvloop==0.17.0
+    """
+    (tmp_path / "requirements.txt").write_text(textwrap.dedent(requirements_txt))
+
+    generator = python.PythonBuildGenerator()
+    assert generator.server_requirements(ServerConfig()) == [
+        "fastapi",
+        "httptools",
+        "uvicorn",
+        "uvloop",
+    ]
+    assert generator.server_requirements(ServerConfig(loop="asyncio", http="h11")) == [
+        "fastapi",
+        "uvicorn",
+    ]
+
+    (tmp_path / "requirements.txt").write_text("fastapi==0.87.0\n")
+    assert generator.server_requirements(ServerConfig(loop="uvloop")) == [
+        "fastapi",
+        "uvloop",
+    ]
+    assert generator.server_requirements(
+        ServerConfig(),
+        [
+            Group(
+                name="fast",
+                language=Language.PYTHON_3_10,
+                filename="fast.py",
+                endpoints=[],
+                dependencies="requirements.txt",
+                serializer="orjson",
+            ),
+        ],
+    ) == ["fastapi", "orjson"]
+
+
+def test_python_build_generator__server_requirements_orjson(tmp_path):
+    (tmp_path / "requirements.txt").write_text("fastapi==0.87.0\norjson==3.8.3\n")
+    generator = python.PythonBuildGenerator()
+
+    def make_group(serializer):
+        return Group(
+            name="fast",
+            language=Language.PYTHON_3_10,
+            filename="fast.py",
+            endpoints=[],
+            dependencies="requirements.txt",
+            serializer=serializer,
+        )
+
+    # orjson is pinned, but not a dependency unless a serializer uses it.
+    assert generator.server_requirements(ServerConfig()) == ["fastapi"]
+    assert generator.server_requirements(ServerConfig(), [make_group("json")]) == [
+        "fastapi"
+    ]
+    assert generator.server_requirements(ServerConfig(), [make_group("orjson")]) == [
+        "fastapi",
+        "orjson",
+    ]
+    assert generator.server_requirements(ServerConfig(serializer="orjson")) == [
+        "fastapi",
+        "orjson",
+    ]
+
+
+def test_python_build_generator__server_options():
+    generator = python.PythonBuildGenerator()
+    server_options = dict(
+        generator.generate_server_options(
+            ServerConfig(workers=4, loop="uvloop", limit_concurrency=100)
+        )
+    )
+    assert server_options["workers"] == "4"
+    assert server_options["loop"] == '"uvloop"'
+    assert server_options["limit_concurrency"] == "100"
+
+    # `os` is only imported to count the CPUs for the default number of workers.
+    assert generator.generate_server([], ServerConfig()).startswith("import os\n\n")
+    assert "import os" not in generator.generate_server([], ServerConfig(workers=4))
+
+
+def test_python_build_generator__server_lazy_imports():
+    generator = python.PythonBuildGenerator()
+    server = generator.generate_server(
+        [
+            Group(
+                name="eager",
+                language=Language.PYTHON_3_10,
+                filename="path/eager.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+            ),
+            Group(
+                name="lazy",
+                language=Language.PYTHON_3_10,
+                filename="path/lazy.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                prefixes=["/lazy"],
+            ),
+        ],
+        ServerConfig(lazy_imports=True, import_in_background=False),
+    )
+
+    assert "import chaos_runtime\n" in server
+    assert "app.include_router(path_eager.router)\n" in server
+    assert "path_lazy" not in server
+
+    expected_lazy_groups = """\
+    app = chaos_runtime.LazyGroups(
+        app,
+        [
+            chaos_runtime.Group("lazy", "path.lazy", lazy=True),
+        ],
+        trie=(None, {
+            "lazy": (0, {}),
+        }),
+        import_in_background=False,
+    )
+    """
+    assert textwrap.dedent(expected_lazy_groups) in server
+
+
+def test_python_build_generator__server_response_cache():
+    generator = python.PythonBuildGenerator()
+    cached_endpoints = [
+        Endpoint(name="router"),
+        Endpoint(
+            name="cached_router",
+            cache=CacheConfig(ttl=30, max_entries=100, vary_on=["name"]),
+        ),
+    ]
+    server = generator.generate_server(
+        [
+            Group(
+                name="eager",
+                language=Language.PYTHON_3_10,
+                filename="path/eager.py",
+                endpoints=cached_endpoints,
+                dependencies="path/requirements.txt",
+            ),
+            Group(
+                name="lazy",
+                language=Language.PYTHON_3_10,
+                filename="path/lazy.py",
+                endpoints=cached_endpoints,
+                dependencies="path/requirements.txt",
+                prefixes=["/lazy"],
+            ),
+            Group(
+                name="isolated",
+                language=Language.PYTHON_3_10,
+                filename="path/isolated.py",
+                endpoints=cached_endpoints,
+                dependencies="path/requirements.txt",
+                prefixes=["/isolated"],
+                isolation="process",
+            ),
+        ],
+        ServerConfig(lazy_imports=True, import_in_background=False),
+    )
+
+    assert "import chaos_runtime\n" in server
+
+    expected_caches = """\
+    eager_cached_router_cache = chaos_runtime.ResponseCache(
+        name="eager.cached_router",
+        ttl=30,
+        max_entries=100,
+        vary_on=["name"],
+    )
+
+    lazy_cached_router_cache = chaos_runtime.ResponseCache(
+        name="lazy.cached_router",
+        ttl=30,
+        max_entries=100,
+        vary_on=["name"],
+    )
+
+    isolated_cached_router_cache = dict(
+        name="isolated.cached_router",
+        ttl=30,
+        max_entries=100,
+        vary_on=["name"],
+    )
+    """
+    assert textwrap.dedent(expected_caches) in server
+
+    expected_eager_routers = """\
+    from path import eager as path_eager
+    app.include_router(path_eager.router)
+    chaos_runtime.include_router(
+        app,
+        path_eager.cached_router,
+        cache=eager_cached_router_cache,
+    )
+    """
+    assert textwrap.dedent(expected_eager_routers) in server
+
+    expected_lazy_group = """\
+    app = chaos_runtime.LazyGroups(
+        app,
+        [
+            chaos_runtime.Group(
+                "lazy",
+                "path.lazy",
+                lazy=True,
+                routers=[
+                    chaos_runtime.Router("router"),
+                    chaos_runtime.Router("cached_router", cache=lazy_cached_router_cache),
+                ],
+            ),
+    """
+    assert textwrap.dedent(expected_lazy_group) in server
+
+    # Isolated groups are only served by their workers, which build their own caches.
+    expected_isolated_group = """\
+    chaos_runtime.Group(
+        "isolated",
+        "path.isolated",
+        lazy=True,
+        workers=1,
+        routers=[
+            chaos_runtime.Router("router"),
+            chaos_runtime.Router("cached_router", worker_cache=isolated_cached_router_cache),
+        ],
+    ),
+    """
+    assert textwrap.indent(textwrap.dedent(expected_isolated_group), " " * 8) in server
+
+
+def test_python_build_generator__server_metrics():
+    generator = python.PythonBuildGenerator()
+    server = generator.generate_server(
+        [
+            Group(
+                name="eager",
+                language=Language.PYTHON_3_10,
+                filename="path/eager.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+            ),
+            Group(
+                name="lazy",
+                language=Language.PYTHON_3_10,
+                filename="path/lazy.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                prefixes=["/lazy"],
+            ),
+        ],
+        ServerConfig(lazy_imports=True, metrics=True),
+    )
+
+    assert "import chaos_runtime\n" in server
+    assert "metrics = chaos_runtime.Metrics()\napp = fastapi.FastAPI()\n" in server
+
+    expected_eager_group = """\
+    path_eager = chaos_runtime.import_group("eager", "path.eager")
+    chaos_runtime.include_router(
+        app,
+        path_eager.router,
+        metrics=metrics,
+        group="eager",
+    )
+    """
+    assert textwrap.dedent(expected_eager_group) in server
+
+    expected_lazy_groups = """\
+        import_in_background=True,
+        metrics=metrics,
+    )
+
+    app = chaos_runtime.MetricsApp(app, metrics)
+    """
+    assert textwrap.dedent(expected_lazy_groups) in server
+
+
+def test_python_build_generator__server_isolated_group():
+    generator = python.PythonBuildGenerator()
+    server = generator.generate_server(
+        [
+            Group(
+                name="echo",
+                language=Language.PYTHON_3_10,
+                filename="path/echo.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                prefixes=["/echo"],
+            ),
+            Group(
+                name="images",
+                language=Language.PYTHON_3_10,
+                filename="path/images.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                prefixes=["/images"],
+                isolation="process",
+                workers=4,
+            ),
+        ],
+        ServerConfig(),
+    )
+
+    # Only the isolated group needs to be routed by prefix.
+    assert "app.include_router(path_echo.router)\n" in server
+    expected_groups = """\
+    app = chaos_runtime.LazyGroups(
+        app,
+        [
+            chaos_runtime.Group("images", "path.images", lazy=False, workers=4),
+        ],
+    """
+    assert textwrap.dedent(expected_groups) in server
+
+
+def test_python_build_generator__server_serializer():
+    generator = python.PythonBuildGenerator()
+    server = generator.generate_server(
+        [
+            Group(
+                name="fast",
+                language=Language.PYTHON_3_10,
+                filename="path/fast.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+            ),
+            Group(
+                name="plain",
+                language=Language.PYTHON_3_10,
+                filename="path/plain.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                serializer="json",
+            ),
+            Group(
+                name="dispatched",
+                language=Language.PYTHON_3_10,
+                filename="path/dispatched.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                prefixes=["/dispatched"],
+                isolation="process",
+            ),
+        ],
+        ServerConfig(serializer="orjson"),
+    )
+
+    expected_app = """\
+    app = fastapi.FastAPI(default_response_class=chaos_runtime.response_class("orjson"))
+    """
+    assert textwrap.dedent(expected_app) in server
+
+    expected_routers = """\
+    from path import fast as path_fast
+    chaos_runtime.include_router(
+        app,
+        path_fast.router,
+        default_response_class=chaos_runtime.response_class("orjson"),
+    )
+    from path import plain as path_plain
+    chaos_runtime.include_router(
+        app,
+        path_plain.router,
+        default_response_class=chaos_runtime.response_class("json"),
+    )
+    """
+    assert textwrap.dedent(expected_routers) in server
+
+    expected_group = """\
+    chaos_runtime.Group(
+        "dispatched",
+        "path.dispatched",
+        lazy=False,
+        workers=1,
+        serializer="orjson",
+        routers=[
+            chaos_runtime.Router("router"),
+        ],
+    ),
+    """
+    assert textwrap.indent(textwrap.dedent(expected_group), " " * 8) in server
+
+
+def test_python_build_generator__server_warmup():
+    generator = python.PythonBuildGenerator()
+    server = generator.generate_server(
+        [
+            Group(
+                name="echo",
+                language=Language.PYTHON_3_10,
+                filename="path/echo.py",
+                endpoints=[Endpoint(name="router", paths=["/echo/a", "/echo/b"])],
+                dependencies="path/requirements.txt",
+            ),
+            Group(
+                name="hooked",
+                language=Language.PYTHON_3_10,
+                filename="path/hooked.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                warmup=WarmupConfig(requests=3, hook="warm_up"),
+            ),
+            Group(
+                name="isolated",
+                language=Language.PYTHON_3_10,
+                filename="path/isolated.py",
+                endpoints=[Endpoint(name="router", paths=["/isolated"])],
+                dependencies="path/requirements.txt",
+                prefixes=["/isolated"],
+                isolation="process",
+                warmup=WarmupConfig(hook="warm_up"),
+            ),
+        ],
+        ServerConfig(warmup=WarmupConfig()),
+    )
+
+    assert "import chaos_runtime\n" in server
+    expected_group = """\
+    chaos_runtime.Group(
+        "isolated",
+        "path.isolated",
+        lazy=False,
+        workers=1,
+        warmup_hook="warm_up",
+        routers=[
+            chaos_runtime.Router("router"),
+        ],
+    ),
+    """
+    assert textwrap.indent(textwrap.dedent(expected_group), " " * 8) in server
+
+    expected_warmup = """\
+    app = chaos_runtime.Warmup(
+        app,
+        [
+            chaos_runtime.GroupWarmup("echo", "path.echo", paths=["/echo/a", "/echo/b"]),
+            chaos_runtime.GroupWarmup("hooked", "path.hooked", hook="warm_up"),
+            chaos_runtime.GroupWarmup("isolated", "path.isolated", paths=["/isolated"]),
+        ],
+        workers=os.cpu_count() or 1,
+    )
+    """
+    assert textwrap.dedent(expected_warmup) in server
+    assert "    chaos_runtime.share_readiness()\n    uvicorn.run(\n" in server
+
+
+def test_python_build_generator__server_concurrency_limit():
+    generator = python.PythonBuildGenerator()
+    server = generator.generate_server(
+        [
+            Group(
+                name="database",
+                language=Language.PYTHON_3_10,
+                filename="path/database.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                max_concurrency=4,
+                max_queue=8,
+            ),
+            Group(
+                name="isolated",
+                language=Language.PYTHON_3_10,
+                filename="path/isolated.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                prefixes=["/isolated"],
+                isolation="process",
+                max_concurrency=2,
+            ),
+        ],
+        ServerConfig(),
+    )
+
+    expected_limiter = """\
+    database_limiter = chaos_runtime.ConcurrencyLimiter(
+        name="database",
+        max_concurrency=4,
+        max_queue=8,
+    )
+    """
+    assert textwrap.dedent(expected_limiter) in server
+
+    expected_router = """\
+    chaos_runtime.include_router(
+        app,
+        path_database.router,
+        limiter=database_limiter,
+    )
+    """
+    assert textwrap.dedent(expected_router) in server
+
+    expected_group = """\
+    chaos_runtime.Group(
+        "isolated",
+        "path.isolated",
+        lazy=False,
+        workers=1,
+        limiter=isolated_limiter,
+        routers=[
+            chaos_runtime.Router("router"),
+        ],
+    ),
+    """
+    assert textwrap.indent(textwrap.dedent(expected_group), " " * 8) in server
+
+
+def test_python_build_generator__server_threadpool():
+    generator = python.PythonBuildGenerator()
+    server = generator.generate_server(
+        [
+            Group(
+                name="blocking",
+                language=Language.PYTHON_3_10,
+                filename="path/blocking.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                prefixes=["/blocking"],
+                threadpool_size=8,
+            ),
+        ],
+        ServerConfig(lazy_imports=True),
+    )
+
+    expected_threadpool = """\
+    blocking_threadpool = chaos_runtime.Threadpool(
+        name="blocking",
+        size=8,
+    )
+    """
+    assert textwrap.dedent(expected_threadpool) in server
+
+    expected_group = """\
+    chaos_runtime.Group(
+        "blocking",
+        "path.blocking",
+        lazy=True,
+        threadpool=blocking_threadpool,
+        routers=[
+            chaos_runtime.Router("router"),
+        ],
+    ),
+    """
+    assert textwrap.indent(textwrap.dedent(expected_group), " " * 8) in server
+
+
+def test_python_build_generator__server_batch():
+    generator = python.PythonBuildGenerator()
+    group = Group(
+        name="echo",
+        language=Language.PYTHON_3_10,
+        filename="path/echo.py",
+        endpoints=[],
+        dependencies="path/requirements.txt",
+    )
+    assert "BatchApp" not in generator.generate_server([group], ServerConfig())
+
+    server = generator.generate_server(
+        [group], ServerConfig(batch=BatchConfig(max_requests=10))
+    )
+    assert "import chaos_runtime\n" in server
+    expected_batch = """\
+    app = chaos_runtime.BatchApp(
+        app,
+        max_requests=10,
+        timeout=5.0,
+    )
+    """
+    assert textwrap.dedent(expected_batch) in server
+
+
+def test_python_build_generator__server_prefix_routing():
+    generator = python.PythonBuildGenerator()
+    server = generator.generate_server(
+        [
+            Group(
+                name="first",
+                language=Language.PYTHON_3_10,
+                filename="path/first.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                prefixes=["/first", "/shared/first"],
+            ),
+            Group(
+                name="second",
+                language=Language.PYTHON_3_10,
+                filename="path/second.py",
+                endpoints=[],
+                dependencies="path/requirements.txt",
+                prefixes=["/shared"],
+            ),
+        ],
+        ServerConfig(routing="prefix"),
+    )
+
+    expected_dispatcher = """\
+    app = chaos_runtime.PrefixDispatcher(
+        app,
+        [
+            chaos_runtime.Group("first", "path.first", lazy=False),
+            chaos_runtime.Group("second", "path.second", lazy=False),
+        ],
+        trie=(None, {
+            "first": (0, {}),
+            "shared": (1, {
+                "first": (0, {}),
+            }),
+        }),
+        import_in_background=True,
+    )
+    """
+    assert textwrap.dedent(expected_dispatcher) in server
+
+
+def test_build_prefix_trie():
+    assert python.build_prefix_trie([["/a", "/b/c"], ["/b"], ["/"]]) == (
+        2,
+        {
+            "a": (0, {}),
+            "b": (1, {"c": (0, {})}),
+        },
+    )
+
+
+def test_build_prefix_trie__conflict():
+    with pytest.raises(ValueError):
+        python.build_prefix_trie([["/a"], ["/a/"]])
@@ -0,0 +1,846 @@
+import asyncio
+import importlib.util
+import json
+import os
+import runpy
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from typing import Any
+
+import fastapi
+import pydantic
+import pytest
+
+from buildgen import python
+from config import PYTHON_RUNTIME
+from manifest import CacheConfig
+from manifest import Endpoint
+from manifest import Group
+from manifest import Language
+from manifest import ServerConfig
+
+
+spec = importlib.util.spec_from_file_location("chaos_runtime", PYTHON_RUNTIME)
+assert spec is not None and spec.loader is not None
+chaos_runtime = importlib.util.module_from_spec(spec)
+sys.modules["chaos_runtime"] = chaos_runtime
+spec.loader.exec_module(chaos_runtime)
+
+
+async def request(app: Any, path: str) -> tuple[int, bytes]:
+    path, _, query_string = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query_string.encode(),
+        "headers": [],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8080),
+    }
+    messages = []
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict[str, Any]) -> None:
+        messages.append(message)
+
+    await app(scope, receive, send)
+    status = messages[0]["status"]
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return status, body
+
+
+@pytest.fixture
+def group_modules(tmp_path):
+    """\
+    Writes a package of group modules, each with a router,
+    and returns a function to check if a module has been imported yet.
+    """
+    package = tmp_path / "groups"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    for name in ("first", "second"):
+        group_module = f"""\
+        from fastapi import APIRouter
+
+        router = APIRouter()
+
+
+        @router.get("/{name}/hello")
+        async def hello() -> str:
+            return "hello from {name}"
+
+
+        warmed_up = False
+
+
+        def warm_up() -> None:
+            global warmed_up
+            warmed_up = True
+
+
+        def broken_warm_up() -> None:
+            raise RuntimeError("broken")
+        """
+        (package / f"{name}.py").write_text(textwrap.dedent(group_module))
+
+    sys.path.insert(0, str(tmp_path))
+    try:
+        yield lambda name: f"groups.{name}" in sys.modules
+    finally:
+        sys.path.remove(str(tmp_path))
+        for name in list(sys.modules):
+            if name == "groups" or name.startswith("groups."):
+                del sys.modules[name]
+
+
+TRIE = (None, {"first": (0, {}), "second": (1, {})})
+
+
+def make_groups(lazy: bool = True) -> list[Any]:
+    return [
+        chaos_runtime.Group("first", "groups.first", lazy=lazy),
+        chaos_runtime.Group("second", "groups.second", lazy=lazy),
+    ]
+
+
+def test_lookup():
+    trie = (None, {"echo": (0, {}), "hello": (1, {"world": (2, {})})})
+    assert chaos_runtime.lookup(trie, "/echo") == 0
+    assert chaos_runtime.lookup(trie, "/echo/content") == 0
+    assert chaos_runtime.lookup(trie, "/echoes") is None
+    assert chaos_runtime.lookup(trie, "/hello/someone") == 1
+    assert chaos_runtime.lookup(trie, "/hello/world/again") == 2
+    assert chaos_runtime.lookup((3, {}), "/anything") == 3
+
+
+def test_lazy_groups__import_on_first_request(group_modules):
+    app = chaos_runtime.LazyGroups(
+        fastapi.FastAPI(),
+        make_groups(),
+        trie=TRIE,
+        import_in_background=False,
+    )
+
+    async def run() -> None:
+        await app.app.router.startup()
+        assert not group_modules("first")
+
+        assert await request(app, "/first/hello") == (200, b'"hello from first"')
+        assert group_modules("first")
+        assert not group_modules("second")
+
+        assert await request(app, "/nothing") == (404, b'{"detail":"Not Found"}')
+
+    asyncio.run(run())
+
+
+def test_lazy_groups__import_in_background(group_modules):
+    app = chaos_runtime.LazyGroups(fastapi.FastAPI(), make_groups(), trie=TRIE)
+
+    async def run() -> None:
+        await app.app.router.startup()
+        assert app.background_task is not None
+        await app.background_task
+
+        assert group_modules("first")
+        assert group_modules("second")
+        assert await request(app, "/second/hello") == (200, b'"hello from second"')
+
+    asyncio.run(run())
+
+
+def test_prefix_dispatcher(group_modules):
+    fallback = fastapi.FastAPI()
+
+    @fallback.get("/fallback")
+    async def fallback_route() -> str:
+        return "fallback"
+
+    app = chaos_runtime.PrefixDispatcher(fallback, make_groups(lazy=False), trie=TRIE)
+    assert group_modules("first")
+    assert group_modules("second")
+
+    async def run() -> None:
+        await fallback.router.startup()
+        assert await request(app, "/first/hello") == (200, b'"hello from first"')
+        assert await request(app, "/second/hello") == (200, b'"hello from second"')
+        assert await request(app, "/fallback") == (200, b'"fallback"')
+        # Only the routes of the group which owns the prefix are considered.
+        assert await request(app, "/first/fallback") == (
+            404,
+            b'{"detail":"Not Found"}',
+        )
+
+    asyncio.run(run())
+
+
+def test_prefix_dispatcher__lazy(group_modules):
+    app = chaos_runtime.PrefixDispatcher(
+        fastapi.FastAPI(),
+        make_groups(),
+        trie=TRIE,
+        import_in_background=False,
+    )
+
+    async def run() -> None:
+        await app.app.router.startup()
+        assert not group_modules("second")
+        assert await request(app, "/second/hello") == (200, b'"hello from second"')
+        assert group_modules("second")
+        assert not group_modules("first")
+
+    asyncio.run(run())
+
+
+def make_cached_app(cache: Any, delay: float = 0) -> tuple[Any, list[str]]:
+    calls = []
+    router = fastapi.APIRouter()
+
+    @router.get("/hello/{name}")
+    async def hello(name: str, greeting: str = "hello") -> str:
+        calls.append(name)
+        await asyncio.sleep(delay)
+        return f"{greeting} {name}"
+
+    @router.get("/missing")
+    async def missing() -> None:
+        calls.append("missing")
+        raise fastapi.HTTPException(status_code=404)
+
+    app = fastapi.FastAPI()
+    chaos_runtime.include_router(app, router, cache=cache)
+    return app, calls
+
+
+def test_response_cache__hits_and_misses():
+    cache = chaos_runtime.ResponseCache("test", ttl=60, max_entries=10)
+    app, calls = make_cached_app(cache)
+
+    async def run() -> None:
+        for _ in range(3):
+            assert await request(app, "/hello/a") == (200, b'"hello a"')
+        assert await request(app, "/hello/a?greeting=hi") == (200, b'"hi a"')
+        assert await request(app, "/hello/b") == (200, b'"hello b"')
+
+        # Only successful responses are cached.
+        for _ in range(2):
+            assert (await request(app, "/missing"))[0] == 404
+
+    asyncio.run(run())
+    assert calls == ["a", "a", "b", "missing", "missing"]
+    assert cache.stats() == {"entries": 3, "hits": 2, "misses": 5, "evictions": 0}
+
+
+def test_response_cache__vary_on():
+    cache = chaos_runtime.ResponseCache(
+        "test", ttl=60, max_entries=10, vary_on=["name"]
+    )
+    app, calls = make_cached_app(cache)
+
+    async def run() -> None:
+        assert await request(app, "/hello/a") == (200, b'"hello a"')
+        # `greeting` isn't part of the key, so this is served from the cache.
+        assert await request(app, "/hello/a?greeting=hi") == (200, b'"hello a"')
+        assert await request(app, "/hello/b?greeting=hi") == (200, b'"hi b"')
+
+    asyncio.run(run())
+    assert calls == ["a", "b"]
+
+
+def test_response_cache__evicts_least_recently_used():
+    cache = chaos_runtime.ResponseCache("test", ttl=60, max_entries=2)
+    app, calls = make_cached_app(cache)
+
+    async def run() -> None:
+        for path in ("/hello/a", "/hello/b", "/hello/a", "/hello/c", "/hello/b"):
+            await request(app, path)
+
+    asyncio.run(run())
+    assert calls == ["a", "b", "c", "b"]
+    assert cache.evictions == 2
+
+
+def test_response_cache__expires_entries(monkeypatch):
+    cache = chaos_runtime.ResponseCache("test", ttl=60, max_entries=10)
+    app, calls = make_cached_app(cache)
+    now = 1000.0
+    monkeypatch.setattr(chaos_runtime.time, "monotonic", lambda: now)
+
+    async def run() -> None:
+        nonlocal now
+        await request(app, "/hello/a")
+        now += 30
+        await request(app, "/hello/a")
+        now += 31
+        await request(app, "/hello/a")
+
+    asyncio.run(run())
+    assert calls == ["a", "a"]
+
+
+def test_response_cache__coalesces_concurrent_misses():
+    cache = chaos_runtime.ResponseCache("test", ttl=60, max_entries=10)
+    app, calls = make_cached_app(cache, delay=0.05)
+
+    async def run() -> list[tuple[int, bytes]]:
+        return await asyncio.gather(*(request(app, "/hello/a") for _ in range(10)))
+
+    assert asyncio.run(run()) == [(200, b'"hello a"')] * 10
+    assert calls == ["a"]
+    assert cache.hits == 9
+
+
+def test_concurrency_limiter():
+    limiter = chaos_runtime.ConcurrencyLimiter("slow", max_concurrency=2, max_queue=2)
+    router = fastapi.APIRouter()
+    running = []
+    release = asyncio.Event()
+
+    @router.get("/slow/{index}")
+    async def slow(index: int) -> int:
+        running.append(index)
+        await release.wait()
+        return index
+
+    app = fastapi.FastAPI()
+    chaos_runtime.include_router(app, router, limiter=limiter)
+
+    async def run() -> list[tuple[int, bytes]]:
+        requests = []
+        for index in range(5):
+            requests.append(asyncio.create_task(request(app, f"/slow/{index}")))
+            await asyncio.sleep(0.01)
+        # Two requests are running, two are queued, and the fifth was turned away.
+        assert sorted(running) == [0, 1]
+        assert (limiter.active, limiter.queued, limiter.rejected) == (2, 2, 1)
+        assert await requests[4] == (503, b"Overloaded")
+
+        release.set()
+        return await asyncio.gather(*requests[:4])
+
+    assert asyncio.run(run()) == [(200, str(index).encode()) for index in range(4)]
+    assert sorted(running) == [0, 1, 2, 3]
+    assert (limiter.active, limiter.queued) == (0, 0)
+    rendered = chaos_runtime.Metrics().render().splitlines()
+    assert 'chaos_group_rejected_requests_total{group="slow"} 1' in rendered
+
+
+def test_concurrency_limiter__cancelled_while_queued():
+    limiter = chaos_runtime.ConcurrencyLimiter("test", max_concurrency=1, max_queue=1)
+    release = asyncio.Event()
+
+    async def app(scope: Any, receive: Any, send: Any) -> None:
+        await release.wait()
+
+    limited_app = limiter.wrap(app)
+
+    async def run() -> None:
+        running = asyncio.create_task(limited_app({}, None, None))
+        queued = asyncio.create_task(limited_app({}, None, None))
+        await asyncio.sleep(0.01)
+        assert limiter.queued == 1
+
+        queued.cancel()
+        await asyncio.sleep(0.01)
+        assert limiter.queued == 0
+        release.set()
+        await running
+
+    asyncio.run(run())
+    assert (limiter.active, limiter.queued) == (0, 0)
+
+
+def test_threadpool():
+    threadpool = chaos_runtime.Threadpool("blocking", size=1)
+    router = fastapi.APIRouter()
+    running = 0
+    most_running = 0
+    lock = threading.Lock()
+
+    @router.get("/blocking")
+    def blocking() -> str:
+        nonlocal running, most_running
+        with lock:
+            running += 1
+            most_running = max(most_running, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return "done"
+
+    @router.get("/async")
+    async def not_blocking() -> str:
+        return "done"
+
+    app = fastapi.FastAPI()
+    chaos_runtime.include_router(app, router, threadpool=threadpool)
+    blocking_route, async_route = app.router.routes[-2:]
+    assert async_route.dependant.call is not_blocking
+
+    async def run() -> list[tuple[int, bytes]]:
+        return await asyncio.gather(*(request(app, "/blocking") for _ in range(3)))
+
+    assert asyncio.run(run()) == [(200, b'"done"')] * 3
+    assert most_running == 1
+    assert threadpool.waits == 2
+    rendered = chaos_runtime.Metrics().render().splitlines()
+    assert 'chaos_group_thread_waits_total{group="blocking"} 2' in rendered
+
+
+def test_metrics__counts_requests():
+    metrics = chaos_runtime.Metrics()
+    cache = chaos_runtime.ResponseCache("test", ttl=60, max_entries=10)
+    router = fastapi.APIRouter()
+
+    @router.get("/slow")
+    async def slow() -> str:
+        await asyncio.sleep(0.03)
+        return "slow"
+
+    @router.get("/broken")
+    async def broken() -> str:
+        raise RuntimeError("broken")
+
+    app = fastapi.FastAPI()
+    chaos_runtime.include_router(app, router, metrics=metrics, group="test")
+    cached_app, _ = make_cached_app(cache)
+    chaos_runtime.include_router(
+        app, cached_app.router, cache=cache, metrics=metrics, group="cached"
+    )
+
+    async def run() -> None:
+        assert await request(app, "/slow") == (200, b'"slow"')
+        with pytest.raises(RuntimeError):
+            await request(app, "/broken")
+        for _ in range(2):
+            assert await request(app, "/hello/a") == (200, b'"hello a"')
+
+    asyncio.run(run())
+    slow_route, broken_route, hello_route, _ = metrics.routes
+    assert slow_route.labels == 'group="test",route="/slow",method="GET"'
+    assert (slow_route.requests, slow_route.errors, slow_route.in_flight) == (1, 0, 0)
+    assert slow_route.total >= 0.03
+    # 0.03s is slower than the 0.025s bucket, but not the 0.05s bucket.
+    assert slow_route.buckets[chaos_runtime.LATENCY_BUCKETS.index(0.05)] == 1
+    assert (broken_route.requests, broken_route.errors) == (1, 1)
+    # Cache hits are counted too.
+    assert hello_route.requests == 2
+
+    rendered = metrics.render().splitlines()
+    slow_labels = 'group="test",route="/slow",method="GET"'
+    assert f"chaos_requests_total{{{slow_labels}}} 1" in rendered
+    bucket = "chaos_request_duration_seconds_bucket"
+    assert f'{bucket}{{{slow_labels},le="0.025"}} 0' in rendered
+    assert f'{bucket}{{{slow_labels},le="0.05"}} 1' in rendered
+    assert f'{bucket}{{{slow_labels},le="+Inf"}} 1' in rendered
+    assert 'chaos_response_cache_hits_total{cache="test"} 1' in rendered
+
+
+def test_metrics__format_labels():
+    assert (
+        chaos_runtime.format_labels(group='say "hi"\\\n', route="/")
+        == 'group="say \\"hi\\"\\\\\\n",route="/"'
+    )
+
+
+def test_metrics_app(group_modules):
+    metrics = chaos_runtime.Metrics()
+    app = chaos_runtime.MetricsApp(
+        chaos_runtime.LazyGroups(
+            fastapi.FastAPI(),
+            make_groups(),
+            trie=TRIE,
+            import_in_background=False,
+            metrics=metrics,
+        ),
+        metrics,
+    )
+
+    async def lifespan() -> None:
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+
+        async def receive() -> dict[str, Any]:
+            return messages.pop(0)
+
+        async def send(message: dict[str, Any]) -> None:
+            pass
+
+        await app({"type": "lifespan", "asgi": {"version": "3.0"}}, receive, send)
+
+    async def run() -> None:
+        await lifespan()
+        assert await request(app, "/first/hello") == (200, b'"hello from first"')
+
+        status, body = await request(app, "/metrics")
+        assert status == 200
+        assert (
+            'chaos_requests_total{group="first",route="/first/hello",method="GET"} 1\n'
+            in body.decode()
+        )
+
+    asyncio.run(run())
+    assert metrics.startup_seconds is not None
+    assert "first" in chaos_runtime.import_seconds
+
+
+def test_metrics_app__server_module_run_twice(group_modules, tmp_path):
+    group = Group(
+        name="first",
+        language=Language.PYTHON_3_10,
+        filename="groups/first.py",
+        endpoints=[Endpoint(name="router", cache=CacheConfig(ttl=60))],
+        dependencies="requirements.txt",
+        max_concurrency=2,
+        threadpool_size=4,
+    )
+    server = tmp_path / "server.py"
+    server.write_text(
+        python.PythonBuildGenerator().generate_server(
+            [group], ServerConfig(metrics=True)
+        )
+    )
+    # `python server.py` runs the server module as `__main__` (or `__mp_main__`
+    # in uvicorn's workers), and then again as `server` when uvicorn imports it.
+    runpy.run_path(str(server), run_name="__mp_main__")
+    app = runpy.run_path(str(server), run_name="server")["app"]
+
+    async def run() -> str:
+        assert await request(app, "/first/hello") == (200, b'"hello from first"')
+        status, body = await request(app, "/metrics")
+        assert status == 200
+        return body.decode()
+
+    samples = [
+        line.rpartition(" ")
+        for line in asyncio.run(run()).splitlines()
+        if not line.startswith("#")
+    ]
+    series = [name for name, _, _ in samples]
+    assert len(series) == len(set(series))
+    assert ('chaos_response_cache_misses_total{cache="first.router"}', " ", "1") in (
+        samples
+    )
+    assert ('chaos_group_requests_active{group="first"}', " ", "0") in samples
+    assert ('chaos_group_threads{group="first"}', " ", "4") in samples
+
+
+def test_warmup(group_modules):
+    metrics = chaos_runtime.Metrics()
+    app = chaos_runtime.Warmup(
+        chaos_runtime.LazyGroups(
+            fastapi.FastAPI(),
+            make_groups(),
+            trie=TRIE,
+            import_in_background=False,
+            metrics=metrics,
+        ),
+        [
+            chaos_runtime.GroupWarmup(
+                "first", "groups.first", paths=["/first/hello"], requests=2
+            ),
+            chaos_runtime.GroupWarmup("second", "groups.second", hook="warm_up"),
+        ],
+    )
+
+    async def run() -> None:
+        shutdown = asyncio.Event()
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+
+        async def receive() -> dict[str, Any]:
+            if len(messages) == 1:
+                await shutdown.wait()
+            return messages.pop(0)
+
+        async def send(message: dict[str, Any]) -> None:
+            pass
+
+        assert (await request(app, "/ready"))[0] == 503
+        lifespan = asyncio.create_task(
+            app({"type": "lifespan", "asgi": {"version": "3.0"}}, receive, send)
+        )
+        while app.task is None:
+            await asyncio.sleep(0.01)
+        await app.task
+
+        status, body = await request(app, "/ready")
+        assert status == 200
+        assert json.loads(body)["ready"]
+        shutdown.set()
+        await lifespan
+
+    asyncio.run(run())
+    assert group_modules("first")
+    assert sys.modules["groups.second"].warmed_up
+    assert {"first", "second"} <= chaos_runtime.warmup_seconds.keys()
+    # Warm-up requests aren't counted as the server's traffic.
+    assert metrics.routes
+    assert not any(route.requests for route in metrics.routes)
+
+
+def test_warmup__every_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv(chaos_runtime.READY_DIRECTORY_VARIABLE, str(tmp_path))
+    app = chaos_runtime.Warmup(fastapi.FastAPI(), [], workers=2)
+
+    async def run() -> None:
+        await app.warm_up()
+        # The other worker hasn't warmed up yet, so the server isn't ready.
+        assert (await request(app, "/ready"))[0] == 503
+
+        # Records left behind by workers which have exited don't count.
+        exited = subprocess.Popen((sys.executable, "-c", ""))
+        exited.wait()
+        (tmp_path / str(exited.pid)).touch()
+        assert (await request(app, "/ready"))[0] == 503
+
+        (tmp_path / str(os.getppid())).touch()
+        assert (await request(app, "/ready"))[0] == 200
+
+    asyncio.run(run())
+
+
+def test_worker_pool__failed_warmup_hook(group_modules):
+    groups = [
+        chaos_runtime.Group(
+            "first", "groups.first", workers=1, warmup_hook="broken_warm_up"
+        ),
+        chaos_runtime.Group(
+            "second", "groups.second", workers=1, warmup_hook="missing"
+        ),
+    ]
+    app = chaos_runtime.PrefixDispatcher(fastapi.FastAPI(), groups, trie=TRIE)
+
+    async def run() -> None:
+        # Like groups in the server's own process, the workers are served anyway.
+        await app.app.router.startup()
+        try:
+            assert await request(app, "/first/hello") == (200, b'"hello from first"')
+            assert await request(app, "/second/hello") == (
+                200,
+                b'"hello from second"',
+            )
+        finally:
+            await app.app.router.shutdown()
+
+    asyncio.run(run())
+
+
+def make_batch_app(**kwargs: Any) -> Any:
+    app = fastapi.FastAPI()
+
+    @app.get("/hello/{name}")
+    async def hello(name: str, request: fastapi.Request) -> dict[str, Any]:
+        return {"name": name, "q": request.query_params.get("q")}
+
+    @app.post("/echo")
+    async def echo(request: fastapi.Request) -> dict[str, Any]:
+        return {
+            "body": await request.json(),
+            "cookie": request.headers.get("cookie"),
+            "token": request.headers.get("x-token"),
+        }
+
+    @app.get("/text", response_class=fastapi.responses.PlainTextResponse)
+    async def text() -> str:
+        return "plain"
+
+    @app.get("/slow")
+    async def slow() -> str:
+        await asyncio.sleep(1)
+        return "slow"
+
+    return chaos_runtime.BatchApp(app, **kwargs)
+
+
+async def batch(app: Any, body: Any) -> tuple[int, Any]:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/_batch",
+        "raw_path": b"/_batch",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"cookie", b"session=abc"), (b"content-type", b"text/plain")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8080),
+    }
+    raw_body = body if isinstance(body, bytes) else json.dumps(body).encode()
+    status, _, response_body = await chaos_runtime.call_app(app, scope, raw_body)
+    if status != 200:
+        return status, response_body
+    return status, json.loads(response_body)
+
+
+def test_batch_app():
+    app = make_batch_app(timeout=0.1)
+    sub_requests = [
+        {"path": "/hello/a?q=1"},
+        {"method": "post", "path": "/echo", "body": [1], "headers": {"X-Token": "t"}},
+        {"path": "/text"},
+        {"path": "/slow"},
+        {"path": "/missing"},
+    ]
+    status, responses = asyncio.run(batch(app, sub_requests))
+    assert status == 200
+    assert [response["status"] for response in responses] == [200, 200, 200, 504, 404]
+    assert responses[0]["body"] == {"name": "a", "q": "1"}
+    assert responses[0]["headers"]["content-type"] == "application/json"
+    # Sub-requests inherit the batch request's headers.
+    assert responses[1]["body"] == {"body": [1], "cookie": "session=abc", "token": "t"}
+    assert responses[2]["body"] == "plain"
+
+
+def test_batch_app__invalid():
+    app = make_batch_app(max_requests=2)
+
+    async def run() -> None:
+        assert (await batch(app, [{"path": "/text"}] * 3))[0] == 413
+        assert (await batch(app, {"path": "/text"}))[0] == 400
+        assert (await batch(app, b"not json"))[0] == 400
+        assert (await batch(app, [{"path": "relative"}]))[0] == 400
+        assert await request(app, "/_batch") == (405, b"Method Not Allowed")
+        # Everything else goes to the wrapped app.
+        assert await request(app, "/text") == (200, b"plain")
+
+    asyncio.run(run())
+
+
+def test_worker_pool(group_modules, monkeypatch):
+    monkeypatch.setattr(chaos_runtime, "HEALTH_CHECK_INTERVAL", 0.1)
+    groups = [
+        chaos_runtime.Group("first", "groups.first", lazy=False, workers=2),
+        chaos_runtime.Group("second", "groups.second", lazy=False),
+    ]
+    app = chaos_runtime.PrefixDispatcher(fastapi.FastAPI(), groups, trie=TRIE)
+    pool = groups[0].pool
+    # Isolated groups are only imported by their workers.
+    assert not group_modules("first")
+    assert group_modules("second")
+
+    async def wait_until_healthy() -> None:
+        for _ in range(200):
+            if all(
+                worker.healthy and worker.process.returncode is None
+                for worker in pool.workers
+            ):
+                return
+            await asyncio.sleep(0.05)
+        raise TimeoutError("workers weren't restarted")
+
+    async def run() -> None:
+        await app.app.router.startup()
+        try:
+            for _ in range(4):
+                assert await request(app, "/first/hello") == (
+                    200,
+                    b'"hello from first"',
+                )
+            assert await request(app, "/second/hello") == (200, b'"hello from second"')
+            # Requests are sent over the workers' existing connections.
+            assert [len(worker.idle) for worker in pool.workers] == [1, 1]
+
+            crashed = pool.workers[0].process
+            crashed.kill()
+            await crashed.wait()
+            # The remaining worker takes over until the crashed one is restarted.
+            assert await request(app, "/first/hello") == (200, b'"hello from first"')
+            await wait_until_healthy()
+            assert pool.workers[0].process is not crashed
+            assert await request(app, "/first/hello") == (200, b'"hello from first"')
+        finally:
+            await app.app.router.shutdown()
+        assert all(worker.process.returncode is not None for worker in pool.workers)
+
+    asyncio.run(run())
+
+
+def test_response_class(monkeypatch):
+    assert chaos_runtime.response_class("orjson") is fastapi.responses.ORJSONResponse
+    assert chaos_runtime.response_class("json") is fastapi.responses.JSONResponse
+
+    chaos_runtime.response_class.cache_clear()
+    monkeypatch.setattr(chaos_runtime.importlib.util, "find_spec", lambda name: None)
+    try:
+        assert chaos_runtime.response_class("orjson") is fastapi.responses.JSONResponse
+    finally:
+        chaos_runtime.response_class.cache_clear()
+
+
+def test_lazy_groups__serializer(group_modules):
+    groups = make_groups()
+    groups[0].serializer = "orjson"
+    app = chaos_runtime.LazyGroups(
+        fastapi.FastAPI(), groups, trie=TRIE, import_in_background=False
+    )
+
+    async def run() -> None:
+        await app.app.router.startup()
+        await request(app, "/first/hello")
+        await request(app, "/second/hello")
+
+    asyncio.run(run())
+    response_classes = {
+        route.path: route.response_class
+        for route in app.app.router.routes
+        if isinstance(route, fastapi.routing.APIRoute)
+    }
+    assert response_classes["/first/hello"] is fastapi.responses.ORJSONResponse
+    # The second group uses the app's default.
+    assert response_classes["/second/hello"] is not fastapi.responses.ORJSONResponse
+
+
+def test_include_router__encodes_directly():
+    router = fastapi.APIRouter()
+
+    class Item(pydantic.BaseModel):
+        name: str
+
+    @router.get("/items/{name}")
+    async def get_item(name: str) -> dict[str, Any]:
+        return {"name": name, "tags": ("a", "b")}
+
+    @router.get("/models/{name}")
+    def get_model(name: str) -> Item:
+        return Item(name=name)
+
+    @router.get("/teapot")
+    async def teapot(response: fastapi.Response) -> str:
+        response.status_code = 418
+        return "teapot"
+
+    app = fastapi.FastAPI()
+    chaos_runtime.include_router(
+        app, router, default_response_class=fastapi.responses.ORJSONResponse
+    )
+    calls = {
+        route.path: route.dependant.call
+        for route in app.router.routes
+        if isinstance(route, fastapi.routing.APIRoute)
+    }
+    assert calls["/items/{name}"] is not get_item
+    # Routes which may set their own status aren't changed.
+    assert calls["/teapot"] is teapot
+
+    async def run() -> None:
+        assert await request(app, "/items/a") == (
+            200,
+            b'{"name":"a","tags":["a","b"]}',
+        )
+        # orjson can't encode pydantic models, so they go through jsonable_encoder.
+        assert await request(app, "/models/b") == (200, b'{"name":"b"}')
+        assert await request(app, "/teapot") == (418, b'"teapot"')
+
+    asyncio.run(run())
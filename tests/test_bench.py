@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import bench
+from manifest import Endpoint
+from manifest import Group
+from manifest import Language
+from manifest import Manifest
+
+
+def make_result(path: str, requests_per_second: float, p99: float):
+    return bench.EndpointResult(
+        path=path,
+        requests=100,
+        errors=0,
+        duration=1.0,
+        requests_per_second=requests_per_second,
+        p50=p99 / 2,
+        p95=p99,
+        p99=p99,
+    )
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert bench.percentile(values, 50) == 50.0
+    assert bench.percentile(values, 99) == 99.0
+    assert bench.percentile([1.0], 99) == 1.0
+    assert bench.percentile([], 50) == 0.0
+
+
+def test_iter_bench_paths():
+    manifest = Manifest(
+        groups=[
+            Group(
+                name="test",
+                language=Language.PYTHON_3_10,
+                filename="something.py",
+                endpoints=[
+                    Endpoint(name="router", paths=["/a", "/b"]),
+                    Endpoint(name="other_router", paths=["/a"]),
+                ],
+                dependencies="requirements.txt",
+            ),
+        ],
+    )
+    assert bench.iter_bench_paths(manifest) == ["/a", "/b"]
+
+
+def test_build_batch_body():
+    assert json.loads(bench.build_batch_body(["/a", "/b?c=d"])) == [
+        {"path": "/a"},
+        {"path": "/b?c=d"},
+    ]
+
+
+def test_read_response():
+    async def read(raw_response: bytes) -> tuple[int, bytes]:
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw_response)
+        reader.feed_eof()
+        return await bench.read_response(reader)
+
+    assert asyncio.run(read(b"HTTP/1.1 200 OK\r\ncontent-length: 5\r\n\r\nhello")) == (
+        200,
+        b"hello",
+    )
+    assert asyncio.run(
+        read(
+            b"HTTP/1.1 404 Not Found\r\ntransfer-encoding: chunked\r\n\r\n"
+            b"3\r\nabc\r\n2\r\nde\r\n0\r\n\r\n"
+        )
+    ) == (404, b"abcde")
+
+
+def test_load_generator__errors_are_not_timed():
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        while request_line := await reader.readline():
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            status = b"200 OK" if b" /ok " in request_line else b"503 Unavailable"
+            writer.write(b"HTTP/1.1 %s\r\ncontent-length: 0\r\n\r\n" % status)
+            await writer.drain()
+        writer.close()
+
+    async def run() -> tuple[bench.EndpointResult, bench.EndpointResult]:
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        generator = bench.LoadGenerator("127.0.0.1", port, concurrency=2, duration=0.1)
+        async with server:
+            return await generator.drive("/ok"), await generator.drive("/shed")
+
+    ok, shed = asyncio.run(run())
+    assert ok.requests > 0 and ok.errors == 0
+    assert shed.errors > 0
+    assert (shed.requests, shed.requests_per_second, shed.p99) == (0, 0.0, 0.0)
+
+
+def test_compare():
+    baseline = {
+        "/a": make_result("/a", 1000.0, 0.010),
+        "/b": make_result("/b", 1000.0, 0.010),
+    }
+    results = [
+        make_result("/a", 950.0, 0.0105),
+        make_result("/b", 800.0, 0.020),
+        make_result("/c", 1.0, 1.0),
+    ]
+
+    regressions = bench.compare(results, baseline, threshold=0.1)
+    assert len(regressions) == 2
+    assert all(regression.startswith("/b:") for regression in regressions)
@@ -1,39 +1,74 @@
+import json
 import textwrap
 from pathlib import Path
+from typing import Optional
 from unittest import mock
 
 import pytest
 
 import buildgen
 from buildgen.common import BuildGenerator
+from buildgen.common import group_label
+from buildgen.common import Repository
 from manifest import Group
 from manifest import Language
 from manifest import Manifest
+from manifest import NamedServer
+from manifest import ServerConfig
 
 
 class MockGenerator(BuildGenerator):
     def generate_toolchain(self, language: Language) -> str:
         return f"mock_toolchain({language.format()})\n"
 
-    def generate_target_deps(self, group: Group) -> str:
-        return f"mock_target_deps_{group.name}()\n"
+    def requirements_digest(self, requirements_file: str) -> str:
+        return requirements_file
 
-    def generate_build_rules(self) -> str:
-        return "mock_build_rules()\n"
+    def merge_requirements(self, requirements_files: list[str]) -> Optional[str]:
+        if any("incompatible" in path for path in requirements_files):
+            return None
+        return "".join(f"{path}\n" for path in requirements_files)
 
-    def generate_target(self, group: Group) -> str:
-        return f"mock_target_{group.name}()\n"
+    def generate_target_deps(self, repository: Repository) -> str:
+        return f"mock_target_deps_{repository.name}({repository.requirements_file})\n"
 
-    def generate_server_target(self, groups: list[Group]) -> str:
-        rendered_group_names = ",".join(
-            group.name for group in sorted(groups, key=lambda group: group.name)
-        )
-        return f"mock_server_target({rendered_group_names})\n"
+    def generate_build_rules(self) -> str:
+        return "mock_build_rules()\n"
 
-    def generate_server(self, groups: list[Group]) -> str:
+    def generate_target(
+        self,
+        group: Group,
+        repository: Repository,
+        group_packages: bool = False,
+    ) -> str:
+        return f"mock_target_{group.name}({repository.name})\n"
+
+    def generate_server_target(
+        self,
+        groups: list[Group],
+        server: ServerConfig,
+        group_packages: bool = False,
+        name: str = "server",
+    ) -> str:
+        if group_packages:
+            rendered_group_names = ",".join(
+                group_label(group, group_packages) for group in groups
+            )
+        else:
+            rendered_group_names = ",".join(
+                group.name for group in sorted(groups, key=lambda group: group.name)
+            )
+        return f"mock_{name}_target({rendered_group_names})\n"
+
+    def generate_server(
+        self, groups: list[Group], server: ServerConfig, name: str = "server"
+    ) -> str:
         rendered_groups = ",".join(group.name for group in groups)
         return f"imports({rendered_groups})\n"
 
+    def generate_support_files(self) -> dict[Path, str]:
+        return {Path("support.py"): "support()\n"}
+
 
 @pytest.fixture
 def use_mock_generator():
@@ -60,7 +95,7 @@ def test_generate_workspace__one(use_mock_generator):
 
     mock_toolchain(python3.11)
 
-    mock_target_deps_test()
+    mock_target_deps_test(subdir/requirements.txt)
     """
     expected_workspace = textwrap.dedent(expected_workspace)
     assert workspace == expected_workspace
@@ -81,7 +116,7 @@ def test_generate_workspace__multiple(use_mock_generator):
                 language=Language.PYTHON_3_11,
                 filename="subdir/something.py",
                 endpoints=[],
-                dependencies="subdir/requirements.txt",
+                dependencies="subdir/other_requirements.txt",
             ),
         ],
     )
@@ -92,9 +127,9 @@ def test_generate_workspace__multiple(use_mock_generator):
 
     mock_toolchain(python3.11)
 
-    mock_target_deps_test()
+    mock_target_deps_test(subdir/requirements.txt)
 
-    mock_target_deps_test2()
+    mock_target_deps_test2(subdir/other_requirements.txt)
     """
     expected_workspace = textwrap.dedent(expected_workspace)
     assert workspace == expected_workspace
@@ -117,7 +152,7 @@ def test_generate_root_build__one(use_mock_generator):
     expected_root_build = """\
     mock_build_rules()
 
-    mock_target_test()
+    mock_target_test(test)
 
     mock_server_target(test)
     """
@@ -149,9 +184,9 @@ def test_generate_root_build__multiple(use_mock_generator):
     expected_root_build = """\
     mock_build_rules()
 
-    mock_target_test()
+    mock_target_test(test)
 
-    mock_target_test2()
+    mock_target_test2(test2)
 
     mock_server_target(test,test2)
     """
@@ -183,9 +218,9 @@ def test_generate_root_build__two_targets_different_language(use_mock_generator)
     expected_root_build = """\
     mock_build_rules()
 
-    mock_target_test()
+    mock_target_test(test)
 
-    mock_target_test2()
+    mock_target_test2(test2)
 
     mock_server_target(test,test2)
     """
@@ -193,6 +228,113 @@ def test_generate_root_build__two_targets_different_language(use_mock_generator)
     assert root_build == expected_root_build
 
 
+def test_generate_root_build__group_packages(use_mock_generator):
+    manifest = Manifest(
+        groups=[
+            Group(
+                name="test",
+                language=Language.PYTHON_3_11,
+                filename="something.py",
+                endpoints=[],
+                dependencies="requirements.txt",
+            ),
+            Group(
+                name="test2",
+                language=Language.PYTHON_3_11,
+                filename="subdir/something.py",
+                endpoints=[],
+                dependencies="subdir/requirements.txt",
+            ),
+            Group(
+                name="test3",
+                language=Language.PYTHON_3_11,
+                filename="subdir/other.py",
+                endpoints=[],
+                dependencies="subdir/requirements.txt",
+            ),
+        ],
+    )
+    options = buildgen.BuildOptions(group_packages=True)
+    root_build = buildgen.generate_root_build(
+        Language.PYTHON_3_11, manifest, options=options
+    )
+
+    expected_root_build = """\
+    mock_build_rules()
+
+    mock_target_test(test)
+
+    mock_server_target(:test,//subdir:test2,//subdir:test3)
+    """
+    expected_root_build = textwrap.dedent(expected_root_build)
+    assert root_build == expected_root_build
+
+    group_builds = buildgen.generate_group_builds(Language.PYTHON_3_11, manifest)
+
+    expected_group_build = """\
+    mock_build_rules()
+
+    mock_target_test2(test2)
+
+    mock_target_test3(test2)
+    """
+    expected_group_build = textwrap.dedent(expected_group_build)
+    assert group_builds == {Path("subdir"): expected_group_build}
+
+
+def make_named_servers_manifest() -> Manifest:
+    return Manifest(
+        groups=[
+            Group(
+                name=name,
+                language=Language.PYTHON_3_11,
+                filename=f"{name}.py",
+                endpoints=[],
+                dependencies="requirements.txt",
+                prefixes=prefixes,
+            )
+            for name, prefixes in [
+                ("hot", ["/hot"]),
+                ("cold", ["/cold", "/cold/archive"]),
+                ("internal", []),
+            ]
+        ],
+        servers=[
+            NamedServer("front", ["hot"], ServerConfig(port=8081)),
+            NamedServer("back", ["cold", "internal"], ServerConfig(port=8082)),
+        ],
+    )
+
+
+def test_generate_root_build__named_servers(use_mock_generator):
+    root_build = buildgen.generate_root_build(
+        Language.PYTHON_3_11, make_named_servers_manifest()
+    )
+    # Every group is still in the server with all of them.
+    assert root_build.endswith(
+        "mock_server_target(cold,hot,internal)\n\n"
+        "mock_server_front_target(hot)\n\n"
+        "mock_server_back_target(cold,internal)\n"
+    )
+
+
+def test_generate_router_config():
+    router_config = json.loads(
+        buildgen.generate_router_config(make_named_servers_manifest())
+    )
+    assert router_config == {
+        "servers": {
+            "front": {"target": "server_front", "address": "127.0.0.1:8081"},
+            "back": {"target": "server_back", "address": "127.0.0.1:8082"},
+        },
+        "routes": [
+            {"prefix": "/cold/archive", "server": "back", "group": "cold"},
+            {"prefix": "/cold", "server": "back", "group": "cold"},
+            {"prefix": "/hot", "server": "front", "group": "hot"},
+        ],
+    }
+
+
 def test_generate_export_builds__no_files():
     export_builds = buildgen.generate_export_builds(Manifest(groups=[]))
     assert export_builds == {}
@@ -230,3 +372,90 @@ def test_generate_export_builds__single_sub_dir():
     assert export_builds == {
         Path("subdir"): 'exports_files(["requirements.txt","something.py"])\n'
     }
+
+
+def test_generate_workspace__shared_lockfile(use_mock_generator):
+    manifest = Manifest(
+        groups=[
+            Group(
+                name="test",
+                language=Language.PYTHON_3_11,
+                filename="subdir/something.py",
+                endpoints=[],
+                dependencies="subdir/requirements.txt",
+            ),
+            Group(
+                name="test2",
+                language=Language.PYTHON_3_11,
+                filename="subdir/something_else.py",
+                endpoints=[],
+                dependencies="subdir/requirements.txt",
+            ),
+        ],
+    )
+    workspace = buildgen.generate_workspace(Language.PYTHON_3_11, manifest)
+
+    expected_workspace = """\
+    load("@bazel_tools//tools/build_defs/repo:http.bzl", "http_archive")
+
+    mock_toolchain(python3.11)
+
+    mock_target_deps_test(subdir/requirements.txt)
+    """
+    expected_workspace = textwrap.dedent(expected_workspace)
+    assert workspace == expected_workspace
+
+    root_build = buildgen.generate_root_build(Language.PYTHON_3_11, manifest)
+    assert "mock_target_test2(test)\n" in root_build
+
+
+def make_shared_dependencies_manifest(second_dependencies: str) -> Manifest:
+    return Manifest(
+        groups=[
+            Group(
+                name="test",
+                language=Language.PYTHON_3_11,
+                filename="something.py",
+                endpoints=[],
+                dependencies="requirements.txt",
+            ),
+            Group(
+                name="test2",
+                language=Language.PYTHON_3_11,
+                filename="subdir/something.py",
+                endpoints=[],
+                dependencies=second_dependencies,
+            ),
+        ],
+    )
+
+
+def test_plan_repositories__shared_dependencies(use_mock_generator):
+    manifest = make_shared_dependencies_manifest("subdir/requirements.txt")
+    plan = buildgen.plan_repositories(
+        Language.PYTHON_3_11,
+        manifest,
+        buildgen.BuildOptions(shared_dependencies=True),
+    )
+
+    assert plan.unique_repositories() == [buildgen.SHARED_REPOSITORY]
+    assert plan.generated_files == {
+        Path("chaos_shared_requirements.txt"): (
+            "requirements.txt\nsubdir/requirements.txt\n"
+        ),
+    }
+
+
+def test_plan_repositories__shared_dependencies_incompatible(use_mock_generator):
+    manifest = make_shared_dependencies_manifest("subdir/incompatible.txt")
+    plan = buildgen.plan_repositories(
+        Language.PYTHON_3_11,
+        manifest,
+        buildgen.BuildOptions(shared_dependencies=True),
+    )
+
+    assert plan.unique_repositories() == [
+        Repository(name="test", requirements_file="requirements.txt"),
+        Repository(name="test2", requirements_file="subdir/incompatible.txt"),
+    ]
+    assert plan.generated_files == {}
@@ -0,0 +1,344 @@
+import textwrap
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+import manifest as manifest_module
+
+from manifest import BatchConfig
+from manifest import CacheConfig
+from manifest import Endpoint
+from manifest import Group
+from manifest import Language
+from manifest import Manifest
+from manifest import ServerConfig
+from manifest import WarmupConfig
+
+
+def make_group(name: str, language: Language) -> Group:
+    return Group(
+        name=name,
+        language=language,
+        filename=f"{name}.py",
+        endpoints=[],
+        dependencies="requirements.txt",
+    )
+
+
+def test_manifest__for_language():
+    manifest = Manifest(
+        groups=[
+            make_group("a", Language.PYTHON_3_9),
+            make_group("b", Language.PYTHON_3_10),
+            make_group("c", Language.PYTHON_3_9),
+        ],
+    )
+
+    filtered = manifest.for_language(Language.PYTHON_3_9)
+    assert [group.name for group in filtered.groups] == ["a", "c"]
+    assert [group.name for group in manifest.groups] == ["a", "b", "c"]
+
+
+def test_server_config__from_dict():
+    assert ServerConfig.from_dict({}) == ServerConfig()
+
+    server = ServerConfig.from_dict({"workers": 4, "loop": "uvloop", "backlog": 100})
+    assert server.workers == 4
+    assert server.loop == "uvloop"
+    assert server.backlog == 100
+    assert server.http == "auto"
+
+
+def test_server_config__from_dict_invalid():
+    with pytest.raises(ValueError):
+        ServerConfig.from_dict({"loop": "trio"})
+
+
+def raw_group(**overrides: object) -> dict:
+    return {
+        "name": "images",
+        "language": "python3.10",
+        "filename": "images.py",
+        "endpoints": [],
+        "dependencies": "requirements.txt",
+        "prefixes": ["/images"],
+        **overrides,
+    }
+
+
+def test_group__from_dict_isolation():
+    assert Group.from_dict(raw_group()).isolation == "none"
+
+    group = Group.from_dict(raw_group(isolation="process", workers=4))
+    assert group.isolation == "process"
+    assert group.workers == 4
+
+
+def test_group__from_dict_isolation_invalid():
+    with pytest.raises(ValueError):
+        Group.from_dict(raw_group(isolation="thread"))
+    with pytest.raises(ValueError):
+        Group.from_dict(raw_group(isolation="process", prefixes=[]))
+    with pytest.raises(ValueError):
+        Group.from_dict(raw_group(isolation="process", workers=0))
+
+
+def test_manifest__from_dict_isolated_groups_need_server_workers():
+    raw_groups = [raw_group(name="hot", isolation="process", workers=2)]
+    manifest = Manifest.from_dict({"groups": raw_groups, "server": {"workers": 3}})
+    assert (manifest.server.workers, manifest.groups[0].workers) == (3, 2)
+
+    with pytest.raises(ValueError):
+        Manifest.from_dict({"groups": raw_groups})
+    with pytest.raises(ValueError):
+        Manifest.from_dict(
+            {
+                "groups": raw_groups,
+                "server": {"workers": 3},
+                "servers": [{"name": "front", "groups": ["hot"], "workers": None}],
+            }
+        )
+
+
+def test_from_dict_serializer():
+    assert ServerConfig.from_dict({"serializer": "orjson"}).serializer == "orjson"
+    assert Group.from_dict(raw_group()).serializer is None
+    assert Group.from_dict(raw_group(serializer="json")).serializer == "json"
+    with pytest.raises(ValueError):
+        ServerConfig.from_dict({"serializer": "pickle"})
+    with pytest.raises(ValueError):
+        Group.from_dict(raw_group(serializer="pickle"))
+
+
+def test_from_dict_warmup():
+    assert ServerConfig.from_dict({}).warmup is None
+    assert ServerConfig.from_dict({"warmup": {}}).warmup == WarmupConfig()
+
+    group = Group.from_dict(raw_group(warmup={"requests": 5, "hook": "warm_up"}))
+    assert group.warmup == WarmupConfig(requests=5, hook="warm_up")
+    with pytest.raises(ValueError):
+        Group.from_dict(raw_group(warmup={"requests": -1}))
+
+
+def test_group__from_dict_concurrency():
+    group = Group.from_dict(raw_group(max_concurrency=8, max_queue=16))
+    assert (group.max_concurrency, group.max_queue) == (8, 16)
+    with pytest.raises(ValueError):
+        Group.from_dict(raw_group(max_concurrency=0))
+    with pytest.raises(ValueError):
+        Group.from_dict(raw_group(max_concurrency=8, max_queue=-1))
+    with pytest.raises(ValueError):
+        Group.from_dict(raw_group(max_queue=16))
+
+
+def test_group__from_dict_threadpool_size():
+    assert Group.from_dict(raw_group()).threadpool_size is None
+    assert Group.from_dict(raw_group(threadpool_size=4)).threadpool_size == 4
+    with pytest.raises(ValueError):
+        Group.from_dict(raw_group(threadpool_size=0))
+
+
+def test_server_config__from_dict_batch():
+    assert ServerConfig.from_dict({}).batch is None
+    assert ServerConfig.from_dict({"batch": {}}).batch == BatchConfig()
+    batch = ServerConfig.from_dict({"batch": {"max_requests": 5, "timeout": 0.5}}).batch
+    assert batch == BatchConfig(max_requests=5, timeout=0.5)
+    with pytest.raises(ValueError):
+        ServerConfig.from_dict({"batch": {"max_requests": 0}})
+    with pytest.raises(ValueError):
+        ServerConfig.from_dict({"batch": {"timeout": 0}})
+
+
+def test_manifest__from_dict_servers():
+    manifest = Manifest.from_dict(
+        {
+            "groups": [raw_group(name="hot"), raw_group(name="cold", prefixes=[])],
+            "server": {"port": 8000, "workers": 2},
+            "servers": [
+                {"name": "front", "groups": ["hot"], "port": 8001},
+                {"name": "back", "groups": ["cold"]},
+            ],
+        }
+    )
+    front, back = manifest.servers
+    assert (front.name, front.target, front.groups) == (
+        "front",
+        "server_front",
+        ["hot"],
+    )
+    # Servers inherit the top-level settings.
+    assert (front.server.port, front.server.workers) == (8001, 2)
+    assert (back.server.port, back.server.workers) == (8000, 2)
+    assert [group.name for group in manifest.server_groups(back)] == ["cold"]
+
+
+def test_manifest__from_dict_servers_invalid():
+    def make_manifest(*raw_servers: dict) -> Manifest:
+        return Manifest.from_dict(
+            {
+                "groups": [raw_group(name="hot"), raw_group(name="server_x")],
+                "servers": list(raw_servers),
+            }
+        )
+
+    with pytest.raises(ValueError):
+        make_manifest({"name": "front", "groups": ["missing"]})
+    with pytest.raises(ValueError):
+        make_manifest({"name": "front", "groups": []})
+    with pytest.raises(ValueError):
+        make_manifest({"name": "front-end", "groups": ["hot"]})
+    with pytest.raises(ValueError):
+        make_manifest({"name": "x", "groups": ["hot"]})
+    with pytest.raises(ValueError):
+        make_manifest(
+            {"name": "front", "groups": ["hot"]},
+            {"name": "back", "groups": ["hot"], "port": 8081},
+        )
+    with pytest.raises(ValueError):
+        make_manifest(
+            {"name": "front", "groups": ["hot"]},
+            {"name": "front", "groups": ["server_x"]},
+        )
+    # Without their own ports, both servers would listen on the top-level port.
+    with pytest.raises(ValueError):
+        make_manifest(
+            {"name": "front", "groups": ["hot"]},
+            {"name": "back", "groups": ["server_x"]},
+        )
+    make_manifest(
+        {"name": "front", "groups": ["hot"]},
+        {"name": "back", "groups": ["server_x"], "port": 8081},
+    )
+
+
+def test_endpoint__from_dict_cache():
+    assert Endpoint.from_dict({"name": "router"}).cache is None
+
+    endpoint = Endpoint.from_dict(
+        {"name": "router", "cache": {"ttl": 30, "vary_on": ["name"]}}
+    )
+    assert endpoint.cache == CacheConfig(ttl=30, max_entries=1024, vary_on=["name"])
+
+
+def test_endpoint__from_dict_cache_invalid():
+    with pytest.raises(ValueError):
+        Endpoint.from_dict({"name": "router", "cache": {"ttl": 0}})
+    with pytest.raises(ValueError):
+        Endpoint.from_dict({"name": "router", "cache": {"ttl": 1, "max_entries": 0}})
+
+
+def test_manifest__from_dict_server():
+    manifest = Manifest.from_dict({"groups": [], "server": {"port": 9000}})
+    assert manifest.server == ServerConfig(port=9000)
+    assert Manifest.from_dict({"groups": []}).server == ServerConfig()
+
+
+def write_group_file(path: Path, *names: str) -> None:
+    raw_group = """\
+    - name: {name}
+      language: python3.10
+      filename: {name}.py
+      endpoints:
+        - name: router
+      dependencies: requirements.txt
+    """
+    raw_groups = "".join(textwrap.dedent(raw_group).format(name=name) for name in names)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("groups:\n" + textwrap.indent(raw_groups, "  "))
+
+
+def write_root_manifest(path: Path) -> None:
+    root_manifest = """\
+    include:
+      - teams/*.yaml
+    server:
+      port: 9000
+    """
+    path.write_text(textwrap.dedent(root_manifest))
+
+
+def test_manifest__load(tmp_path):
+    write_group_file(tmp_path / "manifest.yaml", "a", "b")
+    manifest = Manifest.load(tmp_path / "manifest.yaml")
+    assert [group.name for group in manifest.groups] == ["a", "b"]
+    assert manifest.sources == [tmp_path / "manifest.yaml"]
+
+
+def test_manifest__load_includes(tmp_path):
+    write_root_manifest(tmp_path / "manifest.yaml")
+    write_group_file(tmp_path / "teams" / "one.yaml", "a", "b")
+    write_group_file(tmp_path / "teams" / "two.yaml", "c")
+
+    manifest = Manifest.load(tmp_path / "manifest.yaml")
+    assert [group.name for group in manifest.groups] == ["a", "b", "c"]
+    assert manifest.server.port == 9000
+    assert manifest.sources == [
+        tmp_path / "manifest.yaml",
+        tmp_path / "teams" / "one.yaml",
+        tmp_path / "teams" / "two.yaml",
+    ]
+
+
+def test_manifest__load_includes_in_parallel(tmp_path):
+    write_root_manifest(tmp_path / "manifest.yaml")
+    for name in ("a", "b", "c"):
+        write_group_file(tmp_path / "teams" / f"{name}.yaml", name)
+
+    with mock.patch.object(manifest_module, "PARALLEL_LOAD_THRESHOLD", 2):
+        manifest = Manifest.load(tmp_path / "manifest.yaml")
+    assert [group.name for group in manifest.groups] == ["a", "b", "c"]
+
+
+def test_manifest__load_duplicate_group(tmp_path):
+    write_root_manifest(tmp_path / "manifest.yaml")
+    write_group_file(tmp_path / "teams" / "one.yaml", "a")
+    write_group_file(tmp_path / "teams" / "two.yaml", "a")
+
+    with pytest.raises(ValueError):
+        Manifest.load(tmp_path / "manifest.yaml")
+
+
+def test_manifest__load_included_server(tmp_path):
+    write_root_manifest(tmp_path / "manifest.yaml")
+    (tmp_path / "teams").mkdir()
+    (tmp_path / "teams" / "one.yaml").write_text("server:\n  port: 1234\n")
+
+    with pytest.raises(ValueError):
+        Manifest.load(tmp_path / "manifest.yaml")
+
+
+@pytest.mark.parametrize("contents", ["", "- a\n"])
+def test_manifest__load_included_not_mapping(tmp_path, contents):
+    write_root_manifest(tmp_path / "manifest.yaml")
+    (tmp_path / "teams").mkdir()
+    (tmp_path / "teams" / "one.yaml").write_text(contents)
+
+    with pytest.raises(ValueError, match="mapping"):
+        Manifest.load(tmp_path / "manifest.yaml")
+
+
+def test_manifest__load_absolute_include(tmp_path):
+    (tmp_path / "manifest.yaml").write_text(f"include:\n  - {tmp_path}/teams/*.yaml\n")
+
+    with pytest.raises(ValueError, match="relative"):
+        Manifest.load(tmp_path / "manifest.yaml")
+
+
+def test_manifest__load_cached(tmp_path):
+    cache_directory = tmp_path / "cache"
+    write_root_manifest(tmp_path / "manifest.yaml")
+    write_group_file(tmp_path / "teams" / "one.yaml", "a")
+
+    manifest = Manifest.load(tmp_path / "manifest.yaml", cache_directory)
+    with mock.patch.object(manifest_module, "load_yaml", side_effect=AssertionError):
+        assert Manifest.load(tmp_path / "manifest.yaml", cache_directory) == manifest
+
+    # Changing an included file, or adding a new one, invalidates the cache.
+    write_group_file(tmp_path / "teams" / "one.yaml", "b")
+    manifest = Manifest.load(tmp_path / "manifest.yaml", cache_directory)
+    assert [group.name for group in manifest.groups] == ["b"]
+
+    write_group_file(tmp_path / "teams" / "two.yaml", "c")
+    manifest = Manifest.load(tmp_path / "manifest.yaml", cache_directory)
+    assert [group.name for group in manifest.groups] == ["b", "c"]
@@ -0,0 +1,175 @@
+import os
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+import outputs
+from outputs import OutputDirectory
+from outputs import STATE_FILENAME
+
+
+def test_output_directory__writes_new_files(tmp_path):
+    with OutputDirectory(tmp_path) as output:
+        assert output.write_text(Path("subdir/BUILD"), "contents\n")
+
+    assert (tmp_path / "subdir" / "BUILD").read_text() == "contents\n"
+    assert (tmp_path / STATE_FILENAME).exists()
+
+
+def test_output_directory__skips_unchanged_writes(tmp_path):
+    with OutputDirectory(tmp_path) as output:
+        output.write_text(Path("BUILD"), "contents\n")
+    os.utime(tmp_path / "BUILD", ns=(0, 0))
+
+    with OutputDirectory(tmp_path) as output:
+        assert not output.write_text(Path("BUILD"), "contents\n")
+    assert (tmp_path / "BUILD").stat().st_mtime_ns == 0
+
+    with OutputDirectory(tmp_path) as output:
+        assert output.write_text(Path("BUILD"), "changed\n")
+    assert (tmp_path / "BUILD").read_text() == "changed\n"
+
+
+def test_output_directory__force_rewrites(tmp_path):
+    with OutputDirectory(tmp_path) as output:
+        output.write_text(Path("BUILD"), "contents\n")
+
+    with OutputDirectory(tmp_path, force=True) as output:
+        assert output.write_text(Path("BUILD"), "contents\n")
+
+
+def test_output_directory__skips_unchanged_copies(tmp_path):
+    source = tmp_path / "source.py"
+    source.write_text("print('hello')\n")
+    output_path = tmp_path / "out"
+
+    with OutputDirectory(output_path) as output:
+        assert output.copy(source, Path("pkg/source.py"))
+    with OutputDirectory(output_path) as output:
+        assert not output.copy(source, Path("pkg/source.py"))
+
+    source.write_text("print('goodbye')\n")
+    with OutputDirectory(output_path) as output:
+        assert output.copy(source, Path("pkg/source.py"))
+    assert (output_path / "pkg" / "source.py").read_text() == "print('goodbye')\n"
+
+
+def test_output_directory__removes_stale_outputs(tmp_path):
+    with OutputDirectory(tmp_path) as output:
+        output.write_text(Path("BUILD"), "root\n")
+        output.write_text(Path("removed/BUILD"), "removed\n")
+
+    with OutputDirectory(tmp_path) as output:
+        output.write_text(Path("BUILD"), "root\n")
+
+    assert (tmp_path / "BUILD").exists()
+    assert not (tmp_path / "removed").exists()
+
+
+def test_output_directory__keeps_outputs_on_failure(tmp_path):
+    with OutputDirectory(tmp_path) as output:
+        output.write_text(Path("BUILD"), "root\n")
+
+    try:
+        with OutputDirectory(tmp_path) as output:
+            output.write_text(Path("other/BUILD"), "other\n")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert (tmp_path / "BUILD").exists()
+
+    with OutputDirectory(tmp_path) as output:
+        output.write_text(Path("BUILD"), "root\n")
+    assert not (tmp_path / "other").exists()
+
+
+def test_output_directory__skips_unchanged_sources_without_reading(tmp_path):
+    source = tmp_path / "source.py"
+    source.write_text("print('hello')\n")
+    output_path = tmp_path / "out"
+
+    with OutputDirectory(output_path) as output:
+        output.copy(source, Path("source.py"))
+    with mock.patch.object(outputs, "digest_file", side_effect=AssertionError):
+        with OutputDirectory(output_path) as output:
+            assert not output.copy(source, Path("source.py"))
+
+
+def test_output_directory__restores_edited_copies(tmp_path):
+    source = tmp_path / "source.py"
+    source.write_text("print('hello')\n")
+    output_path = tmp_path / "out"
+
+    with OutputDirectory(output_path) as output:
+        output.copy(source, Path("source.py"))
+    # Edited by hand, without changing its size.
+    (output_path / "source.py").write_text("print('HELLO')\n")
+    with OutputDirectory(output_path) as output:
+        assert output.copy(source, Path("source.py"))
+    assert (output_path / "source.py").read_text() == "print('hello')\n"
+
+    # A staged file which was only touched is read, but not staged again.
+    os.utime(output_path / "source.py")
+    with OutputDirectory(output_path) as output:
+        assert not output.copy(source, Path("source.py"))
+    with mock.patch.object(outputs, "digest_file", side_effect=AssertionError):
+        with OutputDirectory(output_path) as output:
+            assert not output.copy(source, Path("source.py"))
+
+
+def test_output_directory__stage_modes(tmp_path):
+    source = tmp_path / "source.py"
+    source.write_text("print('hello')\n")
+
+    with OutputDirectory(tmp_path / "hardlink", stage_mode="hardlink") as output:
+        output.copy(source, Path("source.py"))
+    assert (tmp_path / "hardlink" / "source.py").samefile(source)
+
+    with OutputDirectory(tmp_path / "symlink", stage_mode="symlink") as output:
+        output.copy(source, Path("source.py"))
+    assert os.readlink(tmp_path / "symlink" / "source.py") == str(source)
+
+    # Switching modes restages the file, without writing through the old link.
+    with OutputDirectory(tmp_path / "hardlink") as output:
+        assert output.copy(source, Path("source.py"))
+    assert not (tmp_path / "hardlink" / "source.py").samefile(source)
+
+
+def test_output_directory__falls_back_to_copy(tmp_path):
+    source = tmp_path / "source.py"
+    source.write_text("print('hello')\n")
+
+    with mock.patch.object(os, "link", side_effect=OSError("cross-device link")):
+        with OutputDirectory(tmp_path / "out", stage_mode="hardlink") as output:
+            assert output.copy(source, Path("source.py"))
+    target_path = tmp_path / "out" / "source.py"
+    assert target_path.read_text() == "print('hello')\n"
+    assert not target_path.samefile(source)
+
+
+def test_output_directory__reflink_unavailable(tmp_path):
+    with mock.patch.object(outputs, "reflink_available", return_value=False):
+        with pytest.raises(ValueError):
+            OutputDirectory(tmp_path / "out", stage_mode="reflink")
+        # Every other mode works without `fcntl`.
+        with OutputDirectory(tmp_path / "out", stage_mode="copy") as output:
+            output.write_text(Path("BUILD"), "")
+
+
+def test_output_directory__copy_all_stages_duplicates_once(tmp_path):
+    source = tmp_path / "requirements.txt"
+    source.write_text("fastapi==0.87.0\n")
+    other = tmp_path / "other.py"
+    other.write_text("")
+
+    with OutputDirectory(tmp_path / "out") as output:
+        staged = output.copy_all(
+            [
+                (source, Path("requirements.txt")),
+                (other, Path("other.py")),
+                (source, Path("requirements.txt")),
+            ]
+        )
+    assert staged == [Path("requirements.txt"), Path("other.py")]
+    assert sorted(output.written) == sorted(staged)
@@ -0,0 +1,68 @@
+import json
+
+import profiling
+
+
+def test_span__disabled():
+    assert not profiling.is_enabled()
+    assert profiling.span("a") is profiling.span("b")
+    with profiling.span("a", group="echo"):
+        pass
+
+
+def test_span__enabled():
+    profiler = profiling.enable()
+    try:
+        with profiling.span("outer"):
+            with profiling.span("inner", group="echo"):
+                pass
+    finally:
+        profiling.disable()
+
+    inner, outer = profiler.events
+    assert inner["name"] == "inner"
+    assert inner["args"] == {"group": "echo"}
+    assert outer["name"] == "outer"
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+
+
+def test_profile__writes_trace(tmp_path, capsys):
+    trace_path = tmp_path / "trace.json"
+    with profiling.profile(trace_path):
+        for _ in range(3):
+            with profiling.span("render"):
+                pass
+        with profiling.span("copy"):
+            pass
+    assert not profiling.is_enabled()
+
+    raw_trace = json.loads(trace_path.read_text())
+    assert [event["name"] for event in raw_trace["traceEvents"]] == [
+        "render",
+        "render",
+        "render",
+        "copy",
+    ]
+    assert all(event["ph"] == "X" for event in raw_trace["traceEvents"])
+
+    summary = capsys.readouterr().err
+    assert "render" in summary
+    assert "copy" in summary
+
+
+def test_profile__disabled(tmp_path):
+    with profiling.profile(None):
+        assert not profiling.is_enabled()
+
+
+def test_profiler__summary_ranks_by_total_time():
+    profiler = profiling.Profiler()
+    profiler.events = [
+        {"name": "fast", "dur": 1000.0},
+        {"name": "slow", "dur": 5000.0},
+        {"name": "fast", "dur": 1000.0},
+    ]
+    _, slow, fast = profiler.summary(top=2).splitlines()
+    assert slow.split()[:2] == ["slow", "1"]
+    assert fast.split()[:2] == ["fast", "2"]
@@ -0,0 +1,105 @@
+import shutil
+import subprocess
+from unittest import mock
+
+import pytest
+
+from manifest import Language
+from virtualenvs import READY_FILENAME
+from virtualenvs import virtualenv_key
+from virtualenvs import VirtualenvCache
+
+
+@pytest.fixture(autouse=True)
+def interpreter():
+    with mock.patch.object(shutil, "which", return_value="/usr/bin/python3.10"):
+        yield
+
+
+def test_virtualenv_key(tmp_path):
+    (tmp_path / "a.txt").write_text("fastapi==0.87.0\n")
+    (tmp_path / "b.txt").write_text("somedep==1.2.3\n")
+    (tmp_path / "copy_of_b.txt").write_text("somedep==1.2.3\n")
+    lockfiles = [tmp_path / "a.txt", tmp_path / "b.txt"]
+
+    key = virtualenv_key(Language.PYTHON_3_10, lockfiles)
+    assert key == virtualenv_key(Language.PYTHON_3_10, list(reversed(lockfiles)))
+    assert key == virtualenv_key(
+        Language.PYTHON_3_10, [*lockfiles, tmp_path / "copy_of_b.txt"]
+    )
+    assert key != virtualenv_key(Language.PYTHON_3_11, lockfiles)
+
+    (tmp_path / "b.txt").write_text("somedep==1.2.4\n")
+    assert key != virtualenv_key(Language.PYTHON_3_10, lockfiles)
+
+
+def test_virtualenv_cache__reuses_virtualenv(tmp_path):
+    (tmp_path / "requirements.txt").write_text("")
+    lockfiles = [tmp_path / "requirements.txt"]
+    cache = VirtualenvCache(tmp_path / "cache")
+
+    virtualenv = tmp_path / "cache" / virtualenv_key(Language.PYTHON_3_10, lockfiles)
+
+    def create_virtualenv(args):
+        if args[1:3] == ("-m", "venv"):
+            virtualenv.mkdir()
+
+    with mock.patch.object(
+        subprocess, "check_call", side_effect=create_virtualenv
+    ) as check_call:
+        python = cache.create(Language.PYTHON_3_10, lockfiles)
+        assert check_call.call_count == 2
+        assert python == virtualenv / "bin" / "python"
+        assert (virtualenv / READY_FILENAME).exists()
+
+        assert cache.create(Language.PYTHON_3_10, lockfiles) == python
+        assert check_call.call_count == 2
+
+
+def test_virtualenv_cache__removes_failed_virtualenv(tmp_path):
+    (tmp_path / "requirements.txt").write_text("")
+    lockfiles = [tmp_path / "requirements.txt"]
+    cache = VirtualenvCache(tmp_path / "cache")
+    virtualenv = tmp_path / "cache" / virtualenv_key(Language.PYTHON_3_10, lockfiles)
+
+    def fail_install(args):
+        if args[1:3] == ("-m", "venv"):
+            virtualenv.mkdir()
+        else:
+            raise subprocess.CalledProcessError(1, args)
+
+    with mock.patch.object(subprocess, "check_call", side_effect=fail_install):
+        with pytest.raises(subprocess.CalledProcessError):
+            cache.create(Language.PYTHON_3_10, lockfiles)
+    assert not virtualenv.exists()
+
+
+def test_virtualenv_cache__conflicting_pins(tmp_path):
+    (tmp_path / "a.txt").write_text("fastapi==0.87.0\nsomedep==1.2.3\n")
+    (tmp_path / "b.txt").write_text("SomeDep==1.2.4\n")
+    (tmp_path / "c.txt").write_text("somedep==1.2.3\n")
+    cache = VirtualenvCache(tmp_path / "cache")
+
+    with mock.patch.object(subprocess, "check_call") as check_call:
+        with pytest.raises(ValueError, match="somedep"):
+            cache.create(Language.PYTHON_3_10, [tmp_path / "a.txt", tmp_path / "b.txt"])
+        assert not check_call.called
+
+        # Pinning the same version in several lockfiles is fine.
+        cache.create(Language.PYTHON_3_10, [tmp_path / "a.txt", tmp_path / "c.txt"])
+        assert check_call.called
+
+
+def test_virtualenv_cache__evict(tmp_path):
+    cache = VirtualenvCache(tmp_path / "cache")
+    for key in ("locked", "unused"):
+        with cache.lock(key):
+            cache.get(key)
+
+    # Virtualenvs which are locked (e.g. being created by another run) are left alone.
+    with VirtualenvCache(tmp_path / "cache").lock("locked"):
+        assert cache.evict(max_age=-1) == [tmp_path / "cache" / "unused"]
+    assert sorted(path.name for path in (tmp_path / "cache").iterdir()) == [
+        "locked",
+        "locked.lock",
+    ]
@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+import pytest
+
+from watch import InotifyWatcher
+from watch import PollingWatcher
+from watch import wait_for_changes
+
+
+@pytest.fixture(params=["inotify", "polling"])
+def watcher(request):
+    if request.param == "polling":
+        watcher = PollingWatcher()
+    else:
+        try:
+            watcher = InotifyWatcher()
+        except (AttributeError, OSError):
+            pytest.skip("inotify isn't available")
+    yield watcher
+    watcher.close()
+
+
+def test_watcher__modified_file(tmp_path, watcher):
+    watched = tmp_path / "watched.py"
+    watched.write_text("")
+    watcher.update([watched])
+
+    watched.write_text("print('hello')\n")
+    assert watcher.poll(5) == {watched}
+
+
+def test_watcher__replaced_file(tmp_path, watcher):
+    watched = tmp_path / "watched.py"
+    watched.write_text("")
+    watcher.update([watched])
+
+    # Like an editor which writes a new file, and then renames it over the old one.
+    (tmp_path / "watched.py.tmp").write_text("print('hello')\n")
+    os.replace(tmp_path / "watched.py.tmp", watched)
+    assert watched in watcher.poll(5)
+
+
+def test_watcher__ignores_unwatched_files(tmp_path, watcher):
+    watched = tmp_path / "watched.py"
+    watched.write_text("")
+    watcher.update([watched])
+
+    (tmp_path / "unwatched.py").write_text("")
+    assert watcher.poll(0.5) == set()
+
+
+def test_watcher__directory(tmp_path, watcher):
+    (tmp_path / "templates").mkdir()
+    watcher.update([], [tmp_path / "templates"])
+
+    (tmp_path / "templates" / "server.jinja2").write_text("")
+    assert tmp_path / "templates" / "server.jinja2" in watcher.poll(5)
+
+
+def test_wait_for_changes__debounces(tmp_path, watcher):
+    first = tmp_path / "first.py"
+    second = tmp_path / "second.py"
+    first.write_text("")
+    second.write_text("")
+    watcher.update([first, second])
+
+    def edit():
+        first.write_text("1\n")
+        time.sleep(0.1)
+        second.write_text("2\n")
+
+    thread = threading.Thread(target=edit)
+    thread.start()
+    changed, _ = wait_for_changes(watcher, debounce=0.5)
+    thread.join()
+    assert changed == {first, second}
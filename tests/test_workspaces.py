@@ -0,0 +1,101 @@
+import os
+import time
+from pathlib import Path
+
+import workspaces
+from manifest import Group
+from manifest import Language
+from manifest import Manifest
+from workspaces import workspace_key
+from workspaces import WorkspaceCache
+
+
+def make_manifest() -> Manifest:
+    return Manifest(
+        groups=[
+            Group(
+                name="test",
+                language=Language.PYTHON_3_10,
+                filename="something.py",
+                endpoints=[],
+                dependencies="test_requirements.txt",
+            ),
+        ],
+    )
+
+
+def test_workspace_key(tmp_path):
+    (tmp_path / "manifest.yaml").write_text("groups: []\n")
+    (tmp_path / "requirements.txt").write_text("fastapi==0.87.0\n")
+    (tmp_path / "test_requirements.txt").write_text("somedep==1.2.3\n")
+    manifest = make_manifest()
+
+    key = workspace_key(tmp_path / "manifest.yaml", Language.PYTHON_3_10, manifest)
+    assert key == workspace_key(
+        tmp_path / "manifest.yaml", Language.PYTHON_3_10, manifest
+    )
+    assert key != workspace_key(
+        tmp_path / "manifest.yaml", Language.PYTHON_3_9, manifest
+    )
+
+    (tmp_path / "test_requirements.txt").write_text("somedep==1.2.4\n")
+    assert key != workspace_key(
+        tmp_path / "manifest.yaml", Language.PYTHON_3_10, manifest
+    )
+
+
+def test_workspace_cache__reuses_workspace(tmp_path):
+    cache = WorkspaceCache(tmp_path)
+    workspace = cache.get("key")
+    (workspace / "WORKSPACE").write_text("")
+    assert cache.get("key") == workspace
+    assert (workspace / "WORKSPACE").exists()
+
+
+def test_workspace_cache__evicts_old_workspaces(tmp_path):
+    cache = WorkspaceCache(tmp_path)
+    old = cache.get("old")
+    new = cache.get("new")
+
+    an_hour_ago = time.time() - 60 * 60
+    os.utime(old / ".chaos_last_used", (an_hour_ago, an_hour_ago))
+
+    assert cache.evict(max_age=60) == [old]
+    assert not old.exists()
+    assert new.exists()
+
+
+def test_workspace_cache__evicts_least_recently_used(tmp_path):
+    cache = WorkspaceCache(tmp_path)
+    for i, key in enumerate(("a", "b", "c")):
+        workspace = cache.get(key)
+        (workspace / "data").write_bytes(b"x" * 100)
+        os.utime(workspace / ".chaos_last_used", (i, i))
+
+    evicted = cache.evict(max_size=250, keep="a")
+    assert evicted == [Path(tmp_path / "b")]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "c"]
+
+
+def test_workspace_cache__records_sizes(tmp_path, monkeypatch):
+    cache = WorkspaceCache(tmp_path / "cache")
+    a_minute_ago = time.time() - 60
+    for i, key in enumerate(("a", "b")):
+        workspace = cache.get(key)
+        (workspace / "data").write_bytes(b"x" * 100)
+        os.utime(workspace / ".chaos_last_used", (a_minute_ago + i, a_minute_ago + i))
+    # Without a size limit, nothing is measured.
+    assert cache.evict(max_age=60 * 60) == []
+    assert not (tmp_path / "cache" / "a" / ".chaos_size").exists()
+
+    assert cache.evict(max_size=250) == []
+    assert (tmp_path / "cache" / "a" / ".chaos_size").exists()
+
+    # Workspaces aren't walked again until they've been used since they were measured,
+    (tmp_path / "cache" / "a" / "data").write_bytes(b"x" * 200)
+    assert cache.evict(max_size=250) == []
+    # ...and even then, only once `SIZE_REFRESH_INTERVAL` has passed.
+    cache.get("a")
+    assert cache.evict(max_size=250) == []
+    monkeypatch.setattr(workspaces, "SIZE_REFRESH_INTERVAL", 0)
+    assert cache.evict(max_size=250, keep="b") == [tmp_path / "cache" / "a"]
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import IO
+from typing import Iterator
+from typing import Optional
+
+from packaging.requirements import Requirement
+from packaging.utils import canonicalize_name
+
+from buildgen.python import parse_requirements
+from manifest import Language
+from outputs import digest_file
+from workspaces import WorkspaceCache
+
+
+READY_FILENAME = ".chaos_ready"
+
+
+def virtualenv_key(language: Language, lockfiles: list[Path]) -> str:
+    """\
+    Identifies a virtualenv by the Python version and the content of its lockfiles,
+    so that manifests with the same dependencies share a virtualenv
+    no matter where their lockfiles live.
+    """
+    digest = hashlib.sha256()
+    digest.update(language.format().encode())
+    for lockfile_digest in sorted({digest_file(lockfile) for lockfile in lockfiles}):
+        digest.update(b"\0")
+        digest.update(lockfile_digest.encode())
+    return digest.hexdigest()[:32]
+
+
+def virtualenv_python(virtualenv: Path) -> Path:
+    return virtualenv / "bin" / "python"
+
+
+def check_pins(lockfiles: list[Path]) -> None:
+    """\
+    Raises if two of `lockfiles` pin the same package differently,
+    since pip can't install them into one virtualenv
+    (unlike Bazel, which installs each lockfile into its own repository).
+    """
+    pins: dict[tuple[str, str], tuple[Path, Requirement]] = {}
+    for lockfile in lockfiles:
+        for requirement in parse_requirements(lockfile.read_text()):
+            key = (canonicalize_name(requirement.name), str(requirement.marker))
+            if key not in pins:
+                pins[key] = (lockfile, requirement)
+                continue
+
+            other_lockfile, other = pins[key]
+            if other.specifier != requirement.specifier or other.url != requirement.url:
+                raise ValueError(
+                    f"{other_lockfile} pins `{other}` but {lockfile} pins `{requirement}`, "
+                    "so they can't be installed into one virtualenv. "
+                    "Pin the same version in both, or use `--runner bazel`."
+                )
+
+
+class VirtualenvCache(WorkspaceCache):
+    """\
+    Keeps a virtualenv for each combination of Python version and lockfiles,
+    so that `run --runner venv` can start a server without Bazel.
+    Virtualenvs are evicted like workspaces: by age, and then least recently used first.
+    """
+
+    def acquire(self, key: str, blocking: bool = True) -> Optional[IO[str]]:
+        """\
+        Locks the virtualenv for `key`, and returns the open lock file which holds the lock.
+        Returns `None` rather than waiting if `blocking` is false and the lock is held.
+        """
+        import fcntl
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        lock_path = self.root / f"{key}.lock"
+        while True:
+            lock_file = lock_path.open("w")
+            try:
+                fcntl.flock(
+                    lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB)
+                )
+            except BlockingIOError:
+                lock_file.close()
+                return None
+
+            # Lock files are deleted along with their virtualenvs,
+            # so a lock taken on a deleted lock file doesn't lock anything.
+            try:
+                if os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    @contextlib.contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        # Virtualenvs can't be moved once they're created,
+        # so concurrent runs wait for each other rather than building aside and renaming.
+        lock_file = self.acquire(key)
+        assert lock_file is not None
+        with lock_file:
+            yield
+
+    def remove(self, workspace: Path) -> None:
+        shutil.rmtree(workspace, ignore_errors=True)
+        (self.root / f"{workspace.name}.lock").unlink(missing_ok=True)
+
+    def remove_unused(self, workspace: Path) -> bool:
+        # A virtualenv is locked while it's created, so skip it rather than deleting it
+        # from under another run.
+        lock_file = self.acquire(workspace.name, blocking=False)
+        if lock_file is None:
+            return False
+        with lock_file:
+            self.remove(workspace)
+        return True
+
+    def create(self, language: Language, lockfiles: list[Path]) -> Path:
+        """\
+        Returns the Python interpreter of the virtualenv for `lockfiles`,
+        creating the virtualenv and installing the lockfiles into it if need be.
+        """
+        check_pins(lockfiles)
+        key = virtualenv_key(language, lockfiles)
+        with self.lock(key):
+            virtualenv = self.root / key
+            if (virtualenv / READY_FILENAME).exists():
+                self.get(key)
+                return virtualenv_python(virtualenv)
+
+            interpreter = shutil.which(language.format())
+            if interpreter is None:
+                raise FileNotFoundError(f"Can't find `{language.format()}` on PATH")
+
+            # Start over from anything a failed or interrupted run left behind.
+            # `remove` would delete the lock file too, letting another run lock a new one.
+            shutil.rmtree(virtualenv, ignore_errors=True)
+            try:
+                subprocess.check_call((interpreter, "-m", "venv", str(virtualenv)))
+                requirements_args = []
+                for lockfile in lockfiles:
+                    requirements_args.extend(("-r", str(lockfile)))
+                subprocess.check_call(
+                    (
+                        str(virtualenv_python(virtualenv)),
+                        "-m",
+                        "pip",
+                        "install",
+                        "--disable-pip-version-check",
+                        "--quiet",
+                        *requirements_args,
+                    )
+                )
+            except BaseException:
+                shutil.rmtree(virtualenv, ignore_errors=True)
+                raise
+
+            self.get(key)
+            (virtualenv / READY_FILENAME).touch()
+            return virtualenv_python(virtualenv)
@@ -0,0 +1,249 @@
+"""\
+Waits for changes to a set of files, for `main.py dev --watch`.
+
+On Linux this uses inotify, which watches the directories containing the files,
+so the cost of waiting doesn't grow with the number of files.
+Elsewhere, or if inotify isn't available, the files are polled.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from abc import ABC
+from abc import abstractmethod
+from pathlib import Path
+from typing import Iterable
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+# From <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Editors save files in all sorts of ways (in place, or by renaming a new file over
+# the old one), so watch for every way that a file's content can change.
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+)
+
+# struct inotify_event: wd, mask, cookie, len, and then `len` bytes of name.
+INOTIFY_EVENT = struct.Struct("iIII")
+
+POLL_INTERVAL = 0.25
+
+
+class Watcher(ABC):
+    """\
+    Watches a set of files, and every file under a set of directories.
+    """
+
+    def __init__(self) -> None:
+        self.files: set[Path] = set()
+        self.directories: set[Path] = set()
+
+    def update(self, files: Iterable[Path], directories: Iterable[Path] = ()) -> None:
+        """\
+        Replaces the watched files and directories.
+        """
+        self.files = {Path(os.path.abspath(path)) for path in files}
+        self.directories = {Path(os.path.abspath(path)) for path in directories}
+
+    def is_watched(self, path: Path) -> bool:
+        if path in self.files:
+            return True
+        return any(
+            directory == path or directory in path.parents
+            for directory in self.directories
+        )
+
+    @abstractmethod
+    def poll(self, timeout: Optional[float]) -> set[Path]:
+        """\
+        Waits up to `timeout` seconds (or forever, if `None`) for changes,
+        and returns the watched paths which changed.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher(Watcher):
+    def __init__(self) -> None:
+        super().__init__()
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.libc.inotify_init1.argtypes = [ctypes.c_int]
+        self.libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise self._error()
+        self.watches: dict[int, Path] = {}
+        self.watched_directories: set[Path] = set()
+
+    def _error(self) -> OSError:
+        errno = ctypes.get_errno()
+        return OSError(errno, os.strerror(errno))
+
+    def _add_watch(self, directory: Path) -> None:
+        if directory in self.watched_directories:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            logger.warning("Can't watch %s: %s", directory, self._error())
+            return
+        self.watches[wd] = directory
+        self.watched_directories.add(directory)
+
+    def update(self, files: Iterable[Path], directories: Iterable[Path] = ()) -> None:
+        super().update(files, directories)
+        # inotify watches directories, so that files which are replaced
+        # (rather than written in place) are still seen.
+        for path in self.files:
+            self._add_watch(path.parent)
+        for directory in self.directories:
+            for dirpath, _, _ in os.walk(directory):
+                self._add_watch(Path(dirpath))
+
+    def poll(self, timeout: Optional[float]) -> set[Path]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, so assume that everything changed.
+                changed.update(self.files, self.directories)
+                continue
+
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.is_watched(path):
+                    self._add_watch(path)
+                continue
+            if self.is_watched(path):
+                changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher(Watcher):
+    """\
+    Compares the size and mtime of every watched file every `POLL_INTERVAL` seconds.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.snapshot: dict[Path, Optional[tuple[int, int]]] = {}
+
+    def take_snapshot(self) -> dict[Path, Optional[tuple[int, int]]]:
+        paths = set(self.files)
+        for directory in self.directories:
+            for dirpath, _, filenames in os.walk(directory):
+                paths.update(Path(dirpath) / filename for filename in filenames)
+
+        snapshot: dict[Path, Optional[tuple[int, int]]] = {}
+        for path in paths:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                snapshot[path] = None
+            else:
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def update(self, files: Iterable[Path], directories: Iterable[Path] = ()) -> None:
+        super().update(files, directories)
+        self.snapshot = self.take_snapshot()
+
+    def poll(self, timeout: Optional[float]) -> set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.take_snapshot()
+            changed = {
+                path
+                for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            if changed:
+                return changed
+
+            if deadline is None:
+                time.sleep(POLL_INTERVAL)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return set()
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+
+def make_watcher(polling: bool = False) -> Watcher:
+    if not polling:
+        try:
+            return InotifyWatcher()
+        except (AttributeError, OSError):
+            # AttributeError: libc has no inotify (e.g. on macOS).
+            logger.info("inotify isn't available, polling for changes instead")
+    return PollingWatcher()
+
+
+def wait_for_changes(watcher: Watcher, debounce: float) -> tuple[set[Path], float]:
+    """\
+    Waits for at least one change, and then for `debounce` seconds without a change,
+    so that a burst of changes (like saving several files at once) is handled once.
+    Returns the changed paths, and when the first of them was seen
+    (by `time.perf_counter`).
+    """
+    changed = watcher.poll(None)
+    while not changed:
+        changed = watcher.poll(None)
+    first_seen = time.perf_counter()
+
+    while True:
+        more_changes = watcher.poll(debounce)
+        if not more_changes:
+            return changed, first_seen
+        changed |= more_changes
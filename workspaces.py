@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import subprocess
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from manifest import Language
+from manifest import Manifest
+from outputs import digest_file
+
+
+LAST_USED_FILENAME = ".chaos_last_used"
+SIZE_FILENAME = ".chaos_size"
+# Measuring a workspace walks every one of its files (and Bazel's), so a workspace
+# which has been used since it was measured is measured again at most this often.
+SIZE_REFRESH_INTERVAL = 60 * 60
+
+
+def requirement_lockfiles(manifest: Manifest, language: Language) -> list[Path]:
+    """\
+    The lockfiles of the server and of every group for `language`,
+    relative to the current directory.
+    """
+    lockfiles = {Path("requirements.txt")}
+    for group in manifest.groups:
+        if group.language == language:
+            lockfiles.add(Path(group.dependencies))
+    return sorted(lockfiles)
+
+
+def workspace_key(manifest_path: Path, language: Language, manifest: Manifest) -> str:
+    """\
+    Identifies the workspace for a manifest and a target language.
+    Changes to the manifest or to any of the requirement lockfiles produce a new key,
+    while changes to endpoint sources are left to the incremental regeneration.
+    """
+    digest = hashlib.sha256()
+    digest.update(language.format().encode())
+    for source in dict.fromkeys([manifest_path, *manifest.sources]):
+        digest.update(b"\0")
+        digest.update(source.read_bytes())
+
+    cwd = Path.cwd()
+    for lockfile in requirement_lockfiles(manifest, language):
+        digest.update(b"\0")
+        digest.update(lockfile.as_posix().encode())
+        digest.update(b"\0")
+        digest.update(digest_file(cwd / lockfile).encode())
+
+    return digest.hexdigest()[:32]
+
+
+def bazel_output_base(workspace: Path) -> Optional[Path]:
+    # `bazel-out` points into `<output_base>/execroot/<workspace name>/bazel-out`.
+    bazel_out = workspace / "bazel-out"
+    if not bazel_out.is_symlink():
+        return None
+    return bazel_out.resolve().parent.parent.parent
+
+
+def directory_size(path: Path) -> int:
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+@dataclass
+class CachedWorkspace:
+    path: Path
+    last_used: float
+    # In bytes, including the workspace's Bazel output base. `None` if it wasn't measured.
+    size: Optional[int]
+
+
+class WorkspaceCache:
+    """\
+    Keeps generated workspaces around between invocations of `run`,
+    so that Bazel can reuse its toolchain and `pip_parse` repositories.
+
+    Bazel keys its output base by the absolute path of the workspace,
+    so handing out a stable path per workspace key is all that's needed
+    to keep Bazel's caches warm.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def get(self, key: str) -> Path:
+        workspace = self.root / key
+        workspace.mkdir(parents=True, exist_ok=True)
+        (workspace / LAST_USED_FILENAME).touch()
+        return workspace
+
+    def size(self, workspace: Path, last_used: float) -> int:
+        """\
+        Returns the size recorded for `workspace`, measuring it again if there isn't one,
+        or if the workspace has been used since and `SIZE_REFRESH_INTERVAL` has passed.
+        """
+        size_path = workspace / SIZE_FILENAME
+        try:
+            measured = size_path.stat().st_mtime
+            if last_used <= measured or time.time() - measured < SIZE_REFRESH_INTERVAL:
+                return int(size_path.read_text())
+        except (FileNotFoundError, ValueError):
+            pass
+
+        size = directory_size(workspace)
+        output_base = bazel_output_base(workspace)
+        if output_base is not None:
+            size += directory_size(output_base)
+        try:
+            size_path.write_text(f"{size}\n")
+        except OSError:
+            # The size is measured again next time.
+            pass
+        return size
+
+    def entries(self, measure: bool = True) -> list[CachedWorkspace]:
+        if not self.root.is_dir():
+            return []
+
+        workspaces = []
+        for workspace in self.root.iterdir():
+            if not workspace.is_dir():
+                continue
+
+            try:
+                last_used = (workspace / LAST_USED_FILENAME).stat().st_mtime
+            except FileNotFoundError:
+                last_used = workspace.stat().st_mtime
+
+            size = self.size(workspace, last_used) if measure else None
+            workspaces.append(CachedWorkspace(workspace, last_used, size))
+        return workspaces
+
+    def remove(self, workspace: Path) -> None:
+        if bazel_output_base(workspace) is not None:
+            # The output base lives outside of the workspace, so let Bazel clean it up.
+            subprocess.call(
+                ("bazelisk", "clean", "--expunge"),
+                cwd=workspace,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    def remove_unused(self, workspace: Path) -> bool:
+        """\
+        Removes an evicted workspace unless it's in use, and returns whether it was removed.
+        """
+        self.remove(workspace)
+        return True
+
+    def evict(
+        self,
+        max_size: Optional[int] = None,
+        max_age: Optional[float] = None,
+        keep: Optional[str] = None,
+    ) -> list[Path]:
+        """\
+        Removes workspaces which haven't been used in `max_age` seconds,
+        and then the least recently used workspaces until the cache fits in `max_size` bytes.
+        The workspace for `keep` is never removed, and neither are workspaces in use.
+        """
+        now = time.time()
+        workspaces = sorted(
+            self.entries(measure=max_size is not None),
+            key=lambda workspace: workspace.last_used,
+        )
+
+        evicted = []
+        remaining = []
+        for workspace in workspaces:
+            if workspace.path.name == keep:
+                remaining.append(workspace)
+            elif max_age is not None and now - workspace.last_used > max_age:
+                evicted.append(workspace)
+            else:
+                remaining.append(workspace)
+
+        if max_size is not None:
+            total_size = sum(workspace.size or 0 for workspace in remaining)
+            for workspace in list(remaining):
+                if total_size <= max_size:
+                    break
+                if workspace.path.name == keep:
+                    continue
+                remaining.remove(workspace)
+                evicted.append(workspace)
+                total_size -= workspace.size or 0
+
+        return [
+            workspace.path
+            for workspace in evicted
+            if self.remove_unused(workspace.path)
+        ]